@@ -0,0 +1,175 @@
+# benchmarks/generate_dvf.py
+"""
+Générateur de fichiers DVF synthétiques (schéma geo-dvf complet).
+
+Produit un CSV de 10k à 10M lignes avec une répartition réaliste : quelques
+grosses communes (Bordeaux, Mérignac, Pessac...) concentrent l'essentiel des
+ventes, chaque commune a ses codes postaux, une bonne partie des lignes sont
+des dépendances, terrains ou locaux (éliminées au nettoyage), et certaines
+mutations regroupent plusieurs lots sous le même id_mutation.
+
+    python benchmarks/generate_dvf.py 1000000 dvf_synth.csv
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dvf_communes import registry  # noqa: E402
+
+# En-tête complet des fichiers geo-dvf
+COLONNES_GEO_DVF = [
+    "id_mutation", "date_mutation", "numero_disposition", "nature_mutation", "valeur_fonciere",
+    "adresse_numero", "adresse_suffixe", "adresse_nom_voie", "adresse_code_voie", "code_postal",
+    "code_commune", "nom_commune", "code_departement", "ancien_code_commune", "ancien_nom_commune",
+    "id_parcelle", "ancien_id_parcelle", "numero_volume",
+    "lot1_numero", "lot1_surface_carrez", "lot2_numero", "lot2_surface_carrez",
+    "lot3_numero", "lot3_surface_carrez", "lot4_numero", "lot4_surface_carrez",
+    "lot5_numero", "lot5_surface_carrez", "nombre_lots", "code_type_local", "type_local",
+    "surface_reelle_bati", "nombre_pieces_principales", "code_nature_culture", "nature_culture",
+    "code_nature_culture_speciale", "nature_culture_speciale", "surface_terrain",
+    "longitude", "latitude",
+]
+
+# Types de lignes DVF et leur fréquence approximative dans le fichier brut
+TYPES = ["Maison", "Appartement", "Dépendance", "Local industriel. commercial ou assimilé", ""]
+TYPES_P = [0.22, 0.18, 0.25, 0.05, 0.30]
+CODES_TYPES = {"Maison": "1", "Appartement": "2", "Dépendance": "3",
+               "Local industriel. commercial ou assimilé": "4", "": ""}
+
+# Communes les plus actives et leur poids relatif (les autres suivent une loi de Zipf)
+GROSSES_COMMUNES = {"Bordeaux": 12.0, "Mérignac": 4.0, "Pessac": 3.5, "Talence": 2.5,
+                    "Villenave-d'Ornon": 1.5, "Bègles": 1.5, "Le Bouscat": 1.0}
+
+# Emprise approximative de la Gironde
+LAT_MIN, LAT_MAX = 44.2, 45.6
+LON_MIN, LON_MAX = -1.3, 0.3
+
+BLOC = 500_000
+
+
+def communes_profile(seed: int = 0) -> pd.DataFrame:
+    """
+    Une ligne par commune : poids de tirage, codes postaux, centre et prix de référence.
+    """
+    rng = np.random.default_rng(seed)
+    communes = registry().communes
+    codes = sorted(communes)
+    noms = [communes[c].nom for c in codes]
+    zipf = 1.0 / np.arange(1, len(codes) + 1) ** 1.1
+    rng.shuffle(zipf)
+    poids = np.array([GROSSES_COMMUNES.get(n, z) for n, z in zip(noms, zipf)])
+
+    # Codes postaux et centres du référentiel (tirés au hasard quand ils manquent)
+    postaux = []
+    for i, code in enumerate(codes):
+        if communes[code].codes_postaux:
+            postaux.append(list(communes[code].codes_postaux))
+        else:
+            base = 33000 + 10 * rng.integers(1, 99)
+            postaux.append([str(base + 10 * k) for k in range(1 + (poids[i] > 2.0))])
+    latitude = np.array([communes[c].latitude if communes[c].latitude is not None else np.nan for c in codes])
+    longitude = np.array([communes[c].longitude if communes[c].longitude is not None else np.nan for c in codes])
+    sans_centre = np.isnan(latitude) | np.isnan(longitude)
+    latitude[sans_centre] = rng.uniform(LAT_MIN, LAT_MAX, sans_centre.sum())
+    longitude[sans_centre] = rng.uniform(LON_MIN, LON_MAX, sans_centre.sum())
+
+    return pd.DataFrame({
+        "code_commune": codes,
+        "nom_commune": noms,
+        "poids": poids / poids.sum(),
+        "codes_postaux": postaux,
+        "latitude": latitude,
+        "longitude": longitude,
+        # Prix de référence au m² : plus élevé dans les communes actives (métropole)
+        "prix_m2_ref": 1800 + 2800 * np.sqrt(poids / poids.max()) * rng.uniform(0.7, 1.2, len(codes)),
+    })
+
+
+def generate_block(n: int, profil: pd.DataFrame, rng: np.random.Generator, annee: int, id_depart: int) -> pd.DataFrame:
+    """
+    Génère `n` lignes DVF synthétiques.
+    """
+    # Mutations de 1 à 4 lignes (lots) partageant id, date, commune et valeur foncière
+    tailles = rng.choice([1, 2, 3, 4], size=n, p=[0.6, 0.25, 0.1, 0.05])
+    tailles = tailles[np.cumsum(tailles) <= n]
+    reste = n - tailles.sum()
+    tailles = np.append(tailles, [1] * reste).astype(int)
+    mutation = np.repeat(np.arange(len(tailles)), tailles)
+
+    m = len(tailles)
+    ic = rng.choice(len(profil), size=m, p=profil["poids"].to_numpy())[mutation]
+    commune = profil.iloc[ic]
+    types = rng.choice(TYPES, size=n, p=TYPES_P)
+    surface = np.where(types == "Maison", rng.gamma(9, 12, n),
+                       np.where(types == "Appartement", rng.gamma(4, 14, n), np.nan))
+    surface = np.round(surface)
+    prix_m2 = commune["prix_m2_ref"].to_numpy() * rng.lognormal(0, 0.35, n)
+    valeur_lot = np.where(np.isnan(surface), rng.lognormal(10.5, 1.0, n), surface * prix_m2)
+    # Valeur foncière répétée sur toutes les lignes de la mutation (comme dans DVF)
+    valeur = pd.Series(valeur_lot).groupby(mutation).transform("sum").round(2).to_numpy()
+    # Quelques valeurs aberrantes (ventes symboliques, erreurs de saisie)
+    aberrant = rng.random(n) < 0.01
+    valeur = np.where(aberrant, rng.choice([1.0, 15.0, 1e7], n), valeur)
+
+    jours = rng.integers(0, 365, size=m)[mutation]
+    dates = (np.datetime64(f"{annee}-01-01") + jours.astype("timedelta64[D]")).astype(str)
+    postal = [cps[k % len(cps)] for cps, k in zip(commune["codes_postaux"], rng.integers(0, 5, n))]
+
+    df = pd.DataFrame({c: "" for c in COLONNES_GEO_DVF}, index=range(n))
+    df["id_mutation"] = [f"{annee}-{id_depart + k}" for k in mutation]
+    df["date_mutation"] = dates
+    df["numero_disposition"] = "000001"
+    df["nature_mutation"] = rng.choice(["Vente", "Vente en l'état futur d'achèvement", "Echange"], m, p=[0.93, 0.05, 0.02])[mutation]
+    df["valeur_fonciere"] = valeur
+    df["adresse_numero"] = rng.integers(1, 250, n)
+    df["adresse_nom_voie"] = rng.choice([f"RUE {i}" for i in range(400)], n)
+    df["code_postal"] = postal
+    df["code_commune"] = commune["code_commune"].to_numpy()
+    df["nom_commune"] = commune["nom_commune"].to_numpy()
+    df["code_departement"] = "33"
+    df["id_parcelle"] = [f"{c}000AB{k:04d}" for c, k in zip(df["code_commune"], rng.integers(0, 9999, n))]
+    df["nombre_lots"] = tailles[mutation] - 1
+    df["code_type_local"] = [CODES_TYPES[t] for t in types]
+    df["type_local"] = types
+    df["surface_reelle_bati"] = surface
+    df["nombre_pieces_principales"] = np.where(np.isnan(surface), np.nan, np.clip(np.round(surface / 22), 1, 12))
+    df["surface_terrain"] = np.where(types == "Appartement", np.nan, np.round(rng.lognormal(6.3, 1.0, n)))
+    df["latitude"] = np.round(commune["latitude"].to_numpy() + rng.normal(0, 0.015, n), 6)
+    df["longitude"] = np.round(commune["longitude"].to_numpy() + rng.normal(0, 0.02, n), 6)
+    # Environ 2 % de lignes non géolocalisées
+    sans_geo = rng.random(n) < 0.02
+    df.loc[sans_geo, ["latitude", "longitude"]] = np.nan
+    return df, m
+
+
+def generate(n_rows: int, path: str, seed: int = 0, annee: int = 2024) -> str:
+    """
+    Écrit un CSV DVF synthétique de `n_rows` lignes dans `path` (par blocs de BLOC lignes).
+    """
+    rng = np.random.default_rng(seed)
+    profil = communes_profile(seed)
+    id_depart = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        ecrites = 0
+        while ecrites < n_rows:
+            n = min(BLOC, n_rows - ecrites)
+            bloc, m = generate_block(n, profil, rng, annee, id_depart)
+            bloc.to_csv(f, index=False, header=(ecrites == 0))
+            ecrites += n
+            id_depart += m
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Génère un fichier DVF synthétique")
+    parser.add_argument("rows", type=int, help="nombre de lignes (10k à 10M)")
+    parser.add_argument("output", nargs="?", default="dvf_synth.csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--annee", type=int, default=2024)
+    args = parser.parse_args()
+    print(f"{generate(args.rows, args.output, args.seed, args.annee)} : {args.rows} lignes")
@@ -0,0 +1,316 @@
+# benchmarks/run_benchmarks.py
+"""
+Banc de mesure des chemins de chargement, filtrage et rendu des dashboards.
+
+Chaque étape (lecture, nettoyage, sélection de commune, filtres, KPIs,
+construction des figures) est chronométrée sur un fichier DVF synthétique
+(voir generate_dvf.py) ; le pic mémoire est suivi avec tracemalloc et le RSS
+maximal du processus. Les résultats sont écrits en JSON pour comparer deux
+révisions :
+
+    python benchmarks/run_benchmarks.py --rows 1000000 --output avant.json
+    python benchmarks/run_benchmarks.py --rows 1000000 --output apres.json --compare avant.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+import plotly.express as px  # noqa: E402
+
+from benchmarks.generate_dvf import generate  # noqa: E402
+from dvf_charts import price_histogram, summarize_rows, type_pie  # noqa: E402
+from dvf_cube import build_cube, query_cube  # noqa: E402
+from dvf_data import (clean_dvf, compact_dtypes, convert_csv_to_parquet, dedupe_mutations,  # noqa: E402
+                      flag_outliers, load_clean_streaming, parquet_path_for, partition_by_commune, read_dvf)
+from dvf_filters import FilterEngine  # noqa: E402
+from dvf_map import hex_aggregate  # noqa: E402
+from dvf_spatial import SpatialIndex, add_cell_keys, comparables, project  # noqa: E402
+
+# Nombre d'états de filtres simulés (interactions successives dans la barre latérale)
+N_INTERACTIONS = 50
+
+
+class Bench:
+    """
+    Collecte des mesures : une entrée par étape (durée, pic mémoire, volume traité).
+    """
+
+    def __init__(self, tracemalloc_actif: bool = True):
+        self.tracemalloc_actif = tracemalloc_actif
+        self.results = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **infos):
+        if self.tracemalloc_actif:
+            tracemalloc.start()
+        debut = time.perf_counter()
+        mesure = dict(infos)
+        try:
+            yield mesure
+        finally:
+            duree = time.perf_counter() - debut
+            pic = tracemalloc.get_traced_memory()[1] if self.tracemalloc_actif else None
+            if self.tracemalloc_actif:
+                tracemalloc.stop()
+            mesure.update({
+                "stage": name,
+                "seconds": round(duree, 6),
+                "peak_mb": round(pic / 2**20, 2) if pic is not None else None,
+                "maxrss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            })
+            self.results.append(mesure)
+            print(f"{name:<28} {duree:9.3f} s" + (f" {pic / 2**20:9.1f} Mo" if pic is not None else ""))
+
+
+def _revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=RACINE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "inconnue"
+
+
+def _filter_states(engine: FilterEngine, rng: np.random.Generator):
+    """
+    Suite d'états de filtres où un seul widget change à chaque interaction.
+    """
+    etat = {"codes_postaux": list(engine.codes_postaux), "type_local": "Tous",
+            "prix_min": 0, "prix_max": engine.prix_max}
+    for _ in range(N_INTERACTIONS):
+        widget = rng.integers(0, 3)
+        etat = dict(etat)
+        if widget == 0:
+            k = int(rng.integers(1, len(engine.codes_postaux) + 1))
+            etat["codes_postaux"] = list(rng.choice(engine.codes_postaux, k, replace=False))
+        elif widget == 1:
+            etat["type_local"] = str(rng.choice(["Tous", "Maison", "Appartement"]))
+        else:
+            etat["prix_min"] = float(rng.choice([0, 50_000, 100_000, 200_000]))
+            etat["prix_max"] = float(rng.choice([engine.prix_max, 300_000, 500_000, 1_000_000]))
+        yield etat
+
+
+def _naive_filter(df, codes_postaux, type_local, prix_min, prix_max):
+    df_filtre = df[
+        (df['code_postal'].astype(str).isin(codes_postaux)) &
+        (df['valeur_fonciere'] >= prix_min) &
+        (df['valeur_fonciere'] <= prix_max)
+    ].copy()
+    if type_local != 'Tous':
+        df_filtre = df_filtre[df_filtre['type_local'] == type_local]
+    return df_filtre
+
+
+def run(csv_path: str, bench: Bench, baseline: bool = True):
+    rng = np.random.default_rng(0)
+    taille_mo = os.path.getsize(csv_path) / 2**20
+
+    # --- Ingestion ---
+    if baseline:
+        with bench.stage("ingest_read_csv_full", file_mb=round(taille_mo, 1)) as m:
+            brut = pd.read_csv(csv_path, sep=',', low_memory=False)
+            m["rows"] = len(brut)
+        del brut
+
+    parquet = parquet_path_for(csv_path)
+    if os.path.exists(parquet):
+        os.remove(parquet)
+    with bench.stage("ingest_convert_parquet", file_mb=round(taille_mo, 1)):
+        convert_csv_to_parquet(csv_path)
+    with bench.stage("ingest_read_parquet") as m:
+        brut = read_dvf(csv_path)
+        m["rows"] = len(brut)
+
+    # --- Nettoyage ---
+    with bench.stage("clean") as m:
+        df = clean_dvf(brut)
+        m["rows"] = len(df)
+    del brut
+    with bench.stage("dedupe_mutations", rows=len(df)) as m:
+        df = compact_dtypes(dedupe_mutations(df))
+        m["rows_out"] = len(df)
+        m["frame_mb"] = round(df.memory_usage(deep=True).sum() / 2**20, 2)
+    for methode in ("iqr", "mad"):
+        with bench.stage(f"outliers_{methode}", rows=len(df)) as m:
+            m["flagged"] = int(flag_outliers(df, methode)[0]["aberrant"].sum())
+    df, _ = flag_outliers(df)
+    with bench.stage("spatial_keys", rows=len(df)):
+        df = add_cell_keys(df)
+    with bench.stage("clean_streaming") as m:
+        m["rows"] = len(load_clean_streaming(csv_path))
+
+    # --- Sélection de commune ---
+    with bench.stage("partition") as m:
+        partitions = partition_by_commune(df)
+        m["communes"] = len(partitions)
+    codes = list(partitions)
+    tirages = rng.choice(codes, 100)
+    with bench.stage("commune_select_lookup", lookups=len(tirages)):
+        for code in tirages:
+            partitions.get(code)
+    if baseline:
+        with bench.stage("commune_select_scan", lookups=len(tirages)):
+            for code in tirages:
+                df[df['code_commune'] == code].copy()
+
+    # La plus grosse commune sert aux étapes suivantes (cas le plus lent)
+    code_max = max(partitions, key=lambda c: len(partitions[c]))
+    commune = partitions[code_max]
+
+    # --- Filtres ---
+    with bench.stage("filter_engine_build", rows=len(commune)):
+        engine = FilterEngine(commune)
+    etats = list(_filter_states(engine, rng))
+    with bench.stage("filter_incremental", interactions=len(etats)):
+        for etat in etats:
+            engine.select(**etat)
+    if baseline:
+        with bench.stage("filter_naive", interactions=len(etats)):
+            for etat in etats:
+                _naive_filter(commune, **etat)
+
+    # --- KPIs ---
+    with bench.stage("cube_build", rows=len(commune)) as m:
+        cube = build_cube(commune)
+        m["cells"] = len(cube["cells"])
+    etats_cube = [dict(e, prix_min=0, prix_max=engine.prix_max) for e in etats]
+    with bench.stage("kpi_cube", interactions=len(etats_cube)):
+        for etat in etats_cube:
+            query_cube(cube, **etat)
+    with bench.stage("kpi_raw", interactions=len(etats_cube)):
+        for etat in etats_cube:
+            d = engine.select(**etat)
+            d['prix_m2'].mean(), d['valeur_fonciere'].median(), len(d), d['surface_reelle_bati'].mean()
+
+    # --- Tableau des transactions ---
+    with bench.stage("table_page", interactions=len(etats)):
+        for etat in etats:
+            engine.page(etat, "date_mutation", True, 0, 100)
+    if baseline:
+        with bench.stage("table_sort_full", interactions=len(etats)):
+            for etat in etats:
+                engine.select(**etat).sort_values('date_mutation', ascending=False).head(100)
+
+    # --- Biens comparables : index spatial contre distance à toutes les ventes ---
+    with bench.stage("spatial_index_build", rows=len(commune)):
+        index = SpatialIndex(commune)
+    localisees = commune[commune["latitude"].notna()]
+    points = localisees.sample(N_INTERACTIONS, replace=True, random_state=0)
+    with bench.stage("comparables_index", interactions=len(points)):
+        for p in points.itertuples():
+            comparables(commune, index, p.latitude, p.longitude, p.type_local, p.surface_reelle_bati)
+    if baseline:
+        x, y = project(commune["latitude"], commune["longitude"])
+        with bench.stage("comparables_brute_force", interactions=len(points)):
+            for p in points.itertuples():
+                px_, py_ = project(p.latitude, p.longitude)
+                garde = ((commune["type_local"] == p.type_local).to_numpy()
+                         & commune["surface_reelle_bati"].between(0.75 * p.surface_reelle_bati,
+                                                                  1.25 * p.surface_reelle_bati).to_numpy()
+                         & ~commune["aberrant"].to_numpy())
+                distances = np.where(garde, np.hypot(x - px_, y - py_), np.inf)
+                commune.iloc[np.argsort(distances)[:20]]
+
+    # --- Moteur DuckDB (optionnel) : sélection de commune poussée sur le Parquet ---
+    try:
+        from dvf_duckdb import DuckDbSource
+        source = DuckDbSource(csv_path)
+    except ImportError:
+        source = None
+    if source is not None:
+        with bench.stage("duckdb_prepare"):
+            source.prepare()
+        with bench.stage("duckdb_commune_select", lookups=len(tirages)):
+            for code in tirages:
+                source.query("SELECT * FROM dvf WHERE code_commune = ?", [code])
+
+    # --- Figures ---
+    with bench.stage("figure_histogram", rows=len(commune)) as m:
+        fig = px.histogram(commune, x='prix_m2', nbins=50, color='type_local', marginal="box")
+        m["json_bytes"] = len(fig.to_json())
+    with bench.stage("figure_pie", rows=len(commune)) as m:
+        fig = px.pie(commune, names='type_local', title='Répartition par type')
+        m["json_bytes"] = len(fig.to_json())
+    # Figures légères : seuls les résumés calculés avec NumPy sont envoyés à Plotly
+    with bench.stage("figure_summary", rows=len(commune)):
+        graphique = summarize_rows(commune)
+    with bench.stage("figure_histogram_binned", rows=len(commune)) as m:
+        m["json_bytes"] = len(price_histogram(graphique).to_json())
+    with bench.stage("figure_pie_counts", rows=len(commune)) as m:
+        m["json_bytes"] = len(type_pie(graphique["types"]).to_json())
+    with bench.stage("map_hexbin", rows=len(commune)) as m:
+        grille = hex_aggregate(commune, 11)
+        m["cells"] = len(grille["cells"])
+        m["json_bytes"] = len(json.dumps(grille["geojson"]))
+
+
+def compare(courant: dict, reference: dict):
+    """
+    Affiche les écarts de durée et de pic mémoire par étape entre deux fichiers de résultats.
+    """
+    ref = {r["stage"]: r for r in reference["results"]}
+    print(f"\n{'étape':<28} {'réf (s)':>9} {'actuel (s)':>10} {'ratio':>7} {'pic réf':>9} {'pic act.':>9}")
+    for r in courant["results"]:
+        avant = ref.get(r["stage"])
+        if avant is None:
+            continue
+        ratio = r["seconds"] / avant["seconds"] if avant["seconds"] else float("nan")
+        print(f"{r['stage']:<28} {avant['seconds']:9.3f} {r['seconds']:10.3f} {ratio:7.2f} "
+              f"{avant.get('peak_mb') or 0:9.1f} {r.get('peak_mb') or 0:9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Banc de mesure des dashboards DVF")
+    parser.add_argument("--rows", type=int, default=100_000, help="taille du fichier synthétique")
+    parser.add_argument("--csv", help="fichier DVF existant (sinon un fichier synthétique est généré)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="fichier de résultats de référence")
+    parser.add_argument("--no-baseline", action="store_true", help="ne pas mesurer les anciens chemins (lents)")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="durées seules, sans suivi mémoire")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bench = Bench(tracemalloc_actif=not args.no_tracemalloc)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = args.csv
+        if csv_path is None:
+            csv_path = os.path.join(tmp, "dvf_synth.csv")
+            print(f"Génération de {args.rows} lignes synthétiques...")
+            generate(args.rows, csv_path, seed=args.seed)
+        run(csv_path, bench, baseline=not args.no_baseline)
+
+    resultats = {
+        "meta": {
+            "revision": _revision(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "rows": args.rows if args.csv is None else None,
+            "csv": args.csv,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "tracemalloc": not args.no_tracemalloc,
+        },
+        "results": bench.results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(resultats, f, indent=2, ensure_ascii=False)
+    print(f"Résultats écrits dans {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(resultats, json.load(f))
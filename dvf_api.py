@@ -0,0 +1,482 @@
+# dvf_api.py
+"""
+API HTTP (JSON ou Arrow IPC) pour les outils qui ont besoin des KPIs, des
+distributions et des transactions filtrées sans passer par les pages Streamlit.
+
+Elle s'appuie sur les mêmes sources que les dashboards (cache Parquet, fichier
+Arrow partagé, cache disque HTTP) et sur les mêmes structures précalculées :
+KPIs et histogrammes lus dans les cubes, transactions paginées par le moteur de
+filtres. Les réponses sont gardées en cache sous une clé construite à partir des
+paramètres normalisés (années triées, codes postaux triés, booléens et nombres
+canoniques) : deux requêtes équivalentes ne calculent qu'une fois.
+
+Lancement (Starlette et uvicorn, voir requirements.txt) :
+
+    python dvf_api.py                       # fichiers locaux dvf_<année>.csv
+    DVF_API_SOURCE=http python dvf_api.py   # fichiers par commune sur data.gouv.fr
+
+Routes (paramètres de filtre communs : annees=2023,2024 codes_postaux=33600,33700
+type_local=Maison prix_min=0 prix_max=500000 exclure_aberrants=1) :
+
+    GET /communes?q=merig
+    GET /communes/{code}/kpis
+    GET /communes/{code}/histogramme?format=json|arrow
+    GET /communes/{code}/transactions?tri=Prix&ordre=desc&page=0&taille=100&format=json|arrow
+    GET /communes/{code}/comparables?lat=44.80&lon=-0.63&type_local=Maison&surface=90&k=20&rayon=1000
+"""
+import json
+import math
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import requests
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.routing import Route
+
+from dvf_communes import registry
+from dvf_cube import BINS_PRIX_M2, HORS_ECHELLE, hist_bins, hist_box_stats, query_cube
+from dvf_data import ANNEES, MultiYearSource, get_source, sources_generation
+from dvf_filters import COLONNES_TRI
+from dvf_http import RETRY_AFTER
+from dvf_profiling import count_cache
+from dvf_refresh import start_refresher
+from dvf_spatial import comparables
+
+# Source des données : "local" (dvf_<année>.csv, moteur DVF_BACKEND) ou "http" (data.gouv.fr)
+API_SOURCE = os.environ.get("DVF_API_SOURCE", "local")
+BACKEND = os.environ.get("DVF_BACKEND", "pandas")
+SHARED = os.environ.get("DVF_SHARED", "1") != "0"
+FILE_PATTERN = "dvf_{annee}.csv"
+
+# Nombre de réponses gardées en cache
+MAX_REPONSES = int(os.environ.get("DVF_API_CACHE", "256"))
+
+# Taille maximale d'une page de transactions
+TAILLE_PAGE_MAX = 1000
+
+# Nombre maximal de biens comparables par requête
+K_MAX = 200
+
+TYPES_LOCAUX = ("Tous", "Maison", "Appartement")
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def year_source(annee: int):
+    if API_SOURCE == "http":
+        return get_source("http", annee=annee, departement="33")
+    if BACKEND == "duckdb":
+        return get_source("duckdb", path=FILE_PATTERN.format(annee=annee))
+    return get_source("csv", csv_path=FILE_PATTERN.format(annee=annee), streaming=False, shared=SHARED)
+
+
+historique = MultiYearSource(year_source)
+
+# Reconstruction des sources en tâche de fond quand leurs fichiers changent (voir dvf_refresh.py)
+start_refresher()
+
+
+class ParametreInvalide(ValueError):
+    status_code = 400
+
+
+class Introuvable(LookupError):
+    status_code = 404
+
+
+# --- Normalisation des paramètres ---
+
+def _liste(valeur: str) -> list:
+    return [v.strip() for v in valeur.split(",") if v.strip()] if valeur else []
+
+
+def _nombre(params, nom: str, defaut: float) -> float:
+    valeur = params.get(nom)
+    if valeur in (None, ""):
+        return defaut
+    try:
+        nombre = float(valeur)
+    except ValueError:
+        raise ParametreInvalide(f"{nom} doit être un nombre : {valeur!r}")
+    if not math.isfinite(nombre):
+        raise ParametreInvalide(f"{nom} doit être un nombre fini : {valeur!r}")
+    return nombre
+
+
+def _entier(params, nom: str, defaut: int, minimum: int = 0, maximum: int = None) -> int:
+    nombre = _nombre(params, nom, defaut)
+    if nombre != int(nombre) or nombre < minimum or (maximum is not None and nombre > maximum):
+        borne = f" et {maximum}" if maximum is not None else ""
+        raise ParametreInvalide(f"{nom} doit être un entier compris entre {minimum}{borne}")
+    return int(nombre)
+
+
+def _booleen(params, nom: str, defaut: bool) -> bool:
+    valeur = params.get(nom)
+    if valeur in (None, ""):
+        return defaut
+    if valeur.lower() in ("1", "true", "oui", "yes"):
+        return True
+    if valeur.lower() in ("0", "false", "non", "no"):
+        return False
+    raise ParametreInvalide(f"{nom} doit valoir 0 ou 1 : {valeur!r}")
+
+
+def _annees(params) -> tuple:
+    valeurs = _liste(params.get("annees", ""))
+    if not valeurs:
+        return (ANNEES[-1],)
+    try:
+        annees = sorted({int(v) for v in valeurs})
+    except ValueError:
+        raise ParametreInvalide(f"annees doit être une liste d'années : {params['annees']!r}")
+    inconnues = [a for a in annees if a not in ANNEES]
+    if inconnues:
+        raise ParametreInvalide(f"Années non disponibles : {inconnues} (millésimes {ANNEES[0]}–{ANNEES[-1]})")
+    return tuple(annees)
+
+
+def filter_params(params) -> dict:
+    """
+    Paramètres de filtre normalisés (hashables, valeurs par défaut du dashboard).
+    codes_postaux=None signifie tous les codes de la commune.
+    """
+    type_local = params.get("type_local") or "Tous"
+    if type_local not in TYPES_LOCAUX:
+        raise ParametreInvalide(f"type_local doit être l'un de {', '.join(TYPES_LOCAUX)}")
+    codes_postaux = tuple(sorted(set(_liste(params.get("codes_postaux", ""))))) or None
+    prix_min = _nombre(params, "prix_min", 0.0)
+    prix_max = _nombre(params, "prix_max", math.inf)
+    if prix_min > prix_max:
+        raise ParametreInvalide("prix_min doit être inférieur à prix_max")
+    return {
+        "annees": _annees(params),
+        "codes_postaux": codes_postaux,
+        "type_local": type_local,
+        "prix_min": prix_min,
+        "prix_max": prix_max,
+        "exclure_aberrants": _booleen(params, "exclure_aberrants", True),
+    }
+
+
+def _format(params, formats=("json", "arrow")) -> str:
+    fmt = params.get("format") or "json"
+    if fmt not in formats:
+        raise ParametreInvalide(f"format doit être l'un de {', '.join(formats)}")
+    return fmt
+
+
+# --- Cache des réponses ---
+
+_reponses = {}
+_reponses_lock = threading.Lock()
+
+
+def cached_response(cle: tuple, calcul):
+    """
+    Réponse (corps, type de contenu, en-têtes) gardée sous `cle` ; les plus anciennes
+    sont évincées au-delà de MAX_REPONSES. Les réponses calculées avant le remplacement
+    d'une source par le rafraîchissement ne sont plus servies.
+    """
+    cle = (sources_generation(), *cle)
+    with _reponses_lock:
+        count_cache("api", cle in _reponses)
+        if cle in _reponses:
+            return _reponses[cle]
+    reponse = calcul()
+    with _reponses_lock:
+        _reponses[cle] = reponse
+        if len(_reponses) > MAX_REPONSES:
+            _reponses.pop(next(iter(_reponses)))
+    return reponse
+
+
+def clear_cache():
+    with _reponses_lock:
+        _reponses.clear()
+
+
+# --- Calculs (exécutés hors de la boucle d'événements) ---
+
+def _json(donnees) -> tuple:
+    def defaut(valeur):
+        if isinstance(valeur, np.generic):
+            return valeur.item()
+        if isinstance(valeur, np.ndarray):
+            return valeur.tolist()
+        raise TypeError(type(valeur).__name__)
+    corps = json.dumps(donnees, ensure_ascii=False, default=defaut, allow_nan=False)
+    return corps.encode("utf-8"), "application/json", {}
+
+
+def _arrow(df: pd.DataFrame, entetes: dict = None) -> tuple:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes(), ARROW_MEDIA_TYPE, entetes or {}
+
+
+def _fini(valeur):
+    # JSON n'a pas de NaN ni d'infini : null à la place
+    valeur = float(valeur)
+    return valeur if math.isfinite(valeur) else None
+
+
+def _verifier(code: str, filtres: dict) -> str:
+    """
+    Nom de la commune, après avoir vérifié qu'elle existe et a des ventes sur la période.
+    """
+    commune = registry().get(code)
+    if commune is None:
+        raise Introuvable(f"Commune inconnue : {code}")
+    annees = list(filtres["annees"])
+    manquantes = sorted(set(annees) - set(historique.available_years(annees)))
+    if manquantes:
+        raise Introuvable(f"Données absentes pour {', '.join(map(str, manquantes))}")
+    if historique.load_commune(code, annees).empty:
+        raise Introuvable(f"Aucune vente pour {commune.nom} en {', '.join(map(str, annees))}")
+    return commune.nom
+
+
+def _filtres_moteur(engine, filtres: dict) -> dict:
+    return {
+        "codes_postaux": engine.codes_postaux if filtres["codes_postaux"] is None else list(filtres["codes_postaux"]),
+        "type_local": filtres["type_local"],
+        "prix_min": filtres["prix_min"],
+        "prix_max": filtres["prix_max"],
+        "exclure_aberrants": filtres["exclure_aberrants"],
+    }
+
+
+def _resume(code: str, filtres: dict):
+    """
+    Résumé du cube pour les filtres, ou None s'il faut repasser par les lignes
+    (mêmes règles que le dashboard, voir dvf_cube.query_cube).
+    """
+    cube = historique.commune_cube(code, list(filtres["annees"]))
+    return query_cube(cube, filtres["codes_postaux"], filtres["type_local"], filtres["prix_min"],
+                      filtres["prix_max"], filtres["exclure_aberrants"])
+
+
+def _lignes(code: str, filtres: dict):
+    engine = historique.filter_engine(code, list(filtres["annees"]))
+    return engine, engine.select(**_filtres_moteur(engine, filtres))
+
+
+def compute_kpis(code: str, filtres: dict) -> tuple:
+    nom = _verifier(code, filtres)
+    resume = _resume(code, filtres)
+    if resume is not None:
+        kpis = {"n": resume["n"], "prix_m2_moyen": resume["prix_m2_moyen"], "prix_median": resume["prix_median"],
+                "surface_moyenne": resume["surface_moyenne"],
+                "types": {str(t): int(n) for t, n in resume["types"].items()}, "calcul": "cube"}
+    else:
+        _, df = _lignes(code, filtres)
+        types = df["type_local"].value_counts()
+        kpis = {"n": len(df), "prix_m2_moyen": df["prix_m2"].mean(), "prix_median": df["valeur_fonciere"].median(),
+                "surface_moyenne": df["surface_reelle_bati"].mean(),
+                "types": {str(t): int(n) for t, n in types[types > 0].items()}, "calcul": "lignes"}
+    for cle in ("prix_m2_moyen", "prix_median", "surface_moyenne"):
+        kpis[cle] = _fini(kpis[cle]) if kpis["n"] else None
+    return _json({"code_insee": code, "nom": nom, "annees": list(filtres["annees"]), **kpis})
+
+
+def compute_histogram(code: str, filtres: dict, fmt: str) -> tuple:
+    """
+    Histogramme des prix au m² par type de bien sur les classes fixes du cube
+    (BINS_PRIX_M2), avec les statistiques de boîte à moustaches et le nombre de ventes
+    hors des classes en JSON.
+    """
+    _verifier(code, filtres)
+    resume = _resume(code, filtres)
+    if resume is not None:
+        histogrammes, hors_echelle = resume["hist"], resume["hors_echelle"]
+    else:
+        _, df = _lignes(code, filtres)
+        classes = hist_bins(df["prix_m2"])
+        dans_echelle = classes != HORS_ECHELLE
+        types = df["type_local"].astype(str).to_numpy()
+        histogrammes = {t: np.bincount(classes[dans_echelle & (types == t)], minlength=len(BINS_PRIX_M2) - 1)
+                        for t in np.unique(types)}
+        hors_echelle = int((~dans_echelle).sum())
+
+    if fmt == "arrow":
+        nb_classes = len(BINS_PRIX_M2) - 1
+        return _arrow(pd.DataFrame({
+            "type_local": np.repeat([str(t) for t in histogrammes], nb_classes),
+            "prix_m2_min": np.tile(BINS_PRIX_M2[:-1], len(histogrammes)),
+            "prix_m2_max": np.tile(BINS_PRIX_M2[1:], len(histogrammes)),
+            "n": np.concatenate([np.asarray(c, dtype="int64") for c in histogrammes.values()])
+            if histogrammes else np.array([], dtype="int64"),
+        }))
+    return _json({
+        "code_insee": code,
+        "annees": list(filtres["annees"]),
+        "bornes_classes": BINS_PRIX_M2,
+        "hors_echelle": hors_echelle,
+        "types": {
+            str(t): {"n": np.asarray(c, dtype="int64"),
+                     "boite": {k: _fini(v) for k, v in hist_box_stats(c).items()} if np.any(c) else None}
+            for t, c in histogrammes.items()
+        },
+    })
+
+
+def compute_transactions(code: str, filtres: dict, tri: str, descending: bool, page: int, taille: int,
+                         fmt: str) -> tuple:
+    _verifier(code, filtres)
+    engine = historique.filter_engine(code, list(filtres["annees"]))
+    lignes, total = engine.page(_filtres_moteur(engine, filtres), COLONNES_TRI[tri], descending, page, taille)
+    entetes = {"X-Total-Count": str(total)}
+    if fmt == "arrow":
+        return _arrow(lignes, entetes)
+    corps, media, _ = _json({"code_insee": code, "annees": list(filtres["annees"]), "total": total,
+                             "page": page, "taille": taille,
+                             "lignes": json.loads(lignes.to_json(orient="records", date_format="iso"))})
+    return corps, media, entetes
+
+
+def compute_comparables(code: str, filtres: dict, lat: float, lon: float, surface: float, k: int,
+                        rayon: float, fmt: str) -> tuple:
+    """
+    Les k ventes comparables les plus proches du point, lues dans l'index spatial
+    de la commune (voir dvf_spatial.py), et les statistiques de leur prix au m².
+    """
+    _verifier(code, filtres)
+    annees = list(filtres["annees"])
+    # Ventes et index lus sur la même version des sources (positions de l'index dans le tableau)
+    donnees = historique.snapshot()
+    lignes, stats = comparables(donnees.load_commune(code, annees), donnees.spatial_index(code, annees),
+                                lat, lon, filtres["type_local"], surface, k,
+                                exclure_aberrants=filtres["exclure_aberrants"], rayon_max=rayon)
+    if fmt == "arrow":
+        return _arrow(lignes, {"X-Total-Count": str(len(lignes))})
+    return _json({"code_insee": code, "annees": annees, **{c: _fini(v) for c, v in stats.items() if c != "n"},
+                  "n": stats["n"], "lignes": json.loads(lignes.to_json(orient="records", date_format="iso"))})
+
+
+def compute_communes(texte: str, limite: int) -> tuple:
+    ref = registry()
+    return _json([{"code_insee": code, "nom": ref.communes[code].nom,
+                   "codes_postaux": list(ref.communes[code].codes_postaux)}
+                  for code in ref.search(texte, limite)])
+
+
+# --- Routes ---
+
+def _erreur(message: str, status_code: int, entetes: dict = None) -> Response:
+    corps, media, _ = _json({"erreur": message})
+    return Response(corps, status_code=status_code, media_type=media, headers=entetes)
+
+
+async def _repondre(cle: tuple, calcul) -> Response:
+    try:
+        corps, media, entetes = await run_in_threadpool(cached_response, cle, calcul)
+    except (ParametreInvalide, Introuvable) as e:
+        return _erreur(str(e), e.status_code)
+    except requests.exceptions.HTTPError as e:
+        # Réponse d'erreur de data.gouv.fr (source "http") : fichier absent ou serveur en échec
+        reponse = e.response
+        if reponse is not None and reponse.status_code == 404:
+            return _erreur(f"Données absentes sur data.gouv.fr : {reponse.url}", 404)
+        statut = reponse.status_code if reponse is not None else "une erreur"
+        return _erreur(f"data.gouv.fr a répondu {statut}", 502)
+    except requests.exceptions.RequestException as e:
+        # Origine injoignable et aucune copie locale de la commune
+        return _erreur(f"data.gouv.fr injoignable : {e}", 503, {"Retry-After": str(RETRY_AFTER)})
+    return Response(corps, media_type=media, headers=entetes)
+
+
+async def _valider(request, lecture):
+    try:
+        return lecture(request.query_params), None
+    except ParametreInvalide as e:
+        return None, _erreur(str(e), 400)
+
+
+async def communes(request):
+    def lecture(params):
+        return params.get("q", ""), _entier(params, "limite", 20, minimum=1, maximum=1000)
+    valeurs, erreur = await _valider(request, lecture)
+    if erreur:
+        return erreur
+    texte, limite = valeurs
+    return await _repondre(("communes", texte, limite), lambda: compute_communes(texte, limite))
+
+
+async def kpis(request):
+    code = request.path_params["code"]
+    filtres, erreur = await _valider(request, filter_params)
+    if erreur:
+        return erreur
+    return await _repondre(("kpis", code, *filtres.values()), lambda: compute_kpis(code, filtres))
+
+
+async def histogramme(request):
+    code = request.path_params["code"]
+    valeurs, erreur = await _valider(request, lambda p: (filter_params(p), _format(p)))
+    if erreur:
+        return erreur
+    filtres, fmt = valeurs
+    return await _repondre(("histogramme", code, fmt, *filtres.values()),
+                           lambda: compute_histogram(code, filtres, fmt))
+
+
+async def transactions(request):
+    code = request.path_params["code"]
+
+    def lecture(params):
+        tri = params.get("tri") or "Date"
+        if tri not in COLONNES_TRI:
+            raise ParametreInvalide(f"tri doit être l'un de {', '.join(COLONNES_TRI)}")
+        ordre = params.get("ordre") or "desc"
+        if ordre not in ("asc", "desc"):
+            raise ParametreInvalide("ordre doit valoir asc ou desc")
+        return (filter_params(params), tri, ordre == "desc",
+                _entier(params, "page", 0), _entier(params, "taille", 100, minimum=1, maximum=TAILLE_PAGE_MAX),
+                _format(params))
+    valeurs, erreur = await _valider(request, lecture)
+    if erreur:
+        return erreur
+    filtres, tri, descending, page, taille, fmt = valeurs
+    return await _repondre(("transactions", code, tri, descending, page, taille, fmt, *filtres.values()),
+                           lambda: compute_transactions(code, filtres, tri, descending, page, taille, fmt))
+
+
+async def comparables_route(request):
+    code = request.path_params["code"]
+
+    def lecture(params):
+        if params.get("lat") in (None, "") or params.get("lon") in (None, ""):
+            raise ParametreInvalide("lat et lon sont obligatoires")
+        rayon = _nombre(params, "rayon", math.inf)
+        return (filter_params(params), _nombre(params, "lat", 0.0), _nombre(params, "lon", 0.0),
+                _nombre(params, "surface", 0.0), _entier(params, "k", 20, minimum=1, maximum=K_MAX),
+                None if math.isinf(rayon) else rayon, _format(params))
+    valeurs, erreur = await _valider(request, lecture)
+    if erreur:
+        return erreur
+    filtres, lat, lon, surface, k, rayon, fmt = valeurs
+    return await _repondre(("comparables", code, lat, lon, surface, k, rayon, fmt, *filtres.values()),
+                           lambda: compute_comparables(code, filtres, lat, lon, surface, k, rayon, fmt))
+
+
+app = Starlette(routes=[
+    Route("/communes", communes),
+    Route("/communes/{code}/kpis", kpis),
+    Route("/communes/{code}/histogramme", histogramme),
+    Route("/communes/{code}/transactions", transactions),
+    Route("/communes/{code}/comparables", comparables_route),
+])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.environ.get("DVF_API_HOST", "127.0.0.1"), port=int(os.environ.get("DVF_API_PORT", "8000")))
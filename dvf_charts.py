@@ -0,0 +1,115 @@
+# dvf_charts.py
+"""
+Graphiques légers de la page commune : répartition des prix au m² (histogramme
+et boîte à moustaches) et répartition des types de biens.
+
+Les résumés sont calculés côté serveur avec NumPy : comptes par classe de prix
+au m² (classes fixes BINS_PRIX_M2 du cube), quartiles et moustaches par type de
+bien, nombre de ventes par type. Seuls ces résumés sont transmis à Plotly, et non
+les prix de toutes les ventes filtrées (que px.histogram avec marginal="box"
+embarquait deux fois dans la figure). Le résumé se lit dans le cube quand les
+filtres le permettent (voir dvf_cube.query_cube), sinon il est calculé sur les
+lignes filtrées. Les ventes dont le prix au m² sort des classes ne sont pas
+rangées dans les classes extrêmes : l'histogramme indique leur nombre.
+"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from dvf_cube import BINS_PRIX_M2, HORS_ECHELLE, hist_bins, hist_box_stats
+
+
+def box_stats(valeurs: np.ndarray) -> dict:
+    """
+    Statistiques de boîte à moustaches exactes (quartiles à interpolation linéaire comme
+    Plotly, moustaches sur les valeurs extrêmes à moins de 1,5 IQR des quartiles).
+    """
+    q1, mediane, q3 = np.quantile(valeurs, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    return {
+        "q1": float(q1), "median": float(mediane), "q3": float(q3),
+        "lowerfence": float(valeurs[valeurs >= q1 - 1.5 * iqr].min()),
+        "upperfence": float(valeurs[valeurs <= q3 + 1.5 * iqr].max()),
+    }
+
+
+def summarize_rows(df_filtre: pd.DataFrame) -> dict:
+    """
+    Résumé des graphiques calculé sur les lignes filtrées : comptes par classe de prix
+    au m² et statistiques de boîte (exactes, toutes ventes comprises) par type de bien,
+    nombre de ventes par type et nombre de ventes hors des classes.
+    """
+    codes, types = pd.factorize(df_filtre["type_local"].astype(str), sort=True)
+    prix_m2 = df_filtre["prix_m2"].to_numpy(dtype="float64")
+    nb_classes = len(BINS_PRIX_M2) - 1
+    classes = hist_bins(prix_m2)
+    dans_echelle = classes != HORS_ECHELLE
+    # Un seul np.bincount pour tous les types : indice type * nb_classes + classe
+    comptes = np.bincount(codes[dans_echelle] * nb_classes + classes[dans_echelle],
+                          minlength=len(types) * nb_classes).reshape(len(types), nb_classes)
+    return {
+        "hist": dict(zip(types, comptes)),
+        "boites": {t: box_stats(prix_m2[codes == i]) for i, t in enumerate(types)},
+        "types": pd.Series(np.bincount(codes, minlength=len(types)), index=types, name="n"),
+        "hors_echelle": int((~dans_echelle).sum()),
+    }
+
+
+def summarize_cube(resume: dict) -> dict:
+    """
+    Résumé des graphiques lu dans le résumé du cube (boîtes approchées par classe).
+    """
+    return {
+        "hist": resume["hist"],
+        "boites": {t: hist_box_stats(counts) for t, counts in resume["hist"].items() if counts.sum()},
+        "types": resume["types"],
+        "hors_echelle": resume["hors_echelle"],
+    }
+
+
+def price_histogram(graphique: dict) -> go.Figure:
+    """
+    Histogramme des prix au m² par type de bien, surmonté des boîtes à moustaches, avec
+    le nombre de ventes hors des classes en note.
+    """
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.2, 0.8], vertical_spacing=0.02)
+    centres = (BINS_PRIX_M2[:-1] + BINS_PRIX_M2[1:]) / 2
+    couleurs = px.colors.qualitative.Plotly
+    for i, (type_bien, counts) in enumerate(graphique["hist"].items()):
+        couleur = couleurs[i % len(couleurs)]
+        non_vides = counts > 0
+        fig.add_trace(go.Bar(x=centres[non_vides], y=counts[non_vides], width=BINS_PRIX_M2[1] - BINS_PRIX_M2[0],
+                             name=type_bien, legendgroup=type_bien, marker_color=couleur), row=2, col=1)
+        stats = graphique["boites"].get(type_bien)
+        if stats is not None:
+            fig.add_trace(go.Box(y=[type_bien], orientation="h", name=type_bien, legendgroup=type_bien,
+                                 showlegend=False, marker_color=couleur,
+                                 **{k: [v] for k, v in stats.items()}), row=1, col=1)
+    fig.update_layout(barmode="relative", bargap=0, legend_title_text="type_local")
+    fig.update_xaxes(title_text="prix_m2", row=2, col=1)
+    fig.update_yaxes(title_text="count", row=2, col=1)
+    fig.update_yaxes(showticklabels=False, row=1, col=1)
+    if graphique["hors_echelle"]:
+        fig.add_annotation(text=f"{graphique['hors_echelle']:,} ventes hors de l'échelle "
+                                f"({BINS_PRIX_M2[0]:,}–{BINS_PRIX_M2[-1]:,} €/m²) non représentées",
+                           xref="paper", yref="paper", x=1, y=-0.15, showarrow=False, xanchor="right",
+                           font={"size": 11})
+    return fig
+
+
+def type_pie(types: pd.Series) -> go.Figure:
+    """
+    Camembert de la répartition par type de bien, à partir des comptes par type.
+    """
+    return px.pie(names=types.index.astype(str), values=types.to_numpy(), title='Répartition par type')
+
+
+def chart_figures(df_filtre: pd.DataFrame, resume: dict = None) -> tuple:
+    """
+    Figures de la section graphiques (histogramme, camembert), construites à partir du
+    résumé du cube s'il est fourni, sinon des lignes filtrées.
+    """
+    graphique = summarize_cube(resume) if resume is not None else summarize_rows(df_filtre)
+    return price_histogram(graphique), type_pie(graphique["types"])
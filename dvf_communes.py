@@ -0,0 +1,195 @@
+# dvf_communes.py
+"""
+Référentiel des communes de la Gironde, partagé par tous les dashboards.
+
+Les communes sont lues depuis un fichier versionné livré avec le code
+(data/communes_gironde.csv : code INSEE, nom, codes postaux, centre), au
+premier accès seulement. Un index trié des noms normalisés (sans accents, sans
+casse, tirets et apostrophes remplacés par des espaces) sert à la recherche par
+préfixe : « merig » trouve Mérignac, « medard » trouve Saint-Médard-en-Jalles.
+
+Le fichier se régénère depuis l'API Découpage administratif (geo.api.gouv.fr) :
+
+    python dvf_communes.py
+
+L'en-tête indique le nombre de communes écrites (un fichier tronqué est refusé) ;
+un extrait du département (extrait=1) est signalé dans les logs à la lecture.
+"""
+import bisect
+import csv
+import functools
+import logging
+import os
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+REFERENTIEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "communes_gironde.csv")
+
+# Version du format du fichier (ligne d'en-tête « # referentiel=... version=N ... »)
+VERSION_REFERENTIEL = 1
+
+GEO_API_URL = "https://geo.api.gouv.fr/departements/{departement}/communes"
+
+COLONNES = ["code_insee", "nom", "codes_postaux", "latitude", "longitude"]
+
+
+def normalize_name(texte: str) -> str:
+    """
+    Forme de recherche d'un nom de commune : sans accents ni casse, « St » développé.
+    """
+    texte = unicodedata.normalize("NFKD", texte.replace("œ", "oe").replace("Œ", "Oe"))
+    texte = "".join(c for c in texte if not unicodedata.combining(c)).casefold()
+    texte = re.sub(r"[^a-z0-9]+", " ", texte).strip()
+    return re.sub(r"\b(ste?)\b", lambda m: "sainte" if m.group(1) == "ste" else "saint", texte)
+
+
+class Commune:
+    __slots__ = ("code", "nom", "codes_postaux", "latitude", "longitude")
+
+    def __init__(self, code: str, nom: str, codes_postaux: tuple, latitude, longitude):
+        self.code = code
+        self.nom = nom
+        self.codes_postaux = codes_postaux
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def __repr__(self):
+        return f"Commune({self.code!r}, {self.nom!r})"
+
+
+class CommuneRegistry:
+    """
+    Communes indexées par code INSEE, avec l'index de recherche par préfixe.
+    """
+
+    def __init__(self, communes: list, metadata: dict = None):
+        self.metadata = metadata or {}
+        self.communes = {c.code: c for c in sorted(communes, key=lambda c: c.code)}
+        doublons = len(communes) - len(self.communes)
+        if doublons:
+            raise ValueError(f"Référentiel des communes : {doublons} code(s) INSEE en double")
+        self.noms = {c.nom: c.code for c in self.communes.values()}
+        if len(self.noms) != len(self.communes):
+            raise ValueError("Référentiel des communes : noms en double")
+
+        # Une clé par début de mot : « saint medard en jalles », « medard en jalles », « en jalles »...
+        self._noms_normalises = {c.code: normalize_name(c.nom) for c in self.communes.values()}
+        index = []
+        for c in self.communes.values():
+            cle = self._noms_normalises[c.code]
+            index.append((cle, c.nom, c.code))
+            for m in re.finditer(r" ", cle):
+                index.append((cle[m.end():], c.nom, c.code))
+        index.sort()
+        self._cles = [cle for cle, _, _ in index]
+        self._codes = [code for _, _, code in index]
+
+    def __len__(self):
+        return len(self.communes)
+
+    def __contains__(self, code):
+        return code in self.communes
+
+    def get(self, code: str):
+        return self.communes.get(code)
+
+    def search(self, texte: str, limit: int = None) -> list:
+        """
+        Codes INSEE des communes dont le nom (ou un de ses mots) commence par `texte`,
+        les noms qui commencent par `texte` d'abord, puis par ordre alphabétique.
+        """
+        prefixe = normalize_name(texte)
+        if not prefixe:
+            return sorted(self.communes, key=self._noms_normalises.get)
+        debut = bisect.bisect_left(self._cles, prefixe)
+        fin = bisect.bisect_left(self._cles, prefixe + "\uffff", lo=debut)
+        codes = dict.fromkeys(self._codes[debut:fin])
+        trouves = sorted(codes, key=lambda code: (not self._noms_normalises[code].startswith(prefixe),
+                                                  self._noms_normalises[code]))
+        return trouves[:limit] if limit else trouves
+
+
+def read_registry(path: str = REFERENTIEL_PATH) -> CommuneRegistry:
+    """
+    Lit le fichier du référentiel (en-tête de version en commentaire, puis CSV).
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        entete = f.readline()
+        if not entete.startswith("#"):
+            raise ValueError(f"{path} : en-tête de version manquant")
+        metadata = dict(champ.split("=", 1) for champ in entete[1:].split() if "=" in champ)
+        if int(metadata.get("version", 0)) != VERSION_REFERENTIEL:
+            raise ValueError(f"{path} : version {metadata.get('version')} du référentiel, "
+                             f"{VERSION_REFERENTIEL} attendue")
+        communes = [
+            Commune(ligne["code_insee"], ligne["nom"],
+                    tuple(cp for cp in ligne["codes_postaux"].split(";") if cp),
+                    float(ligne["latitude"]) if ligne["latitude"] else None,
+                    float(ligne["longitude"]) if ligne["longitude"] else None)
+            for ligne in csv.DictReader(f)
+        ]
+    if "communes" in metadata and int(metadata["communes"]) != len(communes):
+        raise ValueError(f"{path} : {len(communes)} communes lues, {metadata['communes']} annoncées")
+    if metadata.get("extrait") == "1":
+        logger.warning("%s : extrait de %d communes seulement, régénérer le fichier complet avec "
+                       "python dvf_communes.py", path, len(communes))
+    return CommuneRegistry(communes, metadata)
+
+
+@functools.lru_cache(maxsize=1)
+def registry() -> CommuneRegistry:
+    """
+    Référentiel partagé, lu une seule fois par processus au premier accès.
+    """
+    return read_registry()
+
+
+def search_communes(texte: str, limit: int = None) -> list:
+    """
+    Noms des communes correspondant à `texte` (recherche par préfixe, sans accents).
+    """
+    ref = registry()
+    return [ref.communes[code].nom for code in ref.search(texte, limit)]
+
+
+def __getattr__(nom):
+    # Dictionnaires historiques, construits à la demande depuis le référentiel
+    if nom == "COMMUNES_GIRONDE":
+        return {code: c.nom for code, c in registry().communes.items()}
+    if nom == "NOMS_COMMUNES":
+        return dict(registry().noms)
+    raise AttributeError(f"module {__name__!r} has no attribute {nom!r}")
+
+
+def download_registry(path: str = REFERENTIEL_PATH, departement: str = "33", millesime: str = "") -> int:
+    """
+    Régénère le fichier du référentiel depuis geo.api.gouv.fr. Renvoie le nombre de communes.
+    """
+    import requests
+
+    r = requests.get(GEO_API_URL.format(departement=departement),
+                     params={"fields": "nom,code,codesPostaux,centre", "format": "json"}, timeout=30)
+    r.raise_for_status()
+    communes = []
+    for c in r.json():
+        lon, lat = (c.get("centre") or {}).get("coordinates", (None, None))
+        communes.append([c["code"], c["nom"], ";".join(sorted(c.get("codesPostaux", []))),
+                         "" if lat is None else f"{lat:.5f}", "" if lon is None else f"{lon:.5f}"])
+    communes.sort()
+
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        f.write(f"# referentiel=communes_{departement} version={VERSION_REFERENTIEL} "
+                f"millesime={millesime or 'geo.api.gouv.fr'} communes={len(communes)}\n")
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(COLONNES)
+        writer.writerows(communes)
+    read_registry(tmp)
+    os.replace(tmp, path)
+    return len(communes)
+
+
+if __name__ == "__main__":
+    print(f"{download_registry()} communes écrites dans {REFERENTIEL_PATH}")
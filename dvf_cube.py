@@ -0,0 +1,315 @@
+# dvf_cube.py
+"""
+Cube d'agrégats précalculés pour les KPIs et les graphiques.
+
+Les transactions nettoyées sont agrégées une fois par commune × code postal ×
+type de bien × mois × prix aberrant ou non : nombre de ventes, sommes (prix au m², valeur foncière,
+surface), bornes de prix, histogramme des prix au m² sur des classes fixes (les
+prix hors de ces classes sont seulement comptés) et
+sketch de quantiles de la valeur foncière (classes logarithmiques, fusionnables
+par simple addition). Tant que les filtres portent sur ces dimensions, les KPIs
+et les graphiques se lisent dans le cube, quelle que soit la taille de la commune.
+"""
+import numpy as np
+import pandas as pd
+
+DIMENSIONS = ["code_commune", "code_postal", "type_local", "mois", "aberrant"]
+
+# Classes fixes de l'histogramme des prix au m² (100 €/m²)
+BINS_PRIX_M2 = np.arange(200, 15100, 100)
+
+# Classe des prix au m² hors de BINS_PRIX_M2 : comptés à part, absents de l'histogramme
+HORS_ECHELLE = -1
+
+# Précision relative du sketch de quantiles sur la valeur foncière (1 %)
+SKETCH_ALPHA = 0.01
+_GAMMA = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+_LOG_GAMMA = np.log(_GAMMA)
+
+
+def _sketch_bucket(values) -> np.ndarray:
+    """
+    Classe logarithmique de chaque valeur : toute valeur de la classe k est à
+    moins de SKETCH_ALPHA (en relatif) de _sketch_value(k).
+    """
+    values = np.maximum(np.asarray(values, dtype="float64"), 1.0)
+    return np.ceil(np.log(values) / _LOG_GAMMA).astype("int32")
+
+
+def _sketch_value(buckets) -> np.ndarray:
+    return 2 * np.exp(np.asarray(buckets, dtype="float64") * _LOG_GAMMA) / (_GAMMA + 1)
+
+
+def hist_bins(prix_m2) -> np.ndarray:
+    """
+    Indice de classe de l'histogramme de chaque prix au m² (HORS_ECHELLE en dehors
+    de BINS_PRIX_M2, la borne haute étant incluse dans la dernière classe).
+    """
+    prix_m2 = np.asarray(prix_m2, dtype="float64")
+    idx = np.minimum(np.searchsorted(BINS_PRIX_M2, prix_m2, side="right") - 1, len(BINS_PRIX_M2) - 2)
+    dans_echelle = (prix_m2 >= BINS_PRIX_M2[0]) & (prix_m2 <= BINS_PRIX_M2[-1])
+    return np.where(dans_echelle, idx, HORS_ECHELLE).astype("int16")
+
+
+def build_cube(df: pd.DataFrame) -> dict:
+    """
+    Construit le cube d'une table de transactions nettoyées.
+
+    Renvoie trois tables au format long :
+    - "cells" : une ligne par cellule (DIMENSIONS) avec n, sommes, bornes de prix et
+      nombre de ventes hors de l'échelle de l'histogramme ;
+    - "hist" : nombre de ventes par cellule et classe de prix au m² (hors HORS_ECHELLE) ;
+    - "sketch" : nombre de ventes par cellule et classe logarithmique de valeur foncière.
+    """
+    if df.empty:
+        return {}
+
+    base = pd.DataFrame({
+        "code_commune": df["code_commune"],
+        "code_postal": df["code_postal"],
+        "type_local": df["type_local"],
+        "mois": df["date_mutation"].values.astype("datetime64[M]"),
+        "aberrant": df["aberrant"].to_numpy(dtype=bool) if "aberrant" in df.columns else False,
+        "prix_m2": df["prix_m2"].astype("float64"),
+        "valeur_fonciere": df["valeur_fonciere"].astype("float64"),
+        "surface_reelle_bati": df["surface_reelle_bati"].astype("float64"),
+        "bin": hist_bins(df["prix_m2"]),
+        "bucket": _sketch_bucket(df["valeur_fonciere"]),
+    })
+    base["hors_echelle"] = base["bin"] == HORS_ECHELLE
+    groupes = base.groupby(DIMENSIONS, observed=True, sort=False)
+    cells = groupes.agg(
+        n=("prix_m2", "size"),
+        somme_prix_m2=("prix_m2", "sum"),
+        somme_valeur=("valeur_fonciere", "sum"),
+        somme_surface=("surface_reelle_bati", "sum"),
+        valeur_min=("valeur_fonciere", "min"),
+        valeur_max=("valeur_fonciere", "max"),
+        hors_echelle=("hors_echelle", "sum"),
+    ).reset_index()
+
+    # Histogramme et sketch : colonnes numpy avec l'indice de la cellule, pour que les
+    # requêtes se résument à un masque sur les cellules et un np.bincount
+    base["cell"] = groupes.ngroup().astype("int32")
+    hist = base[base["bin"] != HORS_ECHELLE].groupby(["cell", "bin"], sort=False).size()
+    sketch = base.groupby(["cell", "bucket"], sort=False).size()
+    return {
+        "cells": cells,
+        "hist": {"cell": hist.index.get_level_values("cell").to_numpy(),
+                 "bin": hist.index.get_level_values("bin").to_numpy(),
+                 "n": hist.to_numpy()},
+        "sketch": {"cell": sketch.index.get_level_values("cell").to_numpy(),
+                   "bucket": sketch.index.get_level_values("bucket").to_numpy(),
+                   "n": sketch.to_numpy()},
+    }
+
+
+def _select(cells: pd.DataFrame, codes_postaux, type_local: str, exclure_aberrants: bool = False) -> np.ndarray:
+    """
+    Masque des cellules retenues par les filtres (codes_postaux=None : tous les codes).
+    """
+    if codes_postaux is None:
+        masque = np.ones(len(cells), dtype=bool)
+    else:
+        masque = cells["code_postal"].isin(codes_postaux).to_numpy().copy()
+    if type_local != 'Tous':
+        masque &= (cells["type_local"] == type_local).to_numpy()
+    if exclure_aberrants:
+        masque &= ~cells["aberrant"].to_numpy(dtype=bool)
+    return masque
+
+
+def _sketch_quantiles(depart: int, cumul: np.ndarray, q: float) -> np.ndarray:
+    """
+    Quantile de chaque ligne de `cumul` (comptes cumulés par classe logarithmique à
+    partir de la classe `depart`), interpolé entre les deux rangs qui l'encadrent
+    comme pandas (médiane d'un nombre pair de ventes : milieu des deux centrales).
+    """
+    total = cumul[:, -1]
+    rang = q * np.maximum(total - 1, 0)
+    bas, haut = np.floor(rang), np.ceil(rang)
+    # Classe de la vente de rang r (0 = la moins chère) : première classe dont le cumul dépasse r
+    valeur_bas = _sketch_value(depart + (cumul > bas[:, None]).argmax(axis=1))
+    valeur_haut = _sketch_value(depart + (cumul > haut[:, None]).argmax(axis=1))
+    return np.where(total > 0, valeur_bas + (rang - bas) * (valeur_haut - valeur_bas), np.nan)
+
+
+def sketch_quantile(sketch: dict, masque_cells: np.ndarray, q: float) -> float:
+    """
+    Quantile approché (erreur relative <= SKETCH_ALPHA) sur les cellules retenues.
+    """
+    garde = masque_cells[sketch["cell"]]
+    if not garde.any():
+        return float("nan")
+    buckets = sketch["bucket"][garde]
+    depart = buckets.min()
+    comptes = np.bincount(buckets - depart, weights=sketch["n"][garde])
+    return float(_sketch_quantiles(depart, np.cumsum(comptes)[None, :], q)[0])
+
+
+def hist_quantile(counts: np.ndarray, q: float) -> float:
+    """
+    Quantile approché des prix au m² à partir des comptes par classe (interpolation linéaire dans la classe).
+    """
+    total = counts.sum()
+    if total == 0:
+        return float("nan")
+    cumul = np.cumsum(counts)
+    rang = q * total
+    i = int(np.searchsorted(cumul, rang, side="left"))
+    avant = cumul[i - 1] if i > 0 else 0
+    part = (rang - avant) / counts[i] if counts[i] else 0.0
+    return float(BINS_PRIX_M2[i] + part * (BINS_PRIX_M2[i + 1] - BINS_PRIX_M2[i]))
+
+
+def query_cube(cube: dict, codes_postaux, type_local: str, prix_min: float, prix_max: float,
+               exclure_aberrants: bool = False):
+    """
+    Résumé des transactions filtrées lu dans le cube, ou None si les filtres ne
+    correspondent pas aux dimensions du cube (fourchette de prix qui coupe des
+    ventes) : l'appelant repasse alors par les lignes brutes.
+    """
+    if not cube:
+        return None
+
+    masque = _select(cube["cells"], codes_postaux, type_local, exclure_aberrants)
+    if not masque.any():
+        return None
+    cells = cube["cells"][masque]
+    if prix_min > cells["valeur_min"].min() or prix_max < cells["valeur_max"].max():
+        return None
+
+    # Histogramme par type de bien : {type_local: comptes par classe de BINS_PRIX_M2}
+    hist = cube["hist"]
+    garde = masque[hist["cell"]]
+    type_cell = cube["cells"]["type_local"].to_numpy()[hist["cell"]]
+    nb_classes = len(BINS_PRIX_M2) - 1
+    types = cells.groupby("type_local", observed=True)["n"].sum()
+    histogrammes = {
+        t: np.bincount(hist["bin"][garde & (type_cell == t)], weights=hist["n"][garde & (type_cell == t)],
+                       minlength=nb_classes)
+        for t in types.index
+    }
+
+    n = int(cells["n"].sum())
+    return {
+        "n": n,
+        "prix_m2_moyen": cells["somme_prix_m2"].sum() / n,
+        "prix_median": sketch_quantile(cube["sketch"], masque, 0.5),
+        "surface_moyenne": cells["somme_surface"].sum() / n,
+        "types": types,
+        "hist": histogrammes,
+        "hors_echelle": int(cells["hors_echelle"].sum()),
+    }
+
+
+def hist_box_stats(counts: np.ndarray):
+    """
+    Statistiques de boîte à moustaches (quartiles, moustaches à 1,5 IQR) approchées
+    à partir des comptes par classe de prix au m². None si l'histogramme est vide
+    (toutes les ventes hors échelle, par exemple).
+    """
+    if counts.sum() == 0:
+        return None
+    q1, mediane, q3 = (hist_quantile(counts, q) for q in (0.25, 0.5, 0.75))
+    non_vides = np.flatnonzero(counts)
+    minimum = BINS_PRIX_M2[non_vides[0]]
+    maximum = BINS_PRIX_M2[non_vides[-1] + 1]
+    iqr = q3 - q1
+    return {
+        "q1": q1, "median": mediane, "q3": q3,
+        "lowerfence": max(minimum, q1 - 1.5 * iqr),
+        "upperfence": min(maximum, q3 + 1.5 * iqr),
+    }
+
+
+def merge_cubes(cubes: list) -> dict:
+    """
+    Fusionne des cubes (par exemple une commune sur plusieurs années) : les cellules
+    sont concaténées et les indices de cellule de l'histogramme et du sketch décalés.
+    """
+    cubes = [c for c in cubes if c]
+    if len(cubes) <= 1:
+        return cubes[0] if cubes else {}
+
+    decalages = np.cumsum([0] + [len(c["cells"]) for c in cubes[:-1]])
+    fusion = {"cells": pd.concat([c["cells"] for c in cubes], ignore_index=True)}
+    for table, valeur in (("hist", "bin"), ("sketch", "bucket")):
+        fusion[table] = {
+            "cell": np.concatenate([c[table]["cell"] + d for c, d in zip(cubes, decalages)]),
+            valeur: np.concatenate([c[table][valeur] for c in cubes]),
+            "n": np.concatenate([c[table]["n"] for c in cubes]),
+        }
+    return fusion
+
+
+def monthly_trend(cubes: list, codes_postaux, type_local: str, exclure_aberrants: bool = False) -> pd.DataFrame:
+    """
+    Prix moyen au m² et nombre de ventes par mois et type de bien, lus dans les
+    cubes annuels (aucune ligne brute n'est concaténée).
+    """
+    morceaux = []
+    for cube in cubes:
+        if not cube:
+            continue
+        cells = cube["cells"][_select(cube["cells"], codes_postaux, type_local, exclure_aberrants)]
+        morceaux.append(cells[["mois", "type_local", "n", "somme_prix_m2"]].astype({"type_local": str}))
+    if not morceaux:
+        return pd.DataFrame(columns=["mois", "type_local", "n", "prix_m2_moyen"])
+
+    tendance = pd.concat(morceaux, ignore_index=True).groupby(["mois", "type_local"], as_index=False).sum()
+    tendance["prix_m2_moyen"] = tendance["somme_prix_m2"] / tendance["n"]
+    return tendance.drop(columns="somme_prix_m2").sort_values("mois")
+
+
+def compare_cubes(cubes: dict, type_local: str = 'Tous', exclure_aberrants: bool = False):
+    """
+    Indicateurs côte à côte de plusieurs cubes ({libellé: cube}, par exemple un par
+    commune), en une seule passe sur leurs cellules fusionnées : chaque agrégat est
+    un np.bincount sur l'indice du cube d'origine.
+
+    Renvoie un tableau indexé par libellé (n, prix_m2_moyen, prix_median,
+    surface_moyenne) et les histogrammes des prix au m² (une ligne par libellé,
+    classes de BINS_PRIX_M2). Les cubes vides sont ignorés.
+    """
+    libelles = [nom for nom, cube in cubes.items() if cube]
+    if not libelles:
+        return pd.DataFrame(columns=["n", "prix_m2_moyen", "prix_median", "surface_moyenne"]), np.zeros((0, len(BINS_PRIX_M2) - 1))
+    fusion = merge_cubes([cubes[nom] for nom in libelles])
+    k = len(libelles)
+    origine = np.repeat(np.arange(k), [len(cubes[nom]["cells"]) for nom in libelles])
+
+    cells = fusion["cells"]
+    masque = _select(cells, None, type_local, exclure_aberrants)
+    groupe = origine[masque]
+    n = np.bincount(groupe, weights=cells["n"].to_numpy()[masque], minlength=k)
+    somme_prix_m2 = np.bincount(groupe, weights=cells["somme_prix_m2"].to_numpy()[masque], minlength=k)
+    somme_surface = np.bincount(groupe, weights=cells["somme_surface"].to_numpy()[masque], minlength=k)
+
+    # Histogrammes : une ligne par libellé
+    nb_classes = len(BINS_PRIX_M2) - 1
+    hist = fusion["hist"]
+    garde = masque[hist["cell"]]
+    hist_2d = np.bincount(origine[hist["cell"][garde]] * nb_classes + hist["bin"][garde],
+                          weights=hist["n"][garde], minlength=k * nb_classes).reshape(k, nb_classes)
+
+    # Médianes : sketch par libellé, même règle que sketch_quantile
+    sketch = fusion["sketch"]
+    garde = masque[sketch["cell"]]
+    buckets = sketch["bucket"][garde]
+    medianes = np.full(k, np.nan)
+    if garde.any():
+        depart = buckets.min()
+        largeur = int(buckets.max() - depart) + 1
+        comptes = np.bincount(origine[sketch["cell"][garde]] * largeur + (buckets - depart),
+                              weights=sketch["n"][garde], minlength=k * largeur).reshape(k, largeur)
+        medianes = _sketch_quantiles(depart, np.cumsum(comptes, axis=1), 0.5)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        kpis = pd.DataFrame({
+            "n": n.astype("int64"),
+            "prix_m2_moyen": somme_prix_m2 / n,
+            "prix_median": medianes,
+            "surface_moyenne": somme_surface / n,
+        }, index=pd.Index(libelles, name="commune"))
+    return kpis, hist_2d
@@ -0,0 +1,1096 @@
+# dvf_data.py
+"""
+Couche d'accès aux données DVF partagée par tous les dashboards : chargement,
+nettoyage, cache et sources de données (CSV local, Parquet, fichiers par
+commune sur data.gouv.fr).
+
+Le fichier dvf_2024.csv pèse ~600 Mo et contient une quarantaine de colonnes
+dont le dashboard n'utilise qu'une quinzaine. On le convertit une seule fois
+en Parquet typé (colonnes élaguées), puis on relit ce Parquet en mémoire mappée
+à chaque démarrage. En mode streaming, le CSV est lu par blocs et seules les
+lignes Maison/Appartement valides sont conservées.
+"""
+import hashlib
+import io
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from dvf_communes import registry
+from dvf_cube import build_cube, merge_cubes
+from dvf_filters import FilterEngine
+from dvf_http import PREFETCH_WORKERS, RETRY_AFTER, cache_validator, commune_url, fetch_cached, prefetch_urls
+from dvf_profiling import count_cache
+from dvf_spatial import SpatialIndex, add_cell_keys
+
+logger = logging.getLogger(__name__)
+
+# Dossier du cache colonnaire (à côté du CSV source)
+CACHE_DIR = ".dvf_cache"
+
+# Nombre de lignes lues par bloc en mode streaming
+CHUNK_ROWS = 200_000
+
+# Version des règles de nettoyage : à incrémenter quand clean_dvf change, pour
+# invalider les fichiers partagés déjà publiés (voir publish_shared)
+VERSION_NETTOYAGE = 4
+
+# Détection des prix au m² aberrants (DVF_OUTLIERS) : "iqr", "mad" ou "aucune"
+METHODE_ABERRANTS = os.environ.get("DVF_OUTLIERS", "iqr")
+
+# Seuil par méthode : k × écart interquartile au-delà des quartiles, ou score z robuste (MAD)
+SEUILS_ABERRANTS = {"iqr": 1.5, "mad": 3.5}
+
+# En dessous de ce nombre de ventes, un groupe commune × type de bien reprend les bornes
+# calculées sur tout le tableau pour ce type (sans bornes fiables, rien n'est signalé)
+MIN_VENTES_GROUPE = 20
+
+# Millésimes DVF proposés dans les dashboards
+ANNEES = list(range(2019, 2025))
+
+# Nombre de combinaisons commune × années gardées en mémoire (tableaux concaténés)
+MAX_COMBINAISONS = 8
+
+# Délai sans modification après lequel un fichier source modifié est relu (secondes) :
+# un fichier en cours de copie n'est pas pris pour une nouvelle version
+FICHIER_STABLE = 60
+
+# Types de biens conservés par le nettoyage
+TYPES_LOCAUX = ['Maison', 'Appartement']
+
+# Colonnes à faible cardinalité stockées en catégories
+COLONNES_CATEGORIES = ["nature_mutation", "code_postal", "code_commune", "nom_commune", "type_local", "adresse_nom_voie"]
+
+# Colonnes numériques réduites en float32 (précision largement suffisante pour l'affichage)
+COLONNES_FLOAT32 = ["valeur_fonciere", "surface_reelle_bati", "nombre_pieces_principales",
+                    "surface_terrain", "longitude", "latitude", "prix_m2"]
+
+# Colonnes DVF réellement utilisées par les dashboards, avec leur type Arrow
+COLONNES_DVF = {
+    "id_mutation": pa.string(),
+    "date_mutation": pa.date32(),
+    "nature_mutation": pa.string(),
+    "valeur_fonciere": pa.float64(),
+    "adresse_numero": pa.string(),
+    "adresse_nom_voie": pa.string(),
+    "code_postal": pa.string(),
+    "code_commune": pa.string(),
+    "nom_commune": pa.string(),
+    "type_local": pa.string(),
+    "surface_reelle_bati": pa.float64(),
+    "nombre_pieces_principales": pa.float64(),
+    "surface_terrain": pa.float64(),
+    "longitude": pa.float64(),
+    "latitude": pa.float64(),
+}
+
+
+def source_key(csv_path: str) -> str:
+    """
+    Clé de cache du fichier source, calculée à partir de sa taille et de sa date
+    de modification (hacher 600 Mo à chaque démarrage coûterait trop cher).
+    """
+    stat = os.stat(csv_path)
+    raw = f"{os.path.abspath(csv_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def files_key(chemins) -> str:
+    """
+    Clé d'un ensemble de fichiers sources (voir source_key).
+    """
+    return "|".join(source_key(chemin) for chemin in chemins)
+
+
+def files_changed(chemins, cle_chargee: str) -> bool:
+    """
+    Vrai si les fichiers ne correspondent plus à `cle_chargee` (clé relevée au
+    chargement) et n'ont pas été modifiés depuis FICHIER_STABLE secondes. Des
+    fichiers disparus ne sont pas un changement : les données chargées restent.
+    """
+    chemins = [c for c in chemins if os.path.exists(c)]
+    if cle_chargee is None or not chemins or files_key(chemins) == cle_chargee:
+        return False
+    return time.time() - max(os.stat(c).st_mtime for c in chemins) >= FICHIER_STABLE
+
+
+def parquet_path_for(csv_path: str) -> str:
+    """
+    Chemin du fichier Parquet correspondant à la version courante du CSV.
+    """
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(csv_path)), CACHE_DIR)
+    return os.path.join(cache_dir, f"{base}-{source_key(csv_path)}.parquet")
+
+
+def convert_csv_to_parquet(csv_path: str, parquet_path: str = None, garder=()) -> str:
+    """
+    Convertit le CSV DVF en Parquet typé, en ne gardant que COLONNES_DVF.
+
+    La lecture se fait par blocs (pyarrow.csv.open_csv), la mémoire consommée reste
+    donc de l'ordre d'un bloc et non du fichier entier. L'écriture passe par un
+    fichier temporaire renommé à la fin pour ne jamais laisser un Parquet partiel.
+    Les anciennes versions sont supprimées, sauf celles de `garder` (encore lues).
+    """
+    if parquet_path is None:
+        parquet_path = parquet_path_for(csv_path)
+    os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+
+    # Seules les colonnes présentes dans le fichier sont demandées
+    with open(csv_path, "r", encoding="utf-8") as f:
+        header = f.readline().strip().split(",")
+    colonnes = [c for c in COLONNES_DVF if c in header]
+
+    reader = pa_csv.open_csv(
+        csv_path,
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=colonnes,
+            column_types={c: COLONNES_DVF[c] for c in colonnes},
+            strings_can_be_null=True,
+        ),
+    )
+    tmp_path = parquet_path + ".tmp"
+    try:
+        with pq.ParquetWriter(tmp_path, reader.schema, compression="zstd") as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+        os.replace(tmp_path, parquet_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # Nettoyage des anciennes versions du cache pour ce fichier
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    cache_dir = os.path.dirname(parquet_path)
+    for name in os.listdir(cache_dir):
+        old = os.path.join(cache_dir, name)
+        if name.startswith(f"{base}-") and name.endswith(".parquet") and old != parquet_path and old not in garder:
+            os.remove(old)
+
+    return parquet_path
+
+
+def read_dvf(csv_path: str, columns: list = None) -> pd.DataFrame:
+    """
+    Charge le fichier DVF via son cache Parquet (créé au premier appel).
+    Seules les colonnes demandées sont lues, en mémoire mappée.
+    """
+    parquet_path = parquet_path_for(csv_path)
+    if not os.path.exists(parquet_path):
+        convert_csv_to_parquet(csv_path, parquet_path)
+    return read_parquet(parquet_path, columns)
+
+
+def read_parquet(parquet_path: str, columns: list = None) -> pd.DataFrame:
+    """
+    Lit un fichier Parquet DVF en mémoire mappée, uniquement les colonnes demandées.
+    """
+    if columns is not None:
+        disponibles = pq.read_schema(parquet_path).names
+        columns = [c for c in columns if c in disponibles]
+
+    # Les colonnes catégorielles sont lues en dictionnaire : pas de chaîne Python par ligne
+    table = pq.read_table(parquet_path, columns=columns, memory_map=True,
+                          read_dictionary=COLONNES_CATEGORIES)
+    df = table.to_pandas()
+    # date32 -> datetime64 pour rester compatible avec le reste du dashboard
+    if "date_mutation" in df.columns:
+        df["date_mutation"] = pd.to_datetime(df["date_mutation"], errors="coerce")
+    return df
+
+
+def shared_path_for(csv_path: str) -> str:
+    """
+    Chemin du fichier Arrow partagé contenant les données nettoyées du CSV. La méthode
+    et le seuil des prix aberrants (DVF_OUTLIERS) font partie du nom : la colonne
+    `aberrant` et les bornes publiées en dépendent.
+    """
+    seuil = SEUILS_ABERRANTS.get(METHODE_ABERRANTS)
+    reglage = METHODE_ABERRANTS if seuil is None else f"{METHODE_ABERRANTS}{seuil:g}"
+    return parquet_path_for(csv_path)[:-len(".parquet")] + f".clean-v{VERSION_NETTOYAGE}-{reglage}.arrow"
+
+
+def publish_shared(df: pd.DataFrame, arrow_path: str, bornes: pd.DataFrame = None) -> str:
+    """
+    Écrit les données nettoyées (triées par commune) dans un fichier Arrow IPC non
+    compressé, relu ensuite en mémoire mappée par toutes les sessions et tous les
+    processus. Les bornes des prix aberrants (voir flag_outliers) sont rangées dans
+    les métadonnées du fichier. Écriture dans un fichier temporaire renommé à la fin :
+    deux processus qui publient en même temps produisent le même contenu, le dernier
+    renommage gagne.
+    """
+    os.makedirs(os.path.dirname(arrow_path), exist_ok=True)
+    df = df[df["code_commune"].notna()].sort_values("code_commune", kind="stable", ignore_index=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if bornes is not None:
+        table = table.replace_schema_metadata({**table.schema.metadata,
+                                               b"dvf.bornes": bornes.to_json(orient="split").encode()})
+    tmp_path = f"{arrow_path}.{os.getpid()}.tmp"
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, arrow_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # Nettoyage des anciennes versions (les processus qui les ont encore mappées gardent leur copie)
+    base = os.path.basename(arrow_path).split(".clean-v")[0].rsplit("-", 1)[0]
+    cache_dir = os.path.dirname(arrow_path)
+    for name in os.listdir(cache_dir):
+        old = os.path.join(cache_dir, name)
+        if name.startswith(f"{base}-") and ".clean-v" in name and name.endswith(".arrow") and old != arrow_path:
+            os.remove(old)
+    return arrow_path
+
+
+def open_shared(arrow_path: str):
+    """
+    Relit un fichier publié par publish_shared en mémoire mappée. Les colonnes
+    numériques et les dates pointent directement dans le fichier (aucune copie :
+    les pages sont partagées par le système entre tous les processus) ; seuls les
+    codes des catégories sont recopiés. Le tableau est en lecture seule.
+    Renvoie le tableau et les bornes des prix aberrants (None si absentes).
+    """
+    table = pa.ipc.open_file(pa.memory_map(arrow_path, "r")).read_all()
+    meta = table.schema.metadata or {}
+    bornes = pd.read_json(io.StringIO(meta[b"dvf.bornes"].decode()), orient="split",
+                          dtype={"code_commune": str}) if b"dvf.bornes" in meta else None
+    return table.to_pandas(split_blocks=True, self_destruct=False), bornes
+
+
+def clean_dvf(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Nettoyage commun des données DVF : conversions, filtre Maison/Appartement,
+    suppression des valeurs manquantes et calcul du prix au m². Les prix aberrants
+    ne sont pas supprimés ici mais signalés ensuite par flag_outliers, qui a besoin
+    du tableau complet. Peut être appliqué au fichier entier ou bloc par bloc.
+    """
+    df = df[df["type_local"].isin(TYPES_LOCAUX)]
+    if df.empty:
+        return df
+
+    df = df.assign(
+        date_mutation=pd.to_datetime(df["date_mutation"], format='%Y-%m-%d', errors='coerce'),
+        valeur_fonciere=pd.to_numeric(df["valeur_fonciere"], errors='coerce'),
+        surface_reelle_bati=pd.to_numeric(df["surface_reelle_bati"], errors='coerce'),
+    )
+    df = df.dropna(subset=["valeur_fonciere", "surface_reelle_bati", "code_postal", "date_mutation"])
+
+    df = df.assign(prix_m2=df['valeur_fonciere'] / df['surface_reelle_bati'])
+    df = df[np.isfinite(df['prix_m2']) & (df['prix_m2'] > 0)]
+    return df
+
+
+def dedupe_mutations(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Regroupe les lignes d'une même mutation (plusieurs lots vendus ensemble) en une
+    seule vente. DVF répète la valeur foncière de la mutation sur chaque lot : la
+    diviser par la surface de chaque ligne fausse le prix au m², et compter chaque
+    ligne gonfle le nombre de transactions.
+
+    Les lignes sont groupées par id_mutation × code_commune sans boucle Python : la
+    surface bâtie et le nombre de pièces sont sommés, la ligne de plus grande surface
+    donne le type de bien dominant et les autres colonnes, et le prix au m² est
+    recalculé sur la surface totale. La colonne nombre_lots garde le nombre de lignes.
+    """
+    if df.empty or "id_mutation" not in df.columns:
+        return df
+
+    mutation = pd.factorize(df["id_mutation"], use_na_sentinel=False)[0].astype("int64")
+    commune = pd.factorize(df["code_commune"], use_na_sentinel=False)[0]
+    groupe = pd.factorize(mutation * (commune.max() + 1) + commune)[0]
+    n_groupes = int(groupe.max()) + 1
+    lots = np.bincount(groupe, minlength=n_groupes).astype("int16")
+    if n_groupes == len(df):
+        return df.assign(nombre_lots=lots[groupe])
+
+    surface = df["surface_reelle_bati"].to_numpy(dtype="float64")
+    surfaces = np.bincount(groupe, weights=surface, minlength=n_groupes)
+
+    # Ligne représentative : la plus grande surface de chaque mutation (la première en cas d'égalité)
+    ordre = np.lexsort((-surface, groupe))
+    premieres = ordre[np.r_[True, groupe[ordre][1:] != groupe[ordre][:-1]]]
+    ventes = df.iloc[premieres]
+    g = groupe[premieres]
+
+    colonnes = {"surface_reelle_bati": surfaces[g], "nombre_lots": lots[g]}
+    if "nombre_pieces_principales" in df.columns:
+        pieces = np.nan_to_num(df["nombre_pieces_principales"].to_numpy(dtype="float64"))
+        colonnes["nombre_pieces_principales"] = np.bincount(groupe, weights=pieces, minlength=n_groupes)[g]
+    colonnes["prix_m2"] = ventes["valeur_fonciere"].to_numpy(dtype="float64") / colonnes["surface_reelle_bati"]
+    return ventes.assign(**colonnes).reset_index(drop=True)
+
+
+def finalize_clean(df: pd.DataFrame):
+    """
+    Étapes d'ingestion qui ont besoin du tableau nettoyé complet (et non d'un bloc) :
+    regroupement des mutations multi-lots, types compacts, signalement des prix
+    aberrants, clés de l'index spatial (voir dvf_spatial.py). Renvoie le tableau et
+    les bornes des prix aberrants.
+    """
+    df, bornes = flag_outliers(compact_dtypes(dedupe_mutations(df)))
+    return add_cell_keys(df), bornes
+
+
+def _outlier_groups(df: pd.DataFrame, methode: str, seuil: float):
+    """
+    Bornes (log) par groupe commune × type de bien et numéro de groupe de chaque ligne.
+    """
+    log_prix = pd.Series(np.log(df["prix_m2"].to_numpy(dtype="float64")), index=df.index)
+
+    def bornes(groupes) -> pd.DataFrame:
+        n = groupes.size()
+        if methode == "iqr":
+            q = groupes.quantile([0.25, 0.75]).unstack()
+            ecart = q[0.75] - q[0.25]
+            basse, haute = q[0.25] - seuil * ecart, q[0.75] + seuil * ecart
+        else:
+            centre = groupes.median()
+            ecart_abs = (log_prix - groupes.transform("median")).abs()
+            mad = ecart_abs.groupby(groupes.ngroup().to_numpy()).median().to_numpy() * 1.4826
+            basse, haute = centre - seuil * mad, centre + seuil * mad
+        fiable = n >= MIN_VENTES_GROUPE
+        return pd.DataFrame({"n": n, "borne_basse": basse.where(fiable), "borne_haute": haute.where(fiable)})
+
+    groupes = log_prix.groupby([df["code_commune"], df["type_local"]], observed=True)
+    par_groupe = bornes(groupes)
+    par_groupe.index.names = ["code_commune", "type_local"]
+
+    # Groupes trop petits : bornes du type de bien sur tout le tableau
+    par_type = bornes(log_prix.groupby(df["type_local"], observed=True))
+    types = par_groupe.index.get_level_values("type_local")
+    petits = par_groupe["borne_basse"].isna().to_numpy()
+    for col in ("borne_basse", "borne_haute"):
+        par_groupe.loc[petits, col] = par_type[col].reindex(types[petits]).to_numpy()
+    return par_groupe, groupes.ngroup().to_numpy()
+
+
+def outlier_bounds(df: pd.DataFrame, methode: str = None, seuil: float = None) -> pd.DataFrame:
+    """
+    Bornes des prix au m² par commune × type de bien, en une passe groupby vectorisée.
+
+    Les bornes sont calculées sur le logarithme du prix au m² (distribution très
+    asymétrique) : quartiles ± seuil × écart interquartile ("iqr") ou médiane ±
+    seuil × MAD normalisée ("mad"). Renvoie un tableau (code_commune, type_local,
+    n, borne_basse, borne_haute) en €/m² ; les bornes sont NaN quand le groupe et
+    son type de bien ont moins de MIN_VENTES_GROUPE ventes.
+    """
+    methode = methode or METHODE_ABERRANTS
+    seuil = SEUILS_ABERRANTS[methode] if seuil is None else seuil
+    par_groupe, _ = _outlier_groups(df, methode, seuil)
+    return np.exp(par_groupe[["borne_basse", "borne_haute"]]).assign(n=par_groupe["n"]).reset_index()
+
+
+def flag_outliers(df: pd.DataFrame, methode: str = None, seuil: float = None):
+    """
+    Ajoute la colonne booléenne `aberrant` (prix au m² hors des bornes de son groupe
+    commune × type de bien, voir outlier_bounds). Les lignes sont conservées : le
+    filtre est appliqué à l'affichage. Renvoie le tableau et ses bornes.
+    """
+    methode = methode or METHODE_ABERRANTS
+    if df.empty or methode == "aucune":
+        vide = pd.DataFrame(columns=["code_commune", "type_local", "borne_basse", "borne_haute", "n"])
+        return df.assign(aberrant=False), vide
+
+    seuil = SEUILS_ABERRANTS[methode] if seuil is None else seuil
+    par_groupe, groupe = _outlier_groups(df, methode, seuil)
+    log_prix = np.log(df["prix_m2"].to_numpy(dtype="float64"))
+    aberrant = ((log_prix < par_groupe["borne_basse"].to_numpy()[groupe])
+                | (log_prix > par_groupe["borne_haute"].to_numpy()[groupe]))
+    bornes = np.exp(par_groupe[["borne_basse", "borne_haute"]]).assign(n=par_groupe["n"]).reset_index()
+    return df.assign(aberrant=aberrant), bornes
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Réduit l'empreinte mémoire du tableau nettoyé : catégories pour les colonnes
+    texte à faible cardinalité (dont codes postaux et INSEE), float32 pour les
+    prix, surfaces et coordonnées.
+    """
+    conversions = {}
+    for col in COLONNES_CATEGORIES:
+        if col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                conversions[col] = df[col].cat.remove_unused_categories()
+            else:
+                conversions[col] = df[col].astype("category")
+    for col in COLONNES_FLOAT32:
+        if col in df.columns:
+            conversions[col] = df[col].astype("float32")
+    return df.assign(**conversions)
+
+
+def iter_csv_chunks(csv_path: str, chunksize: int = CHUNK_ROWS):
+    """
+    Lit le CSV DVF par blocs de `chunksize` lignes, colonnes élaguées.
+    Les codes (postal, commune) restent des chaînes pour conserver les zéros initiaux.
+    """
+    with open(csv_path, "r", encoding="utf-8") as f:
+        header = f.readline().strip().split(",")
+
+    yield from pd.read_csv(csv_path, sep=',', chunksize=chunksize, **_csv_options(header))
+
+
+def _csv_options(header: list) -> dict:
+    """
+    Options pandas.read_csv communes : colonnes élaguées, codes lus en texte.
+    """
+    colonnes = [c for c in COLONNES_DVF if c in header]
+    dtypes = {c: str for c in colonnes if COLONNES_DVF[c] == pa.string()}
+    return {"usecols": colonnes, "dtype": dtypes}
+
+
+def read_csv_bytes(contenu: bytes) -> pd.DataFrame:
+    """
+    Lit un CSV DVF déjà en mémoire (fichier par commune), colonnes élaguées.
+    """
+    header = contenu.split(b"\n", 1)[0].decode("utf-8").strip().split(",")
+    return pd.read_csv(io.BytesIO(contenu), sep=',', **_csv_options(header))
+
+
+def load_clean_streaming(csv_path: str, chunksize: int = CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Charge et nettoie le CSV bloc par bloc : la mémoire maximale suit la taille
+    du résultat nettoyé et non celle du fichier brut.
+    """
+    morceaux = []
+    for chunk in iter_csv_chunks(csv_path, chunksize):
+        chunk = clean_dvf(chunk)
+        if not chunk.empty:
+            morceaux.append(chunk)
+
+    if not morceaux:
+        return pd.DataFrame()
+    return pd.concat(morceaux, ignore_index=True)
+
+
+def partition_by_commune(df: pd.DataFrame) -> dict:
+    """
+    Découpe les données nettoyées par code INSEE : {code_commune: sous-tableau}.
+
+    Le tableau est trié une seule fois par commune, chaque partition est une tranche
+    contiguë de ce tableau. Changer de commune devient une simple recherche dans le
+    dictionnaire, sans parcourir ni copier le département entier.
+    Les partitions sont partagées : elles ne doivent pas être modifiées en place.
+    """
+    if df.empty:
+        return {}
+
+    if df["code_commune"].isna().any():
+        df = df[df["code_commune"].notna()]
+    codes = df["code_commune"].to_numpy()
+    debuts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    # Un tableau déjà groupé par commune (fichier partagé, voir publish_shared) est découpé sans copie
+    if len(debuts) != df["code_commune"].nunique():
+        df = df.sort_values("code_commune", kind="stable", ignore_index=True)
+        codes = df["code_commune"].to_numpy()
+        # Début de chaque commune dans le tableau trié, la fin est le début de la suivante
+        debuts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    fins = np.r_[debuts[1:], len(codes)]
+    return {codes[a]: df.iloc[a:b] for a, b in zip(debuts, fins)}
+
+
+# --- Sources de données ---
+
+class DvfSource:
+    """
+    Source de données DVF nettoyées. Les sous-classes fournissent load_all() ;
+    le découpage par commune est calculé une fois et gardé dans l'instance.
+    """
+
+    def __init__(self):
+        self.version = next(_numeros)
+        self._lock = threading.RLock()
+        self._partitions = None
+        self._bornes = None
+        self._cubes = {}
+        self._engines = {}
+        self._index = {}
+
+    def load_all(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def partitions(self) -> dict:
+        """
+        Données nettoyées découpées par commune (voir partition_by_commune).
+        """
+        with self._lock:
+            count_cache("partitions", self._partitions is not None)
+            if self._partitions is None:
+                self._partitions = partition_by_commune(self.load_all())
+            return self._partitions
+
+    def load_commune(self, insee_code: str) -> pd.DataFrame:
+        """
+        Données nettoyées d'une commune (tableau vide si aucune vente).
+        """
+        return self.partitions().get(insee_code, pd.DataFrame())
+
+    def load_communes(self, insee_codes) -> dict:
+        """
+        Données de plusieurs communes : {code: tableau}. Les communes en erreur sont
+        absentes du résultat (l'erreur est journalisée).
+        """
+        resultats = {}
+        for code in insee_codes:
+            try:
+                resultats[code] = self.load_commune(code)
+            except Exception as e:
+                logger.warning("Chargement impossible pour la commune %s : %s", code, e)
+        return resultats
+
+    def outlier_bounds(self, insee_code: str) -> pd.DataFrame:
+        """
+        Bornes des prix au m² aberrants de la commune, par type de bien (voir flag_outliers).
+        """
+        self.partitions()
+        if self._bornes is None:
+            return pd.DataFrame()
+        return self._bornes[self._bornes["code_commune"] == insee_code]
+
+    def commune_cube(self, insee_code: str) -> dict:
+        """
+        Cube d'agrégats de la commune (voir dvf_cube.py), calculé une fois puis mémorisé.
+        """
+        with self._lock:
+            count_cache("cube", insee_code in self._cubes)
+            if insee_code in self._cubes:
+                return self._cubes[insee_code]
+        df = self.load_commune(insee_code)
+        cube = build_cube(df)
+        with self._lock:
+            if not self.is_stale(insee_code):
+                self._cubes[insee_code] = cube
+        return cube
+
+    def filter_engine(self, insee_code: str) -> FilterEngine:
+        """
+        Moteur de filtres de la commune (voir dvf_filters.py), partagé entre sessions.
+        """
+        with self._lock:
+            count_cache("filter_engine", insee_code in self._engines)
+            if insee_code in self._engines:
+                return self._engines[insee_code]
+        engine = FilterEngine(self.load_commune(insee_code))
+        with self._lock:
+            if not self.is_stale(insee_code):
+                self._engines[insee_code] = engine
+        return engine
+
+    def spatial_index(self, insee_code: str) -> SpatialIndex:
+        """
+        Index spatial des ventes de la commune (voir dvf_spatial.py), partagé entre sessions.
+        """
+        with self._lock:
+            count_cache("index_spatial", insee_code in self._index)
+            if insee_code in self._index:
+                return self._index[insee_code]
+        index = SpatialIndex(self.load_commune(insee_code))
+        with self._lock:
+            if not self.is_stale(insee_code):
+                self._index[insee_code] = index
+        return index
+
+    def prepare(self) -> bool:
+        """
+        Rend la source prête à répondre (ici : chargement et découpage par commune).
+        Renvoie False si elle ne contient aucune donnée.
+        """
+        return bool(self.partitions())
+
+    def loaded(self) -> bool:
+        """
+        Vrai si les données de la source sont en mémoire.
+        """
+        return self._partitions is not None
+
+    def row_count(self) -> int:
+        """
+        Nombre de ventes chargées.
+        """
+        with self._lock:
+            return sum(len(df) for df in (self._partitions or {}).values())
+
+    def cached_communes(self) -> list:
+        """
+        Communes dont les caches dérivés (cube, moteur de filtres, index spatial) sont en mémoire.
+        """
+        with self._lock:
+            return list(dict.fromkeys([*self._cubes, *self._engines, *self._index]))
+
+    def warm(self, insee_codes) -> bool:
+        """
+        Charge la source puis construit les caches dérivés des communes `insee_codes`
+        (reconstruction hors du chemin des requêtes, voir dvf_refresh.py).
+        Renvoie False si la source ne contient aucune donnée.
+        """
+        if not self.prepare():
+            return False
+        self._warm_derived(insee_codes)
+        return True
+
+    def _warm_derived(self, insee_codes):
+        for code in insee_codes:
+            self.commune_cube(code)
+            self.filter_engine(code)
+            self.spatial_index(code)
+
+    def changed(self) -> bool:
+        """
+        Vrai si la donnée d'origine a changé depuis le chargement (fichier modifié,
+        nouvel ETag distant).
+        """
+        return False
+
+    def close(self):
+        """
+        Libère les ressources d'une instance remplacée par le rafraîchissement.
+        """
+
+    def is_stale(self, insee_code: str) -> bool:
+        """
+        Vrai si les données de la commune viennent d'une copie locale non revalidée.
+        """
+        return False
+
+    def available(self) -> bool:
+        """
+        Vrai si la source peut être chargée (fichier présent...).
+        """
+        return True
+
+
+class LocalCsvSource(DvfSource):
+    """
+    Fichier DVF départemental local (dvf_2024.csv), lu via son cache Parquet
+    ou, en mode streaming, nettoyé bloc par bloc.
+
+    Avec shared=True, le résultat nettoyé est publié une fois dans un fichier Arrow
+    (voir publish_shared) que chaque processus relit en mémoire mappée : les
+    serveurs lancés en parallèle partagent les mêmes pages au lieu d'en garder
+    chacun une copie.
+    """
+
+    def __init__(self, csv_path: str = "dvf_2024.csv", streaming: bool = False, shared: bool = False):
+        super().__init__()
+        self.csv_path = csv_path
+        self.streaming = streaming
+        self.shared = shared
+        self._cle_source = None
+
+    def available(self) -> bool:
+        return os.path.exists(self.csv_path)
+
+    def changed(self) -> bool:
+        return files_changed([self.csv_path], self._cle_source)
+
+    def load_all(self) -> pd.DataFrame:
+        if not os.path.exists(self.csv_path):
+            raise FileNotFoundError(self.csv_path)
+        self._cle_source = source_key(self.csv_path)
+
+        if self.shared:
+            arrow_path = shared_path_for(self.csv_path)
+            count_cache("fichier_partage", os.path.exists(arrow_path))
+            if not os.path.exists(arrow_path):
+                df = self._load_clean()
+                if df.empty:
+                    return df
+                publish_shared(df, arrow_path, self._bornes)
+            df, self._bornes = open_shared(arrow_path)
+            return df
+        return self._load_clean()
+
+    def _load_clean(self) -> pd.DataFrame:
+        if self.streaming:
+            df = load_clean_streaming(self.csv_path)
+        else:
+            df = clean_dvf(read_dvf(self.csv_path))
+
+        if df.empty:
+            return pd.DataFrame()
+        df, self._bornes = finalize_clean(df)
+        return df
+
+
+class ParquetSource(DvfSource):
+    """
+    Fichier DVF déjà au format Parquet (par exemple produit par convert_csv_to_parquet).
+    """
+
+    def __init__(self, parquet_path: str):
+        super().__init__()
+        self.parquet_path = parquet_path
+        self._cle_source = None
+
+    def changed(self) -> bool:
+        return files_changed([self.parquet_path], self._cle_source)
+
+    def load_all(self) -> pd.DataFrame:
+        if not os.path.exists(self.parquet_path):
+            raise FileNotFoundError(self.parquet_path)
+        self._cle_source = source_key(self.parquet_path)
+
+        df = clean_dvf(read_parquet(self.parquet_path))
+        if df.empty:
+            return pd.DataFrame()
+        df, self._bornes = finalize_clean(df)
+        return df
+
+
+class HttpCommuneSource(DvfSource):
+    """
+    Fichiers DVF par commune sur data.gouv.fr, téléchargés à la demande via le
+    cache disque de dvf_http puis gardés nettoyés en mémoire.
+    """
+
+    def __init__(self, annee: int = 2024, departement: str = "33"):
+        super().__init__()
+        self.annee = annee
+        self.departement = departement
+        self._communes = {}
+        self._bornes_communes = {}
+        self._validateurs = {}
+        # Communes servies depuis une copie périmée : heure de la prochaine tentative
+        self._perimes = {}
+        self._warmup = None
+
+    def url(self, insee_code: str) -> str:
+        return commune_url(insee_code, self.annee, self.departement)
+
+    def load_commune(self, insee_code: str) -> pd.DataFrame:
+        """
+        Télécharge (ou relit du cache) et nettoie les données d'une commune.
+        Les erreurs réseau sans copie locale sont propagées (requests.exceptions.RequestException).
+        Une copie périmée est gardée en mémoire jusqu'à la tentative suivante (RETRY_AFTER).
+        """
+        with self._lock:
+            present = (insee_code in self._communes
+                       and time.time() < self._perimes.get(insee_code, float("inf")))
+            count_cache("commune", present)
+            if present:
+                return self._communes[insee_code]
+
+        contenu, perime = fetch_cached(self.url(insee_code))
+        validateur = cache_validator(self.url(insee_code))
+        df = clean_dvf(read_csv_bytes(contenu))
+        df, bornes = finalize_clean(df) if not df.empty else (pd.DataFrame(), None)
+
+        with self._lock:
+            self._communes[insee_code] = df
+            if perime:
+                self._perimes[insee_code] = time.time() + RETRY_AFTER
+            else:
+                self._perimes.pop(insee_code, None)
+                self._validateurs[insee_code] = validateur
+            self._bornes_communes[insee_code] = bornes
+        return df
+
+    def load_communes(self, insee_codes) -> dict:
+        """
+        Télécharge et nettoie plusieurs communes en parallèle (au plus PREFETCH_WORKERS à la fois).
+        """
+        codes = list(dict.fromkeys(insee_codes))
+        resultats = {}
+        with ThreadPoolExecutor(max_workers=min(PREFETCH_WORKERS, max(1, len(codes))),
+                                thread_name_prefix="dvf-communes") as pool:
+            futures = {code: pool.submit(self.load_commune, code) for code in codes}
+            for code, future in futures.items():
+                try:
+                    resultats[code] = future.result()
+                except Exception as e:
+                    logger.warning("Chargement impossible pour la commune %s : %s", code, e)
+        return resultats
+
+    def outlier_bounds(self, insee_code: str) -> pd.DataFrame:
+        """
+        Bornes des prix aberrants de la commune, calculées sur son seul fichier.
+        """
+        self.load_commune(insee_code)
+        bornes = self._bornes_communes.get(insee_code)
+        return bornes if bornes is not None else pd.DataFrame()
+
+    def is_stale(self, insee_code: str) -> bool:
+        with self._lock:
+            return insee_code in self._perimes
+
+    def loaded(self) -> bool:
+        with self._lock:
+            return bool(self._communes)
+
+    def row_count(self) -> int:
+        with self._lock:
+            return sum(len(df) for df in self._communes.values())
+
+    def cached_communes(self) -> list:
+        with self._lock:
+            return list(dict.fromkeys([*self._communes, *super().cached_communes()]))
+
+    def warm(self, insee_codes) -> bool:
+        """
+        Télécharge en parallèle les communes `insee_codes` puis construit leurs caches dérivés.
+        Renvoie False si aucune n'a pu être chargée.
+        """
+        codes = list(insee_codes)
+        charges = self.load_communes(codes)
+        if codes and not charges:
+            return False
+        self._warm_derived(charges)
+        return True
+
+    def changed(self) -> bool:
+        """
+        Revalide (requêtes conditionnelles) les fichiers des communes en mémoire : vrai
+        si l'un d'eux a un nouvel ETag / Last-Modified depuis son chargement.
+        """
+        with self._lock:
+            validateurs = dict(self._validateurs)
+        if not validateurs:
+            return False
+        prefetch_urls([self.url(code) for code in validateurs], max_age=0)
+        return any(cache_validator(self.url(code)) != v for code, v in validateurs.items())
+
+    def load_all(self) -> pd.DataFrame:
+        """
+        Toutes les communes du référentiel (préchargées en parallèle).
+        """
+        self.prefetch(registry().communes)
+        with self._lock:
+            morceaux = [df for df in self._communes.values() if not df.empty]
+        if not morceaux:
+            return pd.DataFrame()
+        return compact_dtypes(pd.concat(morceaux, ignore_index=True))
+
+    def prefetch(self, insee_codes):
+        """
+        Télécharge en parallèle les communes puis nettoie celles qui ont réussi.
+        Les échecs ne sont pas mémorisés, pour ne pas garder un résultat vide dû
+        à une erreur réseau passagère.
+        """
+        codes = list(insee_codes)
+        erreurs = prefetch_urls([self.url(code) for code in codes])
+        for code in codes:
+            if erreurs.get(self.url(code)) is None:
+                try:
+                    self.load_commune(code)
+                except Exception as e:
+                    logger.warning("Nettoyage impossible pour la commune %s : %s", code, e)
+
+    def start_warmup(self, insee_codes=None) -> threading.Thread:
+        """
+        Lance une seule fois le préchargement en tâche de fond (toutes les communes par défaut).
+        """
+        with self._lock:
+            if self._warmup is None:
+                codes = list(insee_codes if insee_codes is not None else registry().communes)
+                self._warmup = threading.Thread(target=self.prefetch, args=(codes,),
+                                                name="dvf-warmup", daemon=True)
+                self._warmup.start()
+            return self._warmup
+
+
+class MultiYearSource:
+    """
+    Historique multi-années : une source par millésime, chargée seulement quand
+    la période sélectionnée la demande. Chaque année reste une partition en cache
+    séparée ; seules les combinaisons effectivement affichées sont concaténées.
+    """
+
+    def __init__(self, source_for_year):
+        self.source_for_year = source_for_year
+        self._combinaisons = {}
+        self._index = {}
+        self._lock = threading.Lock()
+        self._figees = None
+
+    def source(self, annee: int) -> DvfSource:
+        if self._figees is None:
+            return self.source_for_year(annee)
+        return self._figees.setdefault(annee, self.source_for_year(annee))
+
+    def snapshot(self) -> "MultiYearSource":
+        """
+        Vue de l'historique figée sur les instances des sources au premier accès à
+        chaque année : toutes les lectures d'un rerun (ou d'une requête) portent sur la
+        même version des données, même si le rafraîchissement (voir dvf_refresh.py) en
+        publie une nouvelle entre-temps. Les caches de combinaisons sont partagés avec
+        l'historique : leurs clés portent la version des sources.
+        """
+        vue = MultiYearSource(self.source_for_year)
+        vue._combinaisons, vue._index, vue._lock = self._combinaisons, self._index, self._lock
+        vue._figees = {}
+        return vue
+
+    def _versions(self, annees) -> tuple:
+        return tuple(self.source(a).version for a in annees)
+
+    def available_years(self, annees) -> list:
+        return [a for a in annees if self.source(a).available()]
+
+    def load_commune(self, insee_code: str, annees) -> pd.DataFrame:
+        """
+        Données nettoyées de la commune sur les années demandées.
+        """
+        if len(annees) == 1:
+            return self.source(annees[0]).load_commune(insee_code)
+        return self._combinaison(insee_code, annees)[0]
+
+    def filter_engine(self, insee_code: str, annees) -> FilterEngine:
+        if len(annees) == 1:
+            return self.source(annees[0]).filter_engine(insee_code)
+        return self._combinaison(insee_code, annees)[1]
+
+    def spatial_index(self, insee_code: str, annees) -> SpatialIndex:
+        """
+        Index spatial des ventes renvoyées par load_commune(insee_code, annees).
+        """
+        if len(annees) == 1:
+            return self.source(annees[0]).spatial_index(insee_code)
+        cle = (insee_code, tuple(sorted(annees)), self._versions(sorted(annees)))
+        with self._lock:
+            count_cache("index_spatial", cle in self._index)
+            if cle in self._index:
+                return self._index[cle]
+        index = SpatialIndex(self.load_commune(insee_code, annees))
+        with self._lock:
+            self._index[cle] = index
+            if len(self._index) > MAX_COMBINAISONS:
+                self._index.pop(next(iter(self._index)))
+        return index
+
+    def commune_cube(self, insee_code: str, annees) -> dict:
+        """
+        Cube fusionné des cubes annuels (aucun recalcul sur les lignes brutes).
+        """
+        return merge_cubes(self.yearly_cubes(insee_code, annees))
+
+    def yearly_cubes(self, insee_code: str, annees) -> list:
+        return [self.source(a).commune_cube(insee_code) for a in annees]
+
+    def commune_cubes(self, insee_codes, annees) -> dict:
+        """
+        Cubes de plusieurs communes sur la période : {code: cube fusionné}. Les communes
+        de chaque année sont chargées ensemble (en parallèle pour les sources HTTP) ; une
+        commune sans données ou en erreur a un cube vide.
+        """
+        codes = list(dict.fromkeys(insee_codes))
+        charges = {a: self.source(a).load_communes(codes) for a in annees}
+        return {code: merge_cubes([self.source(a).commune_cube(code) for a in annees if code in charges[a]])
+                for code in codes}
+
+    def outlier_bounds(self, insee_code: str, annees) -> pd.DataFrame:
+        """
+        Bornes des prix aberrants de la commune, une série par année (chaque millésime
+        est signalé par rapport à ses propres prix).
+        """
+        bornes = [self.source(a).outlier_bounds(insee_code).assign(annee=a) for a in annees]
+        bornes = [b for b in bornes if not b.empty]
+        return pd.concat(bornes, ignore_index=True) if bornes else pd.DataFrame()
+
+    def _combinaison(self, insee_code: str, annees):
+        annees = tuple(sorted(annees))
+        cle = (insee_code, annees, self._versions(annees))
+        with self._lock:
+            count_cache("combinaison", cle in self._combinaisons)
+            if cle in self._combinaisons:
+                return self._combinaisons[cle]
+
+        morceaux = [self.source(a).load_commune(insee_code) for a in annees]
+        morceaux = [m for m in morceaux if not m.empty]
+        df = compact_dtypes(pd.concat(morceaux, ignore_index=True)) if morceaux else pd.DataFrame()
+        resultat = (df, FilterEngine(df) if not df.empty else None)
+        with self._lock:
+            self._combinaisons[cle] = resultat
+            if len(self._combinaisons) > MAX_COMBINAISONS:
+                self._combinaisons.pop(next(iter(self._combinaisons)))
+        return resultat
+
+
+def _duckdb_source(**options) -> DvfSource:
+    # Import différé : DuckDB est optionnel et dvf_duckdb dépend de ce module
+    from dvf_duckdb import DuckDbSource
+    return DuckDbSource(**options)
+
+
+SOURCES = {
+    "csv": LocalCsvSource,
+    "parquet": ParquetSource,
+    "http": HttpCommuneSource,
+    "duckdb": _duckdb_source,
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+# Numéro des instances de sources (voir MultiYearSource) et nombre de remplacements publiés
+_numeros = itertools.count(1)
+_generation = 0
+
+
+def get_source(kind: str, **options) -> DvfSource:
+    """
+    Instance partagée d'une source ("csv", "parquet", "http" ou "duckdb") : tous les
+    dashboards d'un même processus réutilisent les mêmes données en mémoire.
+    """
+    key = (kind, tuple(sorted(options.items())))
+    with _instances_lock:
+        if key not in _instances:
+            _instances[key] = SOURCES[kind](**options)
+        return _instances[key]
+
+
+def shared_sources() -> dict:
+    """
+    Instances partagées créées par get_source : {(kind, options triées): source}.
+    """
+    with _instances_lock:
+        return dict(_instances)
+
+
+def new_source(key: tuple) -> DvfSource:
+    """
+    Nouvelle instance, non partagée, de la source de clé `key` (voir shared_sources).
+    """
+    kind, options = key
+    return SOURCES[kind](**dict(options))
+
+
+def swap_source(key: tuple, ancienne: DvfSource, nouvelle: DvfSource) -> bool:
+    """
+    Remplace atomiquement l'instance partagée `ancienne` par `nouvelle`, déjà chargée :
+    les appels suivants à get_source la renvoient, les lectures en cours terminent sur
+    l'ancienne. Renvoie False si l'instance a été remplacée entre-temps.
+    """
+    global _generation
+    with _instances_lock:
+        if _instances.get(key) is not ancienne:
+            return False
+        _instances[key] = nouvelle
+        _generation += 1
+        return True
+
+
+def sources_generation() -> int:
+    """
+    Nombre de sources remplacées depuis le démarrage (à inclure dans les clés des caches
+    de résultats qui ne dépendent pas directement d'une instance de source).
+    """
+    return _generation
+
+
+if __name__ == "__main__":
+    # Conversion ponctuelle : python dvf_data.py [dvf_2024.csv]
+    import sys
+
+    source = sys.argv[1] if len(sys.argv) > 1 else "dvf_2024.csv"
+    print(f"Conversion de {source} -> {convert_csv_to_parquet(source)}")
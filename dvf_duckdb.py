@@ -0,0 +1,275 @@
+# dvf_duckdb.py
+"""
+Source DVF hors mémoire, interrogée avec DuckDB.
+
+Les sources en mémoire (dvf_data.LocalCsvSource, ParquetSource) chargent et
+nettoient le fichier entier dans un DataFrame par processus. Pour un périmètre
+plus large que la Gironde (toute la Nouvelle-Aquitaine, plusieurs millésimes),
+DuckDbSource laisse les données sur disque : le nettoyage et le signalement des
+prix aberrants sont des vues SQL sur les fichiers Parquet, la sélection de
+commune est une requête poussée jusqu'au lecteur Parquet, et seule la commune
+affichée est matérialisée en pandas. Les filtres, les KPIs et les graphiques
+portent ensuite sur cette commune comme avec les autres sources (FilterEngine,
+cube) : les vues des dashboards reçoivent les mêmes objets.
+
+DuckDB est une dépendance optionnelle (pip install duckdb).
+"""
+import glob
+import os
+import threading
+
+import pandas as pd
+import pyarrow.compute as pc
+
+from dvf_data import (COLONNES_CATEGORIES, COLONNES_DVF, METHODE_ABERRANTS, MIN_VENTES_GROUPE, SEUILS_ABERRANTS,
+                      TYPES_LOCAUX, DvfSource, compact_dtypes, convert_csv_to_parquet, files_changed, files_key,
+                      parquet_path_for)
+from dvf_profiling import count_cache
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    duckdb = None
+
+# Limite mémoire de DuckDB (au-delà, les opérateurs débordent dans DUCKDB_TEMP_DIR)
+DUCKDB_MEMORY_LIMIT = os.environ.get("DVF_DUCKDB_MEMORY_LIMIT", "1GB")
+DUCKDB_TEMP_DIR = os.environ.get("DVF_DUCKDB_TEMP_DIR", os.path.join(".dvf_cache", "duckdb"))
+
+# Nombre de communes gardées matérialisées en mémoire
+MAX_COMMUNES = 16
+
+# Fichiers Parquet lus par une connexion ouverte : une nouvelle conversion du même CSV
+# (source rafraîchie, voir dvf_refresh.py) ne les supprime pas
+_parquet_ouverts = set()
+
+
+def _sql_list(valeurs) -> str:
+    return ", ".join("'" + str(v).replace("'", "''") + "'" for v in valeurs)
+
+
+def clean_sql(fichiers: list, colonnes: list) -> str:
+    """
+    Requête de nettoyage équivalente à dvf_data.clean_dvf puis dedupe_mutations, sur
+    des fichiers Parquet : une ligne par mutation × commune (les prix aberrants sont
+    signalés ensuite, voir bounds_sql). Le regroupement se fait sur code_commune :
+    un filtre sur la commune est donc poussé sous l'agrégation.
+    """
+    select = [("CAST(date_mutation AS TIMESTAMP) AS date_mutation" if c == "date_mutation" else c)
+              for c in colonnes]
+    lignes = f"""
+        SELECT {", ".join(select)}, valeur_fonciere / surface_reelle_bati AS prix_m2
+        FROM read_parquet([{_sql_list(fichiers)}])
+        WHERE type_local IN ({_sql_list(TYPES_LOCAUX)})
+          AND valeur_fonciere IS NOT NULL
+          AND surface_reelle_bati IS NOT NULL
+          AND code_postal IS NOT NULL
+          AND date_mutation IS NOT NULL
+          AND isfinite(valeur_fonciere / surface_reelle_bati)
+          AND valeur_fonciere / surface_reelle_bati > 0
+    """
+    if "id_mutation" not in colonnes:
+        return lignes
+
+    sommes = {
+        "surface_reelle_bati": "sum(surface_reelle_bati)",
+        "nombre_pieces_principales": "sum(coalesce(nombre_pieces_principales, 0))",
+    }
+    agregats = [c if c in ("id_mutation", "code_commune")
+                else f"{sommes.get(c, f'arg_max({c}, surface_reelle_bati)')} AS {c}" for c in colonnes]
+    return f"""
+        SELECT {", ".join(agregats)},
+               arg_max(valeur_fonciere, surface_reelle_bati) / sum(surface_reelle_bati) AS prix_m2,
+               CAST(count(*) AS SMALLINT) AS nombre_lots
+        FROM ({lignes}) AS lignes
+        GROUP BY id_mutation, code_commune
+    """
+
+
+def bounds_sql(methode: str, seuil: float) -> str:
+    """
+    Bornes des prix aberrants par commune × type de bien, équivalentes à
+    dvf_data.outlier_bounds (logarithme du prix au m², repli sur les bornes du type
+    de bien pour les petits groupes), calculées sur la vue `dvf_valide`.
+    """
+    if methode == "iqr":
+        agregats = """quantile_cont(ln(prix_m2), 0.25) - {k} * (quantile_cont(ln(prix_m2), 0.75) - quantile_cont(ln(prix_m2), 0.25)) AS basse,
+                      quantile_cont(ln(prix_m2), 0.75) + {k} * (quantile_cont(ln(prix_m2), 0.75) - quantile_cont(ln(prix_m2), 0.25)) AS haute"""
+    else:
+        agregats = """median(ln(prix_m2)) - {k} * 1.4826 * mad(ln(prix_m2)) AS basse,
+                      median(ln(prix_m2)) + {k} * 1.4826 * mad(ln(prix_m2)) AS haute"""
+    agregats = agregats.format(k=float(seuil))
+    return f"""
+        WITH groupe AS (SELECT code_commune, type_local, count(*) AS n, {agregats}
+                        FROM dvf_valide GROUP BY code_commune, type_local),
+             type AS (SELECT type_local, count(*) AS n, {agregats} FROM dvf_valide GROUP BY type_local)
+        SELECT groupe.code_commune, groupe.type_local,
+               exp(CASE WHEN groupe.n >= {MIN_VENTES_GROUPE} THEN groupe.basse
+                        WHEN type.n >= {MIN_VENTES_GROUPE} THEN type.basse END) AS borne_basse,
+               exp(CASE WHEN groupe.n >= {MIN_VENTES_GROUPE} THEN groupe.haute
+                        WHEN type.n >= {MIN_VENTES_GROUPE} THEN type.haute END) AS borne_haute,
+               groupe.n
+        FROM groupe JOIN type USING (type_local)
+    """
+
+
+class DuckDbSource(DvfSource):
+    """
+    Fichiers DVF (CSV ou Parquet, motifs glob acceptés) interrogés sur disque.
+    Les CSV sont d'abord convertis en Parquet par blocs (voir convert_csv_to_parquet).
+    Les bornes des prix aberrants sont calculées une fois, à la création de la connexion,
+    dans une petite table `bornes` jointe à la vue `dvf`.
+    """
+
+    def __init__(self, path: str, methode_aberrants: str = None):
+        if duckdb is None:
+            raise ImportError("La source 'duckdb' nécessite le paquet duckdb (pip install duckdb).")
+        super().__init__()
+        self.path = path
+        self.methode_aberrants = methode_aberrants or METHODE_ABERRANTS
+        self._communes = {}
+        self._con = None
+        self._cle_source = None
+        self._fichiers = []
+        self._prepare_lock = threading.Lock()
+
+    def files(self) -> list:
+        return sorted(glob.glob(self.path))
+
+    def available(self) -> bool:
+        return bool(self.files())
+
+    def _parquet_files(self) -> list:
+        fichiers = []
+        for fichier in self.files():
+            if fichier.endswith(".parquet"):
+                fichiers.append(fichier)
+            else:
+                parquet = parquet_path_for(fichier)
+                if not os.path.exists(parquet):
+                    convert_csv_to_parquet(fichier, parquet, garder=_parquet_ouverts)
+                fichiers.append(parquet)
+        return fichiers
+
+    def _connection(self):
+        """
+        Connexion DuckDB et vue nettoyée `dvf`, créées au premier appel.
+        Chaque requête passe par un curseur propre au thread appelant.
+        """
+        with self._prepare_lock:
+            if self._con is None:
+                self._cle_source = files_key(self.files())
+                fichiers = self._parquet_files()
+                if not fichiers:
+                    raise FileNotFoundError(self.path)
+                self._fichiers = fichiers
+                _parquet_ouverts.update(fichiers)
+                os.makedirs(DUCKDB_TEMP_DIR, exist_ok=True)
+                con = duckdb.connect()
+                con.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
+                con.execute(f"SET temp_directory = '{DUCKDB_TEMP_DIR}'")
+                disponibles = set(duckdb.read_parquet(fichiers[0], connection=con).columns)
+                colonnes = [c for c in COLONNES_DVF if c in disponibles]
+                con.execute(f"CREATE VIEW dvf_valide AS {clean_sql(fichiers, colonnes)}")
+                if self.methode_aberrants == "aucune":
+                    con.execute("CREATE VIEW dvf AS SELECT *, FALSE AS aberrant FROM dvf_valide")
+                    con.execute("CREATE TABLE bornes AS SELECT NULL::VARCHAR AS code_commune LIMIT 0")
+                else:
+                    seuil = SEUILS_ABERRANTS[self.methode_aberrants]
+                    con.execute(f"CREATE TABLE bornes AS {bounds_sql(self.methode_aberrants, seuil)}")
+                    con.execute("""
+                        CREATE VIEW dvf AS
+                        SELECT v.*, coalesce(v.prix_m2 < b.borne_basse OR v.prix_m2 > b.borne_haute, FALSE) AS aberrant
+                        FROM dvf_valide v LEFT JOIN bornes b
+                          ON v.code_commune = b.code_commune AND v.type_local = b.type_local
+                    """)
+                self._con = con
+            return self._con.cursor()
+
+    def query(self, sql: str, params: list = None) -> pd.DataFrame:
+        """
+        Exécute une requête sur la vue nettoyée `dvf` et matérialise son résultat.
+        Le transfert passe par Arrow ; les colonnes catégorielles arrivent déjà
+        encodées en dictionnaire (pas de chaîne Python par ligne).
+        """
+        table = self._connection().execute(sql, params or []).to_arrow_table()
+        for col in COLONNES_CATEGORIES:
+            i = table.schema.get_field_index(col)
+            if i >= 0:
+                table = table.set_column(i, col, pc.dictionary_encode(table.column(col)))
+        return table.to_pandas()
+
+    def prepare(self) -> bool:
+        self._connection()
+        return True
+
+    def loaded(self) -> bool:
+        return self._con is not None
+
+    def row_count(self) -> int:
+        return int(self.query("SELECT count(*) AS n FROM dvf")["n"].iloc[0])
+
+    def changed(self) -> bool:
+        return files_changed(self.files(), self._cle_source)
+
+    def close(self):
+        """
+        Ferme la connexion et supprime les conversions Parquet qui ne correspondent plus
+        aux CSV sources (gardées tant que la connexion pouvait les lire).
+        """
+        with self._prepare_lock:
+            if self._con is None:
+                return
+            self._con.close()
+            self._con = None
+            _parquet_ouverts.difference_update(self._fichiers)
+            sources = self.files()
+            actuels = {parquet_path_for(f) for f in sources if not f.endswith(".parquet")}
+            for fichier in self._fichiers:
+                if (fichier not in sources and fichier not in actuels and fichier not in _parquet_ouverts
+                        and os.path.exists(fichier)):
+                    os.remove(fichier)
+
+    def load_all(self) -> pd.DataFrame:
+        """
+        Tout le périmètre matérialisé en mémoire (à éviter au-delà d'un département).
+        """
+        return compact_dtypes(self.query("SELECT * FROM dvf"))
+
+    def load_commune(self, insee_code: str) -> pd.DataFrame:
+        """
+        Données nettoyées d'une commune, lues sur disque puis gardées en mémoire.
+        """
+        with self._lock:
+            count_cache("commune", insee_code in self._communes)
+            if insee_code in self._communes:
+                return self._communes[insee_code]
+        df = self.query("SELECT * FROM dvf WHERE code_commune = ?", [insee_code])
+        df = compact_dtypes(df) if not df.empty else pd.DataFrame()
+        with self._lock:
+            self._communes[insee_code] = df
+            if len(self._communes) > MAX_COMMUNES:
+                ancien = next(iter(self._communes))
+                for cache in (self._communes, self._cubes, self._engines, self._index):
+                    cache.pop(ancien, None)
+        return df
+
+    def outlier_bounds(self, insee_code: str) -> pd.DataFrame:
+        return self.query("SELECT * FROM bornes WHERE code_commune = ?", [insee_code])
+
+    def communes_summary(self) -> pd.DataFrame:
+        """
+        Indicateurs par commune sur tout le périmètre (une ligne par commune).
+        """
+        return self.query("""
+            SELECT code_commune, any_value(nom_commune) AS nom_commune, count(*) AS n,
+                   avg(prix_m2) AS prix_m2_moyen, median(valeur_fonciere) AS prix_median
+            FROM dvf GROUP BY code_commune ORDER BY n DESC
+        """)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Indicateurs par commune d'un ou plusieurs fichiers : python dvf_duckdb.py "dvf_*.parquet"
+    source = DuckDbSource(sys.argv[1] if len(sys.argv) > 1 else "dvf_2024.csv")
+    print(source.communes_summary().to_string(index=False))
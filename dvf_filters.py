@@ -0,0 +1,221 @@
+# dvf_filters.py
+"""
+Évaluation incrémentale des filtres de la barre latérale.
+
+Le masque de chaque dimension (codes postaux, type de bien, fourchette de prix,
+exclusion des prix aberrants)
+est mis en cache séparément : quand un seul widget change, seul son masque est
+recalculé puis recombiné avec les autres. La fourchette de prix est résolue par
+recherche dichotomique dans les prix triés une fois pour toutes. Le résultat est
+un tableau d'indices ; le tableau de la commune n'est jamais copié tant qu'aucun
+filtre n'est actif.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from dvf_profiling import count_cache
+
+# Nombre de masques gardés en cache par dimension
+MAX_MASKS = 8
+
+# Colonnes proposées pour trier le tableau des transactions
+COLONNES_TRI = {"Date": "date_mutation", "Prix": "valeur_fonciere", "Surface": "surface_reelle_bati"}
+
+
+class FilterEngine:
+    """
+    Moteur de filtres pour le tableau (nettoyé) d'une commune.
+    Partageable entre sessions : les caches sont protégés par un verrou.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.n = len(df)
+
+        valeurs = df["valeur_fonciere"].to_numpy(dtype="float64")
+        self._ordre_prix = np.argsort(valeurs, kind="stable")
+        self._prix_tries = valeurs[self._ordre_prix]
+
+        postal = df["code_postal"].astype("category")
+        self._postal_codes = postal.cat.codes.to_numpy()
+        self._postal_categories = list(postal.cat.categories)
+        presents = np.unique(self._postal_codes[self._postal_codes >= 0])
+        self.codes_postaux = sorted(self._postal_categories[i] for i in presents)
+
+        types = df["type_local"].astype("category")
+        self._type_codes = types.cat.codes.to_numpy()
+        self._type_categories = list(types.cat.categories)
+
+        # Prix aberrants signalés au chargement (voir dvf_data.flag_outliers)
+        self._aberrants = df["aberrant"].to_numpy(dtype=bool) if "aberrant" in df.columns else None
+        self.n_aberrants = int(self._aberrants.sum()) if self._aberrants is not None else 0
+
+        self._masks = {}
+        self._derives = {}
+        self._ordres = {}
+        self._lock = threading.Lock()
+
+    @property
+    def prix_max(self) -> float:
+        return float(self._prix_tries[-1]) if self.n else 0.0
+
+    def _cached(self, dimension: str, cle, calcul):
+        """
+        Masque d'une dimension pour une valeur de filtre, calculé au premier appel.
+        """
+        with self._lock:
+            count_cache(f"masque.{dimension}", (dimension, cle) in self._masks)
+            if (dimension, cle) in self._masks:
+                return self._masks[(dimension, cle)]
+        masque = calcul()
+        with self._lock:
+            self._masks[(dimension, cle)] = masque
+            if len(self._masks) > MAX_MASKS * 5:
+                # Éviction du plus ancien (ordre d'insertion)
+                self._masks.pop(next(iter(self._masks)))
+        return masque
+
+    def mask_code_postal(self, codes_postaux):
+        """
+        Masque des codes postaux sélectionnés (None si tous le sont).
+        """
+        cle = frozenset(codes_postaux)
+        if cle.issuperset(self.codes_postaux):
+            return None
+
+        def calcul():
+            codes = [i for i, c in enumerate(self._postal_categories) if c in cle]
+            return np.isin(self._postal_codes, codes)
+        return self._cached("code_postal", cle, calcul)
+
+    def mask_type(self, type_local: str):
+        """
+        Masque du type de bien (None pour 'Tous').
+        """
+        if type_local == 'Tous':
+            return None
+
+        def calcul():
+            if type_local not in self._type_categories:
+                return np.zeros(self.n, dtype=bool)
+            return self._type_codes == self._type_categories.index(type_local)
+        return self._cached("type_local", type_local, calcul)
+
+    def mask_prix(self, prix_min: float, prix_max: float):
+        """
+        Masque de la fourchette de prix, par recherche dichotomique dans les prix triés
+        (None si la fourchette couvre toutes les ventes).
+        """
+        debut = np.searchsorted(self._prix_tries, prix_min, side="left")
+        fin = np.searchsorted(self._prix_tries, prix_max, side="right")
+        if debut == 0 and fin == self.n:
+            return None
+
+        def calcul():
+            masque = np.zeros(self.n, dtype=bool)
+            masque[self._ordre_prix[debut:fin]] = True
+            return masque
+        return self._cached("prix", (int(debut), int(fin)), calcul)
+
+    def mask_aberrants(self, exclure_aberrants: bool):
+        """
+        Masque des ventes au prix non aberrant (None si elles sont toutes gardées).
+        """
+        if not exclure_aberrants or not self.n_aberrants:
+            return None
+        return self._cached("aberrant", True, lambda: ~self._aberrants)
+
+    def filter_key(self, codes_postaux, type_local: str, prix_min: float, prix_max: float,
+                   exclure_aberrants: bool = False) -> tuple:
+        """
+        Clé normalisée d'un état de filtres : deux fourchettes de prix qui retiennent
+        les mêmes ventes donnent la même clé.
+        """
+        debut = int(np.searchsorted(self._prix_tries, prix_min, side="left"))
+        fin = int(np.searchsorted(self._prix_tries, prix_max, side="right"))
+        postal = frozenset(codes_postaux) & frozenset(self.codes_postaux)
+        return (postal, type_local, debut, fin, bool(exclure_aberrants and self.n_aberrants))
+
+    def memo(self, nom: str, cle, calcul):
+        """
+        Résultat dérivé des transactions filtrées (carte, graphiques...), mis en cache
+        sous (nom, cle). `cle` doit contenir filter_key() de l'état de filtres.
+        """
+        with self._lock:
+            count_cache(nom, (nom, cle) in self._derives)
+            if (nom, cle) in self._derives:
+                return self._derives[(nom, cle)]
+        resultat = calcul()
+        with self._lock:
+            self._derives[(nom, cle)] = resultat
+            if len(self._derives) > MAX_MASKS * 4:
+                self._derives.pop(next(iter(self._derives)))
+        return resultat
+
+    def mask(self, codes_postaux, type_local: str, prix_min: float, prix_max: float,
+             exclure_aberrants: bool = False):
+        """
+        Masque combiné des filtres, ou None si toutes les lignes sont retenues.
+        """
+        masques = [m for m in (self.mask_code_postal(codes_postaux),
+                               self.mask_type(type_local),
+                               self.mask_prix(prix_min, prix_max),
+                               self.mask_aberrants(exclure_aberrants)) if m is not None]
+        if not masques:
+            return None
+        masque = masques[0]
+        for m in masques[1:]:
+            masque = masque & m
+        return masque
+
+    def indices(self, codes_postaux, type_local: str, prix_min: float, prix_max: float,
+                exclure_aberrants: bool = False):
+        """
+        Positions des lignes retenues par les filtres, ou None si toutes le sont.
+        """
+        masque = self.mask(codes_postaux, type_local, prix_min, prix_max, exclure_aberrants)
+        return None if masque is None else np.flatnonzero(masque)
+
+    def sort_order(self, colonne: str, descending: bool = False) -> np.ndarray:
+        """
+        Positions des lignes triées selon `colonne`, calculées une fois par colonne
+        et par sens (valeurs manquantes en dernier).
+        """
+        with self._lock:
+            count_cache("tri", (colonne, descending) in self._ordres)
+            if (colonne, descending) in self._ordres:
+                return self._ordres[(colonne, descending)]
+        valeurs = self.df[colonne].to_numpy()
+        ordre = np.argsort(valeurs, kind="stable")
+        if descending:
+            manquantes = int(pd.isna(valeurs).sum())
+            ordre = np.r_[ordre[:self.n - manquantes][::-1], ordre[self.n - manquantes:]]
+        with self._lock:
+            self._ordres[(colonne, descending)] = ordre
+        return ordre
+
+    def page(self, filtres: dict, colonne: str, descending: bool = True, page: int = 0, page_size: int = 100):
+        """
+        Une page des transactions filtrées, triées selon `colonne`, et le nombre total de lignes.
+        L'ordre est précalculé : seul le masque des filtres est appliqué puis la page est extraite,
+        sans trier ni copier l'ensemble filtré.
+        """
+        ordre = self.sort_order(colonne, descending)
+        masque = self.mask(**filtres)
+        if masque is not None:
+            ordre = ordre[masque[ordre]]
+        debut = page * page_size
+        return self.df.iloc[ordre[debut:debut + page_size]], len(ordre)
+
+    def select(self, codes_postaux, type_local: str, prix_min: float, prix_max: float,
+               exclure_aberrants: bool = False) -> pd.DataFrame:
+        """
+        Transactions filtrées : le tableau de la commune lui-même si aucun filtre n'est actif,
+        sinon une sélection par positions (à ne pas modifier en place).
+        """
+        idx = self.indices(codes_postaux, type_local, prix_min, prix_max, exclure_aberrants)
+        if idx is None:
+            return self.df
+        return self.df.iloc[idx]
@@ -0,0 +1,193 @@
+# dvf_http.py
+"""
+Téléchargement des fichiers DVF par commune avec cache persistant sur disque.
+
+Chaque CSV téléchargé est conservé avec son ETag / Last-Modified. Les appels
+suivants le revalident par requête conditionnelle (304 = on garde la copie
+locale) et, si data.gouv.fr est injoignable, la copie locale est servie telle
+quelle, sans nouvelle tentative pendant RETRY_AFTER secondes. Le cache survit
+aux redémarrages et peut être partagé entre instances en pointant
+DVF_HTTP_CACHE_DIR vers un volume commun.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Racine des fichiers geo-dvf (surchargeable, par exemple vers un serveur local de test)
+BASE_URL = os.environ.get("DVF_BASE_URL", "https://files.data.gouv.fr/geo-dvf/latest/csv")
+
+# Dossier du cache HTTP
+HTTP_CACHE_DIR = os.environ.get("DVF_HTTP_CACHE_DIR", os.path.join(".dvf_cache", "http"))
+
+# Délai pendant lequel une copie locale est servie sans même revalider (secondes)
+MAX_AGE = 3600
+
+# Délai après un échec de revalidation pendant lequel l'origine n'est pas retentée (secondes)
+RETRY_AFTER = 300
+
+# Délais de connexion / lecture (secondes)
+TIMEOUT = (5, 60)
+
+# Nombre de téléchargements simultanés lors du préchargement
+PREFETCH_WORKERS = 8
+
+
+def make_session(pool_size: int = PREFETCH_WORKERS, retries: int = 3) -> requests.Session:
+    """
+    Session keep-alive avec un pool de `pool_size` connexions et des reprises
+    automatiques (backoff exponentiel) sur les erreurs réseau et 429/5xx.
+    """
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5,
+                  status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_session = make_session()
+
+
+def commune_url(insee_code: str, annee: int = 2024, departement: str = "33") -> str:
+    """
+    URL du fichier DVF d'une commune pour une année.
+    """
+    return f"{BASE_URL}/{annee}/communes/{departement}/{insee_code}.csv"
+
+
+def _cache_paths(url: str):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return (os.path.join(HTTP_CACHE_DIR, f"{key}.csv"),
+            os.path.join(HTTP_CACHE_DIR, f"{key}.json"))
+
+
+def _read_meta(meta_path: str) -> dict:
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_meta(meta_path: str, meta: dict):
+    _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+
+def fetch_cached(url: str, session: requests.Session = None, max_age: float = MAX_AGE):
+    """
+    Renvoie (contenu, perime) pour `url` en passant par le cache disque.
+
+    - copie locale de moins de `max_age` secondes : servie directement ;
+    - sinon requête conditionnelle (If-None-Match / If-Modified-Since) :
+      304 -> copie locale, 200 -> nouvelle copie enregistrée ;
+    - en cas d'erreur réseau ou serveur, la copie locale est servie avec perime=True,
+      puis directement pendant RETRY_AFTER secondes (l'échec est noté dans les
+      métadonnées). Sans copie locale, l'exception requests est propagée.
+    """
+    session = session or _session
+    body_path, meta_path = _cache_paths(url)
+    meta = _read_meta(meta_path) if os.path.exists(body_path) else {}
+
+    if meta and time.time() - meta.get("checked_at", 0) < max_age:
+        with open(body_path, "rb") as f:
+            return f.read(), False
+    if meta and time.time() - meta.get("failed_at", 0) < RETRY_AFTER:
+        with open(body_path, "rb") as f:
+            return f.read(), True
+
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = session.get(url, headers=headers, timeout=TIMEOUT)
+        if response.status_code == 304 and meta:
+            meta["checked_at"] = time.time()
+            meta.pop("failed_at", None)
+            _write_meta(meta_path, meta)
+            with open(body_path, "rb") as f:
+                return f.read(), False
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        if not meta:
+            raise
+        logger.warning("Échec de revalidation de %s (%s), copie locale servie", url, e)
+        meta["failed_at"] = time.time()
+        _write_meta(meta_path, meta)
+        with open(body_path, "rb") as f:
+            return f.read(), True
+
+    os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+    _write_atomic(body_path, response.content)
+    _write_meta(meta_path, {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha1": hashlib.sha1(response.content).hexdigest(),
+        "checked_at": time.time(),
+    })
+    return response.content, False
+
+
+def cache_validator(url: str):
+    """
+    Version de la copie locale de `url` : ETag, sinon Last-Modified, sinon empreinte
+    du contenu (None si rien n'est en cache).
+    """
+    meta = _read_meta(_cache_paths(url)[1])
+    return meta.get("etag") or meta.get("last_modified") or meta.get("sha1")
+
+
+def prefetch_urls(urls, max_workers: int = PREFETCH_WORKERS, session: requests.Session = None,
+                  max_age: float = MAX_AGE) -> dict:
+    """
+    Télécharge en parallèle toutes les `urls` dans le cache disque, avec au plus
+    `max_workers` requêtes simultanées sur une même session (max_age=0 : revalide
+    toutes les copies locales).
+    Renvoie {url: None si succès, sinon l'exception rencontrée}.
+    """
+    session = session or make_session(max_workers)
+    resultats = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dvf-prefetch") as pool:
+        futures = {pool.submit(fetch_cached, url, session, max_age): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                future.result()
+                resultats[url] = None
+            except Exception as e:
+                logger.warning("Préchargement impossible pour %s : %s", url, e)
+                resultats[url] = e
+    return resultats
+
+
+if __name__ == "__main__":
+    # Préchargement manuel : python dvf_http.py 33063 33318 ...
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    codes = sys.argv[1:]
+    debut = time.time()
+    erreurs = prefetch_urls([commune_url(code) for code in codes])
+    ok = sum(1 for e in erreurs.values() if e is None)
+    print(f"{ok}/{len(codes)} communes en cache en {time.time() - debut:.1f} s")
@@ -0,0 +1,99 @@
+# dvf_map.py
+"""
+Agrégation spatiale des transactions pour la carte.
+
+Au lieu d'envoyer un échantillon aléatoire de points au navigateur, les ventes
+sont regroupées côté serveur sur une grille hexagonale dont la taille dépend
+du niveau de zoom. Chaque cellule porte le nombre de ventes et le prix médian
+au m² : toutes les transactions contribuent, et le poids de la figure ne dépend
+plus que du nombre de cellules.
+"""
+import numpy as np
+import pandas as pd
+
+# Mètres par degré de latitude (approximation sphérique suffisante à l'échelle d'un département)
+M_PAR_DEGRE = 111_320.0
+
+# Taille visée d'une cellule à l'écran (pixels, rayon de l'hexagone)
+HEX_PIXELS = 12
+
+# En dessous de ce nombre de transactions, la carte affiche les points individuels
+POINTS_MAX = 1000
+
+
+def hex_radius_m(zoom: int, latitude: float) -> float:
+    """
+    Rayon d'hexagone (mètres) correspondant à HEX_PIXELS au niveau de zoom donné.
+    """
+    metres_par_pixel = 156_543.03 * np.cos(np.radians(latitude)) / 2 ** zoom
+    return HEX_PIXELS * metres_par_pixel
+
+
+def _project(lat, lon, lat0: float):
+    x = np.asarray(lon, dtype="float64") * np.cos(np.radians(lat0)) * M_PAR_DEGRE
+    y = np.asarray(lat, dtype="float64") * M_PAR_DEGRE
+    return x, y
+
+
+def _unproject(x, y, lat0: float):
+    return y / M_PAR_DEGRE, x / (np.cos(np.radians(lat0)) * M_PAR_DEGRE)
+
+
+def hex_cells(x, y, rayon: float):
+    """
+    Coordonnées axiales (q, r) de l'hexagone (pointe en haut) contenant chaque point.
+    """
+    q = (np.sqrt(3) / 3 * x - y / 3) / rayon
+    r = (2 / 3 * y) / rayon
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    # Arrondi cubique : on corrige la coordonnée dont l'erreur d'arrondi est la plus grande
+    corrige_q = (dq > dr) & (dq > ds)
+    corrige_r = ~corrige_q & (dr > ds)
+    rq = np.where(corrige_q, -rr - rs, rq)
+    rr = np.where(corrige_r, -rq - rs, rr)
+    return rq.astype("int64"), rr.astype("int64")
+
+
+def hex_aggregate(df: pd.DataFrame, zoom: int) -> dict:
+    """
+    Regroupe les transactions (latitude, longitude, prix_m2) par hexagone.
+
+    Renvoie {"cells": tableau (id, n, prix_m2_median, latitude, longitude),
+    "geojson": contours des hexagones, "center": (lat, lon)}.
+    """
+    points = df[["latitude", "longitude", "prix_m2"]].dropna()
+    if points.empty:
+        return {"cells": pd.DataFrame(), "geojson": {"type": "FeatureCollection", "features": []}, "center": None}
+
+    lat0 = float(points["latitude"].mean())
+    lon0 = float(points["longitude"].mean())
+    rayon = hex_radius_m(zoom, lat0)
+    x, y = _project(points["latitude"], points["longitude"], lat0)
+    q, r = hex_cells(x, y, rayon)
+
+    cells = (pd.DataFrame({"q": q, "r": r, "prix_m2": points["prix_m2"].to_numpy(dtype="float64")})
+             .groupby(["q", "r"], sort=False)["prix_m2"]
+             .agg(n="size", prix_m2_median="median")
+             .reset_index())
+    cx = rayon * np.sqrt(3) * (cells["q"] + cells["r"] / 2)
+    cy = rayon * 1.5 * cells["r"]
+    cells["latitude"], cells["longitude"] = _unproject(cx.to_numpy(), cy.to_numpy(), lat0)
+    cells["id"] = cells["q"].astype(str) + ":" + cells["r"].astype(str)
+
+    # Sommets des hexagones (pointe en haut : angles 30°, 90°, ...)
+    angles = np.radians(30 + 60 * np.arange(7))
+    vx = cx.to_numpy()[:, None] + rayon * np.cos(angles)[None, :]
+    vy = cy.to_numpy()[:, None] + rayon * np.sin(angles)[None, :]
+    vlat, vlon = _unproject(vx, vy, lat0)
+    features = [
+        {"type": "Feature", "id": cid,
+         "geometry": {"type": "Polygon", "coordinates": [np.round(np.c_[lo, la], 6).tolist()]}}
+        for cid, la, lo in zip(cells["id"], vlat, vlon)
+    ]
+    return {
+        "cells": cells[["id", "n", "prix_m2_median", "latitude", "longitude"]],
+        "geojson": {"type": "FeatureCollection", "features": features},
+        "center": (lat0, lon0),
+    }
@@ -0,0 +1,170 @@
+# dvf_profiling.py
+"""
+Instrumentation des reruns Streamlit.
+
+Chaque exécution du script (ou d'un fragment rejoué seul) est découpée en
+étapes chronométrées (chargement, filtres, KPIs, graphiques, carte, tableau)
+avec la taille des tableaux traités et les succès/échecs des caches. À la fin du rerun, les mesures sont écrites
+sur une ligne JSON (logger "dvf.timing") et, si le mode admin est actif
+(DVF_ADMIN=1 ou ?admin=1 dans l'URL), affichées dans la barre latérale.
+Streamlit n'est importé qu'à l'affichage : la couche de données peut compter
+ses accès aux caches sans en dépendre.
+"""
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import pandas as pd
+
+logger = logging.getLogger("dvf.timing")
+if not logger.handlers and os.environ.get("DVF_TIMING_LOG", "1") != "0":
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Compteurs de cache cumulés depuis le démarrage du processus
+_totaux = Counter()
+_totaux_lock = threading.Lock()
+
+# Rerun en cours, par thread (Streamlit exécute chaque session dans son propre thread)
+_courant = threading.local()
+
+
+class RunProfile:
+    """
+    Mesures d'un rerun : étapes chronométrées et compteurs de cache.
+    """
+
+    def __init__(self, script: str):
+        self.script = script
+        self.run_id = uuid.uuid4().hex[:12]
+        self.debut = time.perf_counter()
+        self.stages = []
+        self.cache = Counter()
+
+    def to_record(self) -> dict:
+        return {
+            "event": "rerun",
+            "script": self.script,
+            "run_id": self.run_id,
+            "total_ms": round((time.perf_counter() - self.debut) * 1000, 2),
+            "stages": self.stages,
+            "cache": dict(self.cache),
+        }
+
+
+def start_run(script: str) -> RunProfile:
+    """
+    Démarre le profilage du rerun courant (à appeler en tête de script).
+    """
+    _courant.profile = RunProfile(script)
+    return _courant.profile
+
+
+def current():
+    return getattr(_courant, "profile", None)
+
+
+@contextlib.contextmanager
+def stage(name: str, **infos):
+    """
+    Chronomètre une étape du rerun. Le dictionnaire renvoyé peut être complété
+    (par exemple rows=len(df)) ; les mesures sont enregistrées même si l'étape
+    s'interrompt (st.stop()).
+    """
+    mesure = dict(infos)
+    debut = time.perf_counter()
+    try:
+        yield mesure
+    finally:
+        profile = current()
+        if profile is not None:
+            mesure["name"] = name
+            mesure["ms"] = round((time.perf_counter() - debut) * 1000, 2)
+            profile.stages.append(mesure)
+
+
+@contextlib.contextmanager
+def fragment_run(name: str):
+    """
+    Profilage d'une section rejouée seule (fragment Streamlit). Dans un rerun complet,
+    ses étapes s'ajoutent au rerun en cours ; lors du rerun du seul fragment, un rerun
+    `name` est démarré puis terminé autour de la section.
+    """
+    if current() is not None:
+        yield
+        return
+    start_run(name)
+    try:
+        yield
+    finally:
+        finish_run()
+
+
+def frame_info(df) -> dict:
+    """
+    Taille d'un tableau pour les mesures (lignes et mémoire hors chaînes Python).
+    """
+    return {"rows": len(df), "mb": round(df.memory_usage(deep=False).sum() / 2**20, 2)}
+
+
+def count_cache(name: str, hit: bool):
+    """
+    Compte un succès ou un échec du cache `name` (pour le rerun courant et le processus).
+    """
+    cle = f"{name}.{'hit' if hit else 'miss'}"
+    with _totaux_lock:
+        _totaux[cle] += 1
+    profile = current()
+    if profile is not None:
+        profile.cache[cle] += 1
+
+
+def admin_enabled() -> bool:
+    import streamlit as st
+
+    return os.environ.get("DVF_ADMIN") == "1" or st.query_params.get("admin") == "1"
+
+
+def finish_run():
+    """
+    Termine le rerun courant : ligne JSON dans le log et panneau admin si activé.
+    """
+    import streamlit as st
+
+    profile = current()
+    if profile is None:
+        return
+    _courant.profile = None
+    record = profile.to_record()
+    logger.info(json.dumps(record, ensure_ascii=False))
+
+    if admin_enabled():
+        with st.sidebar.expander("⏱️ Profilage du rerun", expanded=False):
+            st.caption(f"Rerun {record['run_id']} : {record['total_ms']:.0f} ms")
+            if record["stages"]:
+                st.dataframe(pd.DataFrame(record["stages"]).set_index("name"), use_container_width=True)
+            with _totaux_lock:
+                totaux = dict(_totaux)
+            st.caption("Caches (rerun / cumul processus)")
+            st.dataframe(pd.DataFrame({"rerun": pd.Series(record["cache"], dtype="int64"),
+                                       "processus": pd.Series(totaux, dtype="int64")}).fillna(0).astype(int),
+                         use_container_width=True)
+
+
+def stop_run():
+    """
+    Termine le rerun courant puis arrête le script (remplace st.stop()).
+    """
+    import streamlit as st
+
+    finish_run()
+    st.stop()
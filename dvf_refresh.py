@@ -0,0 +1,188 @@
+# dvf_refresh.py
+"""
+Rafraîchissement des données en tâche de fond.
+
+Un thread par processus vérifie toutes les REFRESH_INTERVAL secondes si la donnée
+d'origine des sources partagées (voir dvf_data.get_source) a changé : fichier local
+modifié (taille, date), nouvel ETag / Last-Modified d'un fichier data.gouv.fr
+(requête conditionnelle). Une source modifiée, ou chargée depuis plus de
+REFRESH_REBUILD secondes si ce délai est fixé, est reconstruite hors du chemin des
+requêtes dans une nouvelle instance : nettoyage, découpage par commune et caches
+dérivés (cubes, moteurs de filtres, index spatiaux) des communes déjà consultées.
+
+La nouvelle instance n'est publiée qu'après validation (données non vides, aucune
+copie périmée, au moins RATIO_MIN fois le nombre de ventes de l'ancienne) par un
+remplacement atomique dans le registre des sources : les reruns en cours terminent
+sur l'ancienne instance (voir MultiYearSource.snapshot), les suivants lisent la
+nouvelle, et aucune session ne voit de jeu partiel ou vide. Une reconstruction
+rejetée laisse l'ancienne instance en place ; elle est retentée à la vérification
+suivante.
+
+    DVF_REFRESH=0               désactive le rafraîchissement
+    DVF_REFRESH_INTERVAL=600    délai entre deux vérifications (secondes)
+    DVF_REFRESH_REBUILD=0       reconstruction planifiée (secondes, 0 = seulement sur changement)
+    DVF_REFRESH_HEURES=20-7     heures où les reconstructions planifiées sont permises
+"""
+import logging
+import os
+import threading
+import time
+
+from dvf_data import DvfSource, new_source, shared_sources, swap_source
+
+logger = logging.getLogger(__name__)
+
+REFRESH_ENABLED = os.environ.get("DVF_REFRESH", "1") != "0"
+
+# Délai entre deux vérifications des sources (secondes)
+REFRESH_INTERVAL = float(os.environ.get("DVF_REFRESH_INTERVAL", "600"))
+
+# Âge au-delà duquel une source est reconstruite même sans changement détecté (0 = jamais)
+REFRESH_REBUILD = float(os.environ.get("DVF_REFRESH_REBUILD", "0"))
+
+# Plage horaire « début-fin » des reconstructions planifiées (vide = à toute heure) ;
+# les reconstructions sur changement ne tournent jamais sur le chemin des requêtes
+REFRESH_HEURES = os.environ.get("DVF_REFRESH_HEURES", "")
+
+# Part minimale des ventes de l'ancienne instance que doit contenir la nouvelle
+RATIO_MIN = 0.5
+
+
+def _dans_plage(heures: str, heure: int) -> bool:
+    if not heures:
+        return True
+    debut, fin = (int(h) for h in heures.split("-"))
+    return debut <= heure < fin if debut <= fin else heure >= debut or heure < fin
+
+
+def validate(nouvelle: DvfSource, insee_codes, avant: int) -> str:
+    """
+    Motif de rejet d'une reconstruction (`avant` : nombre de ventes de la version en
+    place), ou None si elle peut être publiée.
+    """
+    perimees = [code for code in insee_codes if nouvelle.is_stale(code)]
+    if perimees:
+        return f"copies périmées pour {', '.join(perimees)}"
+    n = nouvelle.row_count()
+    if not n:
+        return "aucune vente"
+    if n < RATIO_MIN * avant:
+        return f"{n} ventes contre {avant} dans la version en place"
+    return None
+
+
+class SourceRefresher:
+    """
+    Vérification périodique et reconstruction des sources partagées (une instance
+    par processus, voir start_refresher).
+    """
+
+    def __init__(self, interval: float = REFRESH_INTERVAL, rebuild_every: float = REFRESH_REBUILD,
+                 heures: str = REFRESH_HEURES):
+        self.interval = interval
+        self.rebuild_every = rebuild_every
+        self.heures = heures
+        self.last_results = {}
+        self._charges = {}
+        self._remplacees = []
+        self._arret = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self) -> threading.Thread:
+        """
+        Lance le thread de rafraîchissement (une seule fois).
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._boucle, name="dvf-refresh", daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def stop(self):
+        self._arret.set()
+
+    def _boucle(self):
+        while not self._arret.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Vérification des sources impossible")
+
+    def _motif(self, source: DvfSource) -> str:
+        """
+        Raison de reconstruire la source (None si elle est à jour).
+        """
+        if not source.loaded():
+            return None
+        if source.changed():
+            return "changement"
+        # Âge compté depuis le premier passage qui a trouvé l'instance chargée
+        charge = self._charges.setdefault(source.version, time.time())
+        if (self.rebuild_every and time.time() - charge >= self.rebuild_every
+                and _dans_plage(self.heures, time.localtime().tm_hour)):
+            return "planifié"
+        return None
+
+    def run_once(self) -> int:
+        """
+        Une vérification de toutes les sources partagées. Renvoie le nombre de sources remplacées.
+        """
+        # Les instances remplacées au passage précédent ne sont plus lues par aucun rerun
+        while self._remplacees:
+            self._remplacees.pop().close()
+        remplacees = 0
+        for cle, source in shared_sources().items():
+            try:
+                motif = self._motif(source)
+            except Exception as e:
+                logger.warning("Vérification impossible pour %s : %s", cle, e)
+                continue
+            if motif is not None and self.refresh(cle, source, motif):
+                remplacees += 1
+        return remplacees
+
+    def refresh(self, cle: tuple, ancienne: DvfSource, motif: str = "manuel") -> bool:
+        """
+        Reconstruit la source `cle` dans une nouvelle instance, la valide puis la publie
+        à la place de `ancienne`. Renvoie True si la nouvelle instance a été publiée.
+        """
+        debut = time.perf_counter()
+        codes = ancienne.cached_communes()
+        avant = ancienne.row_count()
+        nouvelle = new_source(cle)
+        try:
+            erreur = validate(nouvelle, codes, avant) if nouvelle.warm(codes) else "source vide"
+        except Exception as e:
+            erreur = f"{type(e).__name__}: {e}"
+        duree = time.perf_counter() - debut
+        if erreur is None and not swap_source(cle, ancienne, nouvelle):
+            erreur = "instance remplacée entre-temps"
+        self.last_results[cle] = {"motif": motif, "publiee": erreur is None, "erreur": erreur,
+                                  "secondes": round(duree, 2), "ventes_avant": avant, "fin": time.time()}
+        if erreur is not None:
+            logger.warning("Rafraîchissement de %s (%s) rejeté après %.1f s : %s", cle, motif, duree, erreur)
+            nouvelle.close()
+            return False
+        self._charges.pop(ancienne.version, None)
+        self._remplacees.append(ancienne)
+        logger.info("Rafraîchissement de %s (%s) publié en %.1f s : %d communes préparées",
+                    cle, motif, duree, len(codes))
+        return True
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def start_refresher() -> SourceRefresher:
+    """
+    Rafraîchisseur partagé du processus, démarré au premier appel (sauf DVF_REFRESH=0).
+    """
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = SourceRefresher()
+            if REFRESH_ENABLED:
+                _refresher.start()
+        return _refresher
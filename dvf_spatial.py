@@ -0,0 +1,227 @@
+# dvf_spatial.py
+"""
+Index spatial des transactions pour la recherche de biens comparables.
+
+À l'ingestion, chaque vente reçoit la clé de la cellule (carré de
+TAILLE_CELLULE_M mètres, projection équirectangulaire centrée sur la Gironde)
+qui contient ses coordonnées, et les lignes de chaque commune sont rangées par
+cellule : la clé est stockée avec les données nettoyées (fichier partagé).
+L'index d'une commune se résume alors à ses clés triées. Une recherche ne
+parcourt que les cellules voisines du point (recherche dichotomique par
+cellule, anneaux de plus en plus larges pour les k plus proches voisins) au
+lieu de calculer la distance à toutes les ventes.
+"""
+import numpy as np
+import pandas as pd
+
+from dvf_map import M_PAR_DEGRE
+
+# Latitude de référence de la projection (fixe : les clés sont persistées)
+LAT_REF = 44.84
+
+# Côté d'une cellule de l'index (mètres)
+TAILLE_CELLULE_M = 250.0
+
+# Clé des ventes sans coordonnées (absentes de l'index)
+CELLULE_VIDE = -1
+
+_DECALAGE = 2 ** 31
+_COS_REF = np.cos(np.radians(LAT_REF))
+
+
+def project(lat, lon):
+    """
+    Coordonnées planes (mètres) dans la projection de l'index.
+    """
+    x = np.asarray(lon, dtype="float64") * _COS_REF * M_PAR_DEGRE
+    y = np.asarray(lat, dtype="float64") * M_PAR_DEGRE
+    return x, y
+
+
+def _cle(ix, iy):
+    return np.asarray(iy, dtype="int64") * 2 ** 32 + (np.asarray(ix, dtype="int64") + _DECALAGE)
+
+
+def cell_keys(lat, lon) -> np.ndarray:
+    """
+    Clé de cellule de chaque point (CELLULE_VIDE si les coordonnées manquent).
+    """
+    x, y = project(lat, lon)
+    valides = np.isfinite(x) & np.isfinite(y)
+    cles = np.full(len(x), CELLULE_VIDE, dtype="int64")
+    cles[valides] = _cle(np.floor(x[valides] / TAILLE_CELLULE_M), np.floor(y[valides] / TAILLE_CELLULE_M))
+    return cles
+
+
+def add_cell_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ajoute la colonne `cellule` et range les lignes par commune puis par cellule
+    (étape d'ingestion, voir dvf_data.finalize_clean).
+    """
+    if df.empty or "latitude" not in df.columns or "longitude" not in df.columns:
+        return df
+    df = df.assign(cellule=cell_keys(df["latitude"], df["longitude"]))
+    return df.sort_values(["code_commune", "cellule"], kind="stable", ignore_index=True)
+
+
+class SpatialIndex:
+    """
+    Index des ventes localisées d'un tableau (une commune, ou plusieurs années
+    concaténées). Les recherches renvoient des positions dans ce tableau.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.n = len(df)
+        if "latitude" in df.columns and "longitude" in df.columns:
+            lat = df["latitude"].to_numpy(dtype="float64")
+            lon = df["longitude"].to_numpy(dtype="float64")
+        else:
+            lat = lon = np.full(self.n, np.nan)
+        self._x, self._y = project(lat, lon)
+
+        # Attributs des filtres de comparables, évalués sur les seules ventes candidates
+        self._surface = df["surface_reelle_bati"].to_numpy(dtype="float64") if self.n else np.empty(0)
+        types = df["type_local"].astype("category") if self.n else pd.Series(dtype="category")
+        self._type_codes = types.cat.codes.to_numpy()
+        self._type_categories = list(types.cat.categories)
+        self._aberrants = df["aberrant"].to_numpy(dtype=bool) if "aberrant" in df.columns else None
+
+        cles = df["cellule"].to_numpy(dtype="int64") if "cellule" in df.columns else cell_keys(lat, lon)
+        # Déjà rangées par cellule à l'ingestion : le tri stable ne fait que vérifier l'ordre
+        ordre = np.argsort(cles, kind="stable")
+        self._ordre = ordre[cles[ordre] != CELLULE_VIDE]
+        self._cles = cles[self._ordre]
+        self.n_localisees = len(self._ordre)
+        if self.n_localisees:
+            iy = self._cles >> 32
+            ix = (self._cles & 0xFFFFFFFF) - _DECALAGE
+            self._emprise = (int(ix.min()), int(ix.max()), int(iy.min()), int(iy.max()))
+
+    def _positions(self, cles: np.ndarray) -> np.ndarray:
+        """
+        Positions des ventes situées dans les cellules `cles`.
+        """
+        debuts = np.searchsorted(self._cles, cles, side="left")
+        longueurs = np.searchsorted(self._cles, cles, side="right") - debuts
+        total = int(longueurs.sum())
+        if not total:
+            return np.empty(0, dtype="int64")
+        decalages = np.repeat(debuts - (np.cumsum(longueurs) - longueurs), longueurs)
+        return self._ordre[np.arange(total) + decalages]
+
+    @staticmethod
+    def _anneau(cx: int, cy: int, r: int) -> np.ndarray:
+        # Cellules à distance de Tchebychev exactement r de (cx, cy)
+        if r == 0:
+            return _cle([cx], [cy])
+        cote = np.arange(-r, r + 1)
+        interieur = np.arange(-r + 1, r)
+        ix = np.concatenate([cx + cote, cx + cote, np.full(len(interieur), cx - r), np.full(len(interieur), cx + r)])
+        iy = np.concatenate([np.full(len(cote), cy - r), np.full(len(cote), cy + r), cy + interieur, cy + interieur])
+        return _cle(ix, iy)
+
+    def _distances(self, positions: np.ndarray, x: float, y: float) -> np.ndarray:
+        return np.hypot(self._x[positions] - x, self._y[positions] - y)
+
+    def comparable_filter(self, type_local: str = 'Tous', surface: float = None, tolerance: float = 0.25,
+                          exclure_aberrants: bool = True):
+        """
+        Filtre des ventes comparables (même type, surface à ± tolerance, prix non
+        aberrant) à passer à nearest / within : appliqué aux seules positions candidates.
+        """
+        code_type = self._type_categories.index(type_local) if type_local in self._type_categories else -2
+
+        def garde(positions: np.ndarray) -> np.ndarray:
+            resultat = np.ones(len(positions), dtype=bool)
+            if type_local != 'Tous':
+                resultat &= self._type_codes[positions] == code_type
+            if surface:
+                surfaces = self._surface[positions]
+                resultat &= (surfaces >= surface * (1 - tolerance)) & (surfaces <= surface * (1 + tolerance))
+            if exclure_aberrants and self._aberrants is not None:
+                resultat &= ~self._aberrants[positions]
+            return resultat
+        return garde
+
+    def within(self, lat: float, lon: float, rayon_m: float, garde=None):
+        """
+        Ventes à moins de `rayon_m` mètres du point (restreintes à celles retenues par
+        `garde`, voir comparable_filter) : positions et distances, de la plus proche à la
+        plus lointaine.
+        """
+        if not self.n_localisees:
+            return np.empty(0, dtype="int64"), np.empty(0)
+        x, y = project(lat, lon)
+        cx, cy = int(np.floor(x / TAILLE_CELLULE_M)), int(np.floor(y / TAILLE_CELLULE_M))
+        r = int(np.ceil(rayon_m / TAILLE_CELLULE_M))
+        dx, dy = np.meshgrid(np.arange(-r, r + 1), np.arange(-r, r + 1))
+        positions = self._positions(np.unique(_cle(cx + dx.ravel(), cy + dy.ravel())))
+        if garde is not None:
+            positions = positions[garde(positions)]
+        distances = self._distances(positions, x, y)
+        proches = distances <= rayon_m
+        ordre = np.argsort(distances[proches], kind="stable")
+        return positions[proches][ordre], distances[proches][ordre]
+
+    def nearest(self, lat: float, lon: float, k: int, garde=None, rayon_max: float = None):
+        """
+        Les `k` ventes les plus proches du point (restreintes à `garde`, et à moins de
+        `rayon_max` mètres si fourni) : positions et distances, de la plus proche à la
+        plus lointaine. Les cellules sont parcourues par anneaux concentriques jusqu'à ce
+        que la k-ième distance trouvée soit inférieure au rayon déjà couvert.
+        """
+        vide = np.empty(0, dtype="int64"), np.empty(0)
+        if not self.n_localisees or k <= 0:
+            return vide
+        x, y = project(lat, lon)
+        cx, cy = int(np.floor(x / TAILLE_CELLULE_M)), int(np.floor(y / TAILLE_CELLULE_M))
+        ix_min, ix_max, iy_min, iy_max = self._emprise
+        # Anneaux entièrement hors de l'emprise des ventes : inutile de les parcourir
+        r_debut = max(0, ix_min - cx, cx - ix_max, iy_min - cy, cy - iy_max)
+        r_fin = max(cx - ix_min, ix_max - cx, cy - iy_min, iy_max - cy)
+        if rayon_max is not None:
+            r_fin = min(r_fin, int(np.ceil(rayon_max / TAILLE_CELLULE_M)))
+
+        positions, distances, trouves = [], [], 0
+        for r in range(r_debut, r_fin + 1):
+            p = self._positions(self._anneau(cx, cy, r))
+            if garde is not None:
+                p = p[garde(p)]
+            if len(p):
+                positions.append(p)
+                distances.append(self._distances(p, x, y))
+                trouves += len(p)
+            # Toute vente hors des anneaux déjà parcourus est à plus de r cellules du point
+            if trouves >= k and np.partition(np.concatenate(distances), k - 1)[k - 1] <= r * TAILLE_CELLULE_M:
+                break
+        if not trouves:
+            return vide
+
+        positions, distances = np.concatenate(positions), np.concatenate(distances)
+        if rayon_max is not None:
+            garde = distances <= rayon_max
+            positions, distances = positions[garde], distances[garde]
+        ordre = np.argsort(distances, kind="stable")[:k]
+        return positions[ordre], distances[ordre]
+
+
+def comparables(df: pd.DataFrame, index: SpatialIndex, lat: float, lon: float, type_local: str,
+                surface: float, k: int = 20, tolerance: float = 0.25, exclure_aberrants: bool = True,
+                rayon_max: float = None):
+    """
+    Les `k` ventes de même type et de surface proche (± tolerance) les plus proches du
+    point, avec leur distance (colonne distance_m), et les statistiques de leur prix au m².
+    """
+    garde = index.comparable_filter(type_local, surface, tolerance, exclure_aberrants)
+    positions, distances = index.nearest(lat, lon, k, garde, rayon_max)
+    lignes = df.iloc[positions].assign(distance_m=distances)
+    prix_m2 = df["prix_m2"].to_numpy(dtype="float64")[positions]
+    stats = {
+        "n": len(lignes),
+        "distance_max": float(distances.max()) if len(distances) else float("nan"),
+        "prix_m2_median": float(np.median(prix_m2)) if len(prix_m2) else float("nan"),
+        "prix_m2_moyen": float(prix_m2.mean()) if len(prix_m2) else float("nan"),
+        "prix_m2_q1": float(np.quantile(prix_m2, 0.25)) if len(prix_m2) else float("nan"),
+        "prix_m2_q3": float(np.quantile(prix_m2, 0.75)) if len(prix_m2) else float("nan"),
+    }
+    return lignes, stats
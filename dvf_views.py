@@ -0,0 +1,387 @@
+# dvf_views.py
+"""
+Sections d'affichage communes aux dashboards : filtres, KPIs, graphiques,
+carte et tableau des transactions.
+"""
+import functools
+import math
+
+import streamlit as st
+import plotly.express as px
+import plotly.graph_objects as go
+
+from dvf_charts import chart_figures
+from dvf_cube import BINS_PRIX_M2, compare_cubes, hist_box_stats, monthly_trend, query_cube
+from dvf_filters import COLONNES_TRI, FilterEngine
+from dvf_map import POINTS_MAX, hex_aggregate
+from dvf_profiling import fragment_run, frame_info, stage, stop_run
+from dvf_spatial import SpatialIndex, comparables
+
+
+def _fragment(nom: str):
+    """
+    Section rejouée seule (st.fragment) quand l'un de ses widgets change, profilée
+    sous le nom `nom` lorsqu'elle est rejouée hors d'un rerun complet.
+    """
+    def decorateur(fonction):
+        @functools.wraps(fonction)
+        def section(*args, **kwargs):
+            with fragment_run(nom):
+                return fonction(*args, **kwargs)
+        return st.fragment(section)
+    return decorateur
+
+
+def _rerun_app_on_change(cle: str, valeur):
+    """
+    Relance toute la page, et non le seul fragment courant, quand `valeur` (dont dépend
+    une section hors du fragment) a changé depuis le passage précédent.
+    """
+    precedente = st.session_state.get(cle, valeur)
+    st.session_state[cle] = valeur
+    if precedente != valeur:
+        st.rerun(scope="app")
+
+
+def render_filters(df, engine: FilterEngine = None, bornes=None):
+    """
+    Filtres de la barre latérale. Renvoie les transactions filtrées et la valeur
+    des filtres (arrête le script si aucune transaction ne correspond).
+    Les masques par dimension sont gardés dans `engine` (voir dvf_filters.py) :
+    seul le filtre modifié est réévalué d'un rerun à l'autre.
+    Les ventes signalées comme aberrantes au chargement sont exclues par défaut ;
+    leurs bornes par type de bien (`bornes`) sont affichées sous la case à cocher.
+    """
+    if engine is None:
+        engine = FilterEngine(df)
+
+    st.sidebar.header("Filtres")
+    codes_postaux_disponibles = engine.codes_postaux
+    code_postal_selectionne = st.sidebar.multiselect("Code postal", codes_postaux_disponibles, default=codes_postaux_disponibles)
+    type_local = st.sidebar.selectbox("Type de bien", ['Tous', 'Maison', 'Appartement'])
+    prix_min = st.sidebar.number_input("Prix minimum (€)", value=0, step=10000)
+    prix_max = st.sidebar.number_input("Prix maximum (€)", value=math.ceil(engine.prix_max), step=10000)
+    # Maximum au-delà de la vente la plus chère : pas de borne (la vue reste lisible dans le cube)
+    if prix_max >= engine.prix_max:
+        prix_max = math.inf
+    exclure_aberrants = st.sidebar.checkbox("Exclure les prix au m² aberrants", value=True, key="exclure_aberrants",
+                                            help=f"{engine.n_aberrants:,} ventes signalées pour cette commune")
+    if bornes is not None and not bornes.empty:
+        with st.sidebar.expander("Bornes des prix aberrants"):
+            st.dataframe(bornes.drop(columns="code_commune", errors="ignore").round({"borne_basse": 0, "borne_haute": 0}),
+                         hide_index=True, use_container_width=True)
+
+    # Application des filtres
+    df_filtre = engine.select(code_postal_selectionne, type_local, prix_min, prix_max, exclure_aberrants)
+
+    if df_filtre.empty:
+        st.warning("Aucune transaction ne correspond à vos filtres.")
+        stop_run()
+
+    filtres = {"codes_postaux": code_postal_selectionne, "type_local": type_local,
+               "prix_min": prix_min, "prix_max": prix_max, "exclure_aberrants": exclure_aberrants}
+    return df_filtre, filtres
+
+
+def render_kpis(df_filtre, nom_commune: str, resume: dict = None):
+    """
+    KPIs lus dans le résumé du cube s'il est fourni, sinon calculés sur les lignes filtrées.
+    """
+    st.header(f"Indicateurs Clés pour {nom_commune}")
+    if resume is not None:
+        prix_m2_moyen, prix_median = resume["prix_m2_moyen"], resume["prix_median"]
+        n, surface_moyenne = resume["n"], resume["surface_moyenne"]
+    else:
+        prix_m2_moyen, prix_median = df_filtre['prix_m2'].mean(), df_filtre['valeur_fonciere'].median()
+        n, surface_moyenne = len(df_filtre), df_filtre['surface_reelle_bati'].mean()
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Prix Moyen / m²", f"{prix_m2_moyen:.0f} €")
+    with col2:
+        st.metric("Prix Médian", f"{prix_median:.0f} €")
+    with col3:
+        st.metric("Transactions", f"{n:,}")
+    with col4:
+        st.metric("Surface Moyenne", f"{surface_moyenne:.0f} m²")
+
+
+def render_charts(df_filtre, nom_commune: str, resume: dict = None, engine: FilterEngine = None,
+                  filtres: dict = None):
+    """
+    Graphiques construits à partir du résumé du cube s'il est fourni, sinon à partir des
+    lignes filtrées : seuls les comptes par classe, quartiles et comptes par type sont
+    envoyés à Plotly (voir dvf_charts.py). Avec le moteur de filtres, les figures sont
+    mises en cache par état de filtres.
+    """
+    st.header(f"Visualisations pour {nom_commune}")
+    if engine is not None and filtres is not None:
+        fig_prix, fig_types = engine.memo("graphiques", (engine.filter_key(**filtres), resume is not None),
+                                          lambda: chart_figures(df_filtre, resume))
+    else:
+        fig_prix, fig_types = chart_figures(df_filtre, resume)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Répartition des Prix au m²")
+        st.plotly_chart(fig_prix, use_container_width=True)
+    with col2:
+        st.subheader("Répartition des Types de Biens")
+        st.plotly_chart(fig_types, use_container_width=True)
+
+
+def render_trend(cubes_annuels: list, filtres: dict, nom_commune: str):
+    """
+    Évolution mensuelle du prix moyen au m², calculée à partir des cubes annuels
+    (codes postaux, type de bien et prix aberrants filtrés ; la fourchette de prix n'est pas appliquée).
+    """
+    st.subheader(f"Évolution du Prix au m² à {nom_commune}")
+    tendance = monthly_trend(cubes_annuels, filtres["codes_postaux"], filtres["type_local"],
+                             filtres["exclure_aberrants"])
+    if tendance.empty:
+        st.info("Pas assez de données pour afficher l'évolution des prix.")
+        return
+    fig = px.line(tendance, x="mois", y="prix_m2_moyen", color="type_local", markers=True,
+                  hover_data={"n": True}, labels={"mois": "Mois", "prix_m2_moyen": "Prix moyen / m² (€)"})
+    st.plotly_chart(fig, use_container_width=True)
+    st.caption("Moyenne mensuelle toutes fourchettes de prix confondues.")
+
+
+def render_map(df_filtre, nom_commune: str, engine: FilterEngine = None, filtres: dict = None):
+    """
+    Carte des transactions. Au-delà de POINTS_MAX ventes, elles sont agrégées côté serveur
+    sur une grille hexagonale (nombre de ventes et prix médian au m² par cellule),
+    mise en cache par état de filtres et niveau de zoom.
+    """
+    st.subheader(f"Carte des Transactions à {nom_commune}")
+    if 'latitude' not in df_filtre.columns or 'longitude' not in df_filtre.columns:
+        st.warning("Les données de localisation (latitude/longitude) ne sont pas disponibles pour afficher la carte.")
+        return
+
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        agreger = st.checkbox("Agréger par cellules", value=True)
+    with col2:
+        zoom = st.select_slider("Zoom de la carte", options=[9, 10, 11, 12, 13, 14], value=11)
+
+    if agreger and len(df_filtre) > POINTS_MAX:
+        if engine is not None and filtres is not None:
+            grille = engine.memo("carte", (engine.filter_key(**filtres), zoom), lambda: hex_aggregate(df_filtre, zoom))
+        else:
+            grille = hex_aggregate(df_filtre, zoom)
+        cells = grille["cells"]
+        centre_lat, centre_lon = grille["center"]
+        fig = px.choropleth_mapbox(cells, geojson=grille["geojson"], locations="id", color="prix_m2_median", hover_data={"id": False, "n": True, "prix_m2_median": ":.0f"}, color_continuous_scale=px.colors.sequential.Viridis, opacity=0.6, zoom=zoom, center={"lat": centre_lat, "lon": centre_lon}, mapbox_style="open-street-map", title=f"Carte de {int(cells['n'].sum())} transactions ({len(cells)} cellules)")
+        fig.update_traces(marker_line_width=0)
+    else:
+        # Peu de ventes (ou agrégation désactivée) : points individuels, échantillon stable au-delà de 5000
+        df_carte = df_filtre if len(df_filtre) <= 5000 else df_filtre.sample(5000, random_state=0)
+        titre = f"Carte de {len(df_carte)} transactions" + (" (échantillon)" if len(df_carte) < len(df_filtre) else "")
+        fig = px.scatter_mapbox(df_carte, lat="latitude", lon="longitude", color="prix_m2", size="surface_reelle_bati", hover_data=["valeur_fonciere", "type_local", "date_mutation"], color_continuous_scale=px.colors.sequential.Viridis, size_max=15, zoom=zoom, mapbox_style="open-street-map", title=titre)
+    st.plotly_chart(fig, use_container_width=True)
+
+
+# Nombre de transactions par page du tableau
+TAILLE_PAGE = 100
+
+# Biens comparables : nombre de ventes retenues, tolérance sur la surface et rayons proposés
+K_COMPARABLES = 20
+TOLERANCE_SURFACE = 0.25
+RAYONS_COMPARABLES = {"Sans limite": None, "250 m": 250, "500 m": 500, "1 km": 1000, "2 km": 2000}
+
+# Mode comparaison : communes proposées par défaut et nombre maximal de communes
+COMPARAISON_DEFAUT = ["Pessac", "Talence", "Mérignac"]
+MAX_COMPARAISON = 8
+
+
+def render_table(df_filtre, engine: FilterEngine = None, filtres: dict = None):
+    """
+    Tableau paginé des transactions, trié par date, prix ou surface. Avec le moteur de
+    filtres, l'ordre de tri est précalculé par commune et seule la page affichée est
+    extraite ; sinon la page est obtenue par sélection partielle (nlargest / nsmallest).
+    """
+    st.subheader("Détail des Transactions")
+    total = len(df_filtre)
+    nb_pages = max(1, -(-total // TAILLE_PAGE))
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        tri = st.selectbox("Trier par", list(COLONNES_TRI))
+    with col2:
+        ordre = st.selectbox("Ordre", ["Décroissant", "Croissant"])
+    with col3:
+        page = st.number_input("Page", min_value=1, max_value=nb_pages, value=1, step=1)
+    colonne, decroissant, debut = COLONNES_TRI[tri], ordre == "Décroissant", (page - 1) * TAILLE_PAGE
+
+    if engine is not None and filtres is not None:
+        lignes, total = engine.page(filtres, colonne, decroissant, page - 1, TAILLE_PAGE)
+    else:
+        selection = df_filtre.nlargest if decroissant else df_filtre.nsmallest
+        lignes = selection(debut + TAILLE_PAGE, colonne).iloc[debut:]
+
+    st.caption(f"Transactions {debut + 1 if total else 0}–{min(debut + TAILLE_PAGE, total)} sur {total:,} (page {page}/{nb_pages})")
+    st.dataframe(lignes.drop(columns=['latitude', 'longitude'], errors='ignore'))
+
+
+def render_comparables(df, index: SpatialIndex, nom_commune: str, exclure_aberrants: bool = True):
+    """
+    Biens comparables autour d'un point : les K_COMPARABLES ventes de même type et de
+    surface proche les plus proches, cherchées dans l'index spatial de la commune
+    (voir dvf_spatial.py) et non par un calcul de distance sur toutes les ventes.
+    """
+    st.subheader(f"Biens comparables à {nom_commune}")
+    if index is None or not index.n_localisees:
+        st.info("Aucune vente localisée pour rechercher des biens comparables.")
+        return
+
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        latitude = st.number_input("Latitude", value=float(df["latitude"].median()), step=0.001, format="%.5f")
+    with col2:
+        longitude = st.number_input("Longitude", value=float(df["longitude"].median()), step=0.001, format="%.5f")
+    with col3:
+        type_local = st.selectbox("Type de bien comparable", ['Appartement', 'Maison'])
+    with col4:
+        surface = st.number_input("Surface (m²)", min_value=0, value=70, step=5)
+    with col5:
+        rayon = st.selectbox("Rayon", list(RAYONS_COMPARABLES))
+
+    lignes, stats = comparables(df, index, latitude, longitude, type_local, surface, K_COMPARABLES,
+                                TOLERANCE_SURFACE, exclure_aberrants, RAYONS_COMPARABLES[rayon])
+    if lignes.empty:
+        st.info(f"Aucune vente comparable ({type_local.lower()} de {surface} m² ± {TOLERANCE_SURFACE:.0%}) "
+                f"dans ce rayon.")
+        return
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Comparables", f"{stats['n']}")
+    with col2:
+        st.metric("Prix Médian / m²", f"{stats['prix_m2_median']:.0f} €")
+    with col3:
+        st.metric("Fourchette / m² (Q1–Q3)", f"{stats['prix_m2_q1']:.0f}–{stats['prix_m2_q3']:.0f} €")
+    with col4:
+        st.metric("Distance max", f"{stats['distance_max']:.0f} m")
+
+    fig = px.scatter_mapbox(lignes, lat="latitude", lon="longitude", color="prix_m2", size="surface_reelle_bati",
+                            hover_data={"valeur_fonciere": True, "date_mutation": True, "distance_m": ":.0f"},
+                            color_continuous_scale=px.colors.sequential.Viridis, size_max=15, zoom=14,
+                            center={"lat": latitude, "lon": longitude}, mapbox_style="open-street-map")
+    fig.add_trace(go.Scattermapbox(lat=[latitude], lon=[longitude], mode="markers", name="Bien recherché",
+                                   marker={"size": 14, "color": "red"}))
+    st.plotly_chart(fig, use_container_width=True)
+    colonnes = ["distance_m", "date_mutation", "type_local", "surface_reelle_bati", "valeur_fonciere", "prix_m2",
+                "adresse_numero", "adresse_nom_voie", "code_postal"]
+    st.dataframe(lignes[[c for c in colonnes if c in lignes.columns]].round({"distance_m": 0, "prix_m2": 0}),
+                 hide_index=True, use_container_width=True)
+
+
+@_fragment("carte")
+def _map_section(df_filtre, nom_commune: str, engine: FilterEngine = None, filtres: dict = None):
+    with stage("carte", rows=len(df_filtre)):
+        render_map(df_filtre, nom_commune, engine, filtres)
+
+
+@_fragment("tableau")
+def _table_section(df_filtre, engine: FilterEngine = None, filtres: dict = None):
+    with stage("tableau", rows=len(df_filtre)):
+        render_table(df_filtre, engine, filtres)
+
+
+@_fragment("comparables")
+def _comparables_section(df, index: SpatialIndex, nom_commune: str, exclure_aberrants: bool):
+    with stage("comparables"):
+        render_comparables(df, index, nom_commune, exclure_aberrants)
+
+
+@_fragment("filtres")
+def _filtered_sections(df, nom_commune: str, cube: dict = None, engine: FilterEngine = None,
+                       cubes_annuels: list = None, bornes=None):
+    """
+    Filtres et sections qui en dépendent : KPIs, graphiques, tendance, carte et tableau.
+    """
+    with stage("filtres", **frame_info(df)) as m:
+        df_filtre, filtres = render_filters(df, engine, bornes)
+        m["rows_out"] = len(df_filtre)
+    # Les comparables, hors de ce fragment, dépendent aussi de l'exclusion des prix aberrants
+    _rerun_app_on_change("_comparables_exclure_aberrants", filtres["exclure_aberrants"])
+    with stage("cube") as m:
+        resume = query_cube(cube, **filtres) if cube else None
+        m["hit"] = resume is not None
+    with stage("kpis", rows=len(df_filtre)):
+        render_kpis(df_filtre, nom_commune, resume)
+    with stage("graphiques", rows=len(df_filtre)):
+        render_charts(df_filtre, nom_commune, resume, engine, filtres)
+    if cubes_annuels:
+        with stage("tendance"):
+            render_trend(cubes_annuels, filtres, nom_commune)
+    _map_section(df_filtre, nom_commune, engine, filtres)
+    _table_section(df_filtre, engine, filtres)
+
+
+def render_dashboard(df, nom_commune: str, cube: dict = None, engine: FilterEngine = None,
+                     cubes_annuels: list = None, bornes=None, index: SpatialIndex = None):
+    """
+    Page complète pour une commune : filtres, KPIs, graphiques, carte et tableau.
+    Si le cube de la commune est fourni, KPIs et graphiques en sont lus dès que les filtres le permettent.
+    Avec les cubes annuels, une courbe d'évolution mensuelle des prix est ajoutée, et avec
+    l'index spatial une recherche de biens comparables.
+    Les sections sont des fragments Streamlit : un changement de filtre ne rejoue que les
+    sections filtrées, sans le chargement ni la sélection de la commune, et les réglages
+    propres à la carte, au tableau ou aux comparables ne rejouent que leur section.
+    Chaque section est chronométrée (voir dvf_profiling.py).
+    """
+    _filtered_sections(df, nom_commune, cube, engine, cubes_annuels, bornes)
+    if index is not None:
+        _comparables_section(df, index, nom_commune, st.session_state.get("exclure_aberrants", True))
+
+
+@_fragment("comparaison")
+def render_comparison(cubes: dict):
+    """
+    Comparaison de plusieurs communes ({nom: cube}) : tableau des KPIs côte à côte et
+    distributions des prix au m² superposées, calculés en une passe sur les cubes
+    (voir dvf_cube.compare_cubes). Fragment : un changement de filtre ne rejoue que cette section.
+    """
+    st.sidebar.header("Filtres")
+    type_local = st.sidebar.selectbox("Type de bien", ['Tous', 'Maison', 'Appartement'])
+    exclure_aberrants = st.sidebar.checkbox("Exclure les prix au m² aberrants", value=True, key="exclure_aberrants")
+
+    with stage("comparaison", communes=len(cubes)):
+        kpis, histogrammes = compare_cubes(cubes, type_local, exclure_aberrants)
+    vides = [nom for nom in cubes if nom not in kpis.index or not kpis.loc[nom, "n"]]
+    if vides:
+        st.warning("Aucune transaction pour : " + ", ".join(vides))
+    # Une ligne d'histogramme par commune du tableau, dans le même ordre
+    series = [(nom, histogrammes[i]) for i, nom in enumerate(kpis.index) if kpis.loc[nom, "n"]]
+    kpis = kpis[kpis["n"] > 0]
+    if kpis.empty:
+        stop_run()
+
+    st.header("Indicateurs Clés par Commune")
+    st.dataframe(kpis.rename(columns={"n": "Transactions", "prix_m2_moyen": "Prix Moyen / m² (€)",
+                                      "prix_median": "Prix Médian (€)", "surface_moyenne": "Surface Moyenne (m²)"}),
+                 column_config={"Prix Moyen / m² (€)": st.column_config.NumberColumn(format="%.0f"),
+                                "Prix Médian (€)": st.column_config.NumberColumn(format="%.0f"),
+                                "Surface Moyenne (m²)": st.column_config.NumberColumn(format="%.0f")},
+                 use_container_width=True)
+
+    st.header("Répartition des Prix au m²")
+    centres = (BINS_PRIX_M2[:-1] + BINS_PRIX_M2[1:]) / 2
+    col1, col2 = st.columns(2)
+    with col1:
+        fig = go.Figure()
+        for nom, counts in series:
+            if not counts.sum():
+                continue
+            fig.add_trace(go.Scatter(x=centres, y=100 * counts / counts.sum(), mode="lines",
+                                     line_shape="hvh", name=nom))
+        fig.update_layout(xaxis_title="prix_m2", yaxis_title="% des ventes", legend_title_text="Commune")
+        st.plotly_chart(fig, use_container_width=True)
+    with col2:
+        fig = go.Figure()
+        for nom, counts in series:
+            stats = hist_box_stats(counts)
+            if stats is None:
+                continue
+            fig.add_trace(go.Box(y=[nom], orientation="h", name=nom, **{k: [v] for k, v in stats.items()}))
+        fig.update_layout(xaxis_title="prix_m2", showlegend=False)
+        st.plotly_chart(fig, use_container_width=True)
@@ -0,0 +1,20 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+from benchmarks.generate_dvf import generate  # noqa: E402
+from dvf_data import LocalCsvSource  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def partitions(tmp_path_factory) -> dict:
+    """
+    Fichier DVF synthétique nettoyé, découpé par commune.
+    """
+    chemin = generate(30_000, str(tmp_path_factory.mktemp("dvf") / "dvf_synth.csv"))
+    return LocalCsvSource(chemin).partitions()
@@ -0,0 +1,50 @@
+# tests/test_dvf_api.py
+import asyncio
+import json
+import os
+
+import pytest
+import requests
+
+os.environ.setdefault("DVF_REFRESH", "0")
+
+import dvf_api  # noqa: E402
+
+
+def _reponse(exception: Exception):
+    def calcul():
+        raise exception
+    reponse = asyncio.run(dvf_api._repondre(("test", repr(exception)), calcul))
+    return reponse.status_code, json.loads(reponse.body), reponse.headers
+
+
+def _http_error(statut: int) -> requests.exceptions.HTTPError:
+    reponse = requests.Response()
+    reponse.status_code = statut
+    reponse.url = "https://files.data.gouv.fr/geo-dvf/latest/csv/2024/communes/33/33003.csv"
+    return requests.exceptions.HTTPError(response=reponse)
+
+
+def test_origine_injoignable_503():
+    statut, corps, entetes = _reponse(requests.exceptions.ConnectionError("refusée"))
+    assert statut == 503 and "injoignable" in corps["erreur"]
+    assert entetes["retry-after"] == str(dvf_api.RETRY_AFTER)
+
+
+@pytest.mark.parametrize("amont, attendu", [(404, 404), (500, 502), (403, 502)])
+def test_reponse_erreur_origine(amont, attendu):
+    statut, corps, _ = _reponse(_http_error(amont))
+    assert statut == attendu and "erreur" in corps
+
+
+def test_parametre_invalide_400():
+    statut, corps, _ = _reponse(dvf_api.ParametreInvalide("tri inconnu"))
+    assert (statut, corps) == (400, {"erreur": "tri inconnu"})
+
+
+@pytest.mark.parametrize("nom, valeur", [("lat", "inf"), ("lon", "-inf"), ("prix_max", "nan"), ("k", "1e999")])
+def test_nombre_non_fini_400(nom, valeur):
+    def calcul():
+        return dvf_api._entier({nom: valeur}, nom, 20) if nom == "k" else dvf_api._nombre({nom: valeur}, nom, 0.0)
+    reponse = asyncio.run(dvf_api._repondre(("test", nom, valeur), calcul))
+    assert reponse.status_code == 400 and "fini" in json.loads(reponse.body)["erreur"]
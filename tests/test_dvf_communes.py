@@ -0,0 +1,27 @@
+# tests/test_dvf_communes.py
+import pytest
+
+from dvf_communes import read_registry, registry, search_communes
+
+
+def test_referentiel_complet():
+    ref = registry()
+    assert len(ref) == 535
+    assert ref.metadata["extrait"] == "0"
+    assert ref.get("33063").nom == "Bordeaux"
+    assert ref.get("33140").nom == "Créon"
+
+
+def test_recherche_sans_accents():
+    assert search_communes("merig") == ["Mérignac", "Mérignas"]
+    assert "Saint-Médard-en-Jalles" in search_communes("st medard")
+    assert search_communes("salleboeuf") == ["Sallebœuf"]
+
+
+def test_fichier_tronque_refuse(tmp_path):
+    chemin = tmp_path / "communes.csv"
+    chemin.write_text("# referentiel=communes_gironde version=1 communes=2\n"
+                      "code_insee,nom,codes_postaux,latitude,longitude\n"
+                      "33063,Bordeaux,33000,44.83778,-0.57944\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="1 communes lues"):
+        read_registry(str(chemin))
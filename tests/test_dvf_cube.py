@@ -0,0 +1,84 @@
+# tests/test_dvf_cube.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from dvf_charts import summarize_rows
+from dvf_cube import SKETCH_ALPHA, build_cube, compare_cubes, hist_box_stats, query_cube
+
+
+def _ventes(valeurs) -> pd.DataFrame:
+    n = len(valeurs)
+    return pd.DataFrame({
+        "code_commune": ["33063"] * n, "code_postal": ["33000"] * n, "type_local": ["Maison"] * n,
+        "date_mutation": pd.to_datetime(["2024-01-15"] * n),
+        "valeur_fonciere": np.asarray(valeurs, dtype="float64"),
+        "surface_reelle_bati": np.full(n, 100.0),
+        "prix_m2": np.asarray(valeurs, dtype="float64") / 100,
+    })
+
+
+def test_mediane_nombre_pair():
+    resume = query_cube(build_cube(_ventes([100_000, 300_000])), None, 'Tous', 0, np.inf)
+    assert resume["prix_median"] == pytest.approx(200_000, rel=SKETCH_ALPHA)
+
+
+@pytest.mark.parametrize("type_local", ['Tous', 'Maison', 'Appartement'])
+@pytest.mark.parametrize("exclure_aberrants", [False, True])
+def test_mediane_comme_pandas(partitions, type_local, exclure_aberrants):
+    communes = sorted(partitions, key=lambda c: -len(partitions[c]))[:30]
+    for code in communes:
+        df = partitions[code]
+        resume = query_cube(build_cube(df), None, type_local, 0, np.inf, exclure_aberrants)
+        lignes = df if type_local == 'Tous' else df[df["type_local"] == type_local]
+        if exclure_aberrants:
+            lignes = lignes[~lignes["aberrant"]]
+        if lignes.empty:
+            assert resume is None
+            continue
+        attendu = lignes["valeur_fonciere"].astype("float64").median()
+        assert resume["prix_median"] == pytest.approx(attendu, rel=SKETCH_ALPHA), code
+
+
+def test_compare_cubes_comme_pandas(partitions):
+    communes = sorted(partitions, key=lambda c: -len(partitions[c]))[:10]
+    kpis, _ = compare_cubes({code: build_cube(partitions[code]) for code in communes})
+    for code in communes:
+        attendu = partitions[code]["valeur_fonciere"].astype("float64").median()
+        assert kpis.loc[code, "prix_median"] == pytest.approx(attendu, rel=SKETCH_ALPHA)
+
+
+def test_prix_hors_echelle_comptes_a_part():
+    # 100, 199 et 20 000 €/m² sont hors de BINS_PRIX_M2 ; 15 000 €/m² est dans la dernière classe
+    ventes = _ventes([10_000, 19_900, 250_000, 1_500_000, 2_000_000])
+    resume = query_cube(build_cube(ventes), None, 'Tous', 0, np.inf)
+    assert resume["hors_echelle"] == 3
+    assert resume["hist"]["Maison"].sum() == 2
+    assert resume["hist"]["Maison"][0] == 0 and resume["hist"]["Maison"][-1] == 1
+
+    lignes = summarize_rows(ventes)
+    assert lignes["hors_echelle"] == 3
+    np.testing.assert_array_equal(lignes["hist"]["Maison"], resume["hist"]["Maison"])
+    assert lignes["types"]["Maison"] == 5
+
+
+def test_tous_prix_hors_echelle():
+    # Toutes les ventes hors de BINS_PRIX_M2 : histogramme vide, pas de boîte à moustaches
+    ventes = _ventes([10_000, 19_900, 2_500_000])
+    resume = query_cube(build_cube(ventes), None, 'Tous', 0, np.inf)
+    assert resume["n"] == 3 and resume["hors_echelle"] == 3
+    assert resume["hist"]["Maison"].sum() == 0
+    assert hist_box_stats(resume["hist"]["Maison"]) is None
+
+    kpis, histogrammes = compare_cubes({"33063": build_cube(ventes)})
+    assert kpis.loc["33063", "n"] == 3
+    assert histogrammes[0].sum() == 0
+
+
+def test_histogramme_cube_comme_lignes(partitions):
+    df = max(partitions.values(), key=len)
+    resume = query_cube(build_cube(df), None, 'Tous', 0, np.inf)
+    lignes = summarize_rows(df)
+    assert resume["hors_echelle"] == lignes["hors_echelle"]
+    for type_local, comptes in lignes["hist"].items():
+        np.testing.assert_array_equal(resume["hist"][type_local], comptes)
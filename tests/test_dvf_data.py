@@ -0,0 +1,76 @@
+# tests/test_dvf_data.py
+import numpy as np
+import pandas as pd
+import pytest
+
+import dvf_data
+from benchmarks.generate_dvf import generate
+
+
+@pytest.fixture
+def contenu_commune(tmp_path) -> bytes:
+    chemin = generate(2_000, str(tmp_path / "commune.csv"))
+    with open(chemin, "rb") as f:
+        return f.read()
+
+
+def test_copie_perimee_gardee_jusqu_a_la_tentative_suivante(contenu_commune, monkeypatch):
+    appels = []
+
+    def fetch_cached(url):
+        appels.append(url)
+        return contenu_commune, True
+    monkeypatch.setattr(dvf_data, "fetch_cached", fetch_cached)
+    monkeypatch.setattr(dvf_data, "cache_validator", lambda url: None)
+
+    source = dvf_data.HttpCommuneSource()
+    premier = source.load_commune("33063")
+    assert not premier.empty and source.is_stale("33063")
+    assert source.load_commune("33063") is premier
+    assert len(appels) == 1
+
+    # Délai écoulé : l'origine est retentée, et une copie à jour n'est plus périmée
+    source._perimes["33063"] = 0
+    monkeypatch.setattr(dvf_data, "fetch_cached", lambda url: (contenu_commune, False))
+    assert source.load_commune("33063") is not premier
+    assert not source.is_stale("33063")
+
+
+def test_fichier_partage_depend_des_aberrants(tmp_path, monkeypatch):
+    csv = tmp_path / "dvf.csv"
+    csv.write_text("id_mutation\n")
+    chemins = set()
+    for methode in ("iqr", "mad", "aucune"):
+        monkeypatch.setattr(dvf_data, "METHODE_ABERRANTS", methode)
+        chemins.add(dvf_data.shared_path_for(str(csv)))
+    monkeypatch.setattr(dvf_data, "METHODE_ABERRANTS", "mad")
+    monkeypatch.setitem(dvf_data.SEUILS_ABERRANTS, "mad", 3.0)
+    chemins.add(dvf_data.shared_path_for(str(csv)))
+    assert len(chemins) == 4
+
+
+def test_dedupe_mutations_une_vente_par_mutation_et_commune():
+    df = pd.DataFrame({
+        "id_mutation": ["M1", "M1", "M1", "M2", "M3", "M3"],
+        "code_commune": ["33063", "33063", "33063", "33063", "33063", "33318"],
+        "type_local": ["Appartement", "Maison", "Appartement", "Maison", "Maison", "Appartement"],
+        "valeur_fonciere": [300_000.0, 300_000.0, 300_000.0, 200_000.0, 500_000.0, 500_000.0],
+        "surface_reelle_bati": [40.0, 70.0, 30.0, 100.0, 120.0, 60.0],
+        "nombre_pieces_principales": [2.0, 3.0, np.nan, 4.0, 5.0, 3.0],
+    })
+    ventes = dvf_data.dedupe_mutations(df).set_index(["id_mutation", "code_commune"])
+
+    # Trois lots d'une même mutation : une seule vente, surfaces et pièces sommées,
+    # type de la plus grande surface, prix au m² sur la surface totale
+    m1 = ventes.loc[("M1", "33063")]
+    assert (m1["nombre_lots"], m1["type_local"]) == (3, "Maison")
+    assert (m1["surface_reelle_bati"], m1["nombre_pieces_principales"]) == (140.0, 5.0)
+    assert (m1["valeur_fonciere"], m1["prix_m2"]) == (300_000.0, pytest.approx(300_000 / 140))
+
+    assert ventes.loc[("M2", "33063"), "nombre_lots"] == 1
+    assert ventes.loc[("M2", "33063"), "prix_m2"] == 2_000.0
+
+    # Une mutation sur deux communes reste une vente par commune
+    assert ventes.loc[("M3", "33063"), ["type_local", "surface_reelle_bati"]].tolist() == ["Maison", 120.0]
+    assert ventes.loc[("M3", "33318"), ["type_local", "surface_reelle_bati"]].tolist() == ["Appartement", 60.0]
+    assert len(ventes) == 4
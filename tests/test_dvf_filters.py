@@ -0,0 +1,93 @@
+# tests/test_dvf_filters.py
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dvf_filters import FilterEngine
+
+
+@pytest.fixture(scope="module")
+def commune(partitions) -> pd.DataFrame:
+    return max(partitions.values(), key=len)
+
+
+def _masque_pandas(df: pd.DataFrame, codes_postaux, type_local, prix_min, prix_max, exclure_aberrants):
+    masque = df["code_postal"].isin(codes_postaux) & df["valeur_fonciere"].between(prix_min, prix_max)
+    if type_local != 'Tous':
+        masque &= df["type_local"] == type_local
+    if exclure_aberrants:
+        masque &= ~df["aberrant"]
+    return masque.to_numpy()
+
+
+def test_masques_incrementaux_comme_filtre_complet(commune):
+    engine = FilterEngine(commune)
+    rng = np.random.default_rng(3)
+    prix = commune["valeur_fonciere"].to_numpy(dtype="float64")
+    etat = {"codes_postaux": engine.codes_postaux, "type_local": 'Tous',
+            "prix_min": 0.0, "prix_max": math.inf, "exclure_aberrants": False}
+    # Un seul widget change à chaque étape, comme dans la barre latérale : les
+    # masques des autres dimensions viennent du cache
+    for _ in range(60):
+        dimension = rng.choice(["codes_postaux", "type_local", "prix", "exclure_aberrants"])
+        if dimension == "codes_postaux":
+            taille = rng.integers(1, len(engine.codes_postaux) + 1)
+            etat["codes_postaux"] = list(rng.choice(engine.codes_postaux, taille, replace=False))
+        elif dimension == "type_local":
+            etat["type_local"] = rng.choice(['Tous', 'Maison', 'Appartement'])
+        elif dimension == "prix":
+            bornes = np.sort(rng.choice(prix, 2))
+            etat["prix_min"], etat["prix_max"] = float(bornes[0]), float(rng.choice([bornes[1], math.inf]))
+        else:
+            etat["exclure_aberrants"] = not etat["exclure_aberrants"]
+
+        attendu = _masque_pandas(commune, **etat)
+        masque = engine.mask(**etat)
+        np.testing.assert_array_equal(np.ones(len(commune), dtype=bool) if masque is None else masque, attendu)
+        np.testing.assert_array_equal(engine.indices(**etat) if masque is not None else np.arange(len(commune)),
+                                      np.flatnonzero(attendu))
+        assert len(engine.select(**etat)) == attendu.sum()
+
+
+def test_vente_la_plus_chere_gardee_par_defaut(commune):
+    engine = FilterEngine(commune)
+    plus_chere = int(commune["valeur_fonciere"].to_numpy().argmax())
+    assert engine.prix_max == commune["valeur_fonciere"].max()
+    # Valeur par défaut du widget (arrondie au-dessus) : la fourchette est ouverte
+    prix_max = math.ceil(engine.prix_max)
+    prix_max = math.inf if prix_max >= engine.prix_max else prix_max
+    assert engine.mask(engine.codes_postaux, 'Tous', 0, prix_max) is None
+    assert engine.select(engine.codes_postaux, 'Tous', 0, prix_max) is commune
+    # Les bornes sont inclusives : une fourchette réduite au prix maximal le garde
+    assert plus_chere in engine.indices(engine.codes_postaux, 'Tous', engine.prix_max, engine.prix_max)
+
+
+@pytest.mark.parametrize("colonne", ["valeur_fonciere", "surface_reelle_bati", "date_mutation"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_page_comme_tri_pandas(commune, colonne, descending):
+    engine = FilterEngine(commune)
+    filtres = {"codes_postaux": engine.codes_postaux[:1], "type_local": 'Maison',
+               "prix_min": 0.0, "prix_max": math.inf, "exclure_aberrants": True}
+    filtrees = commune[_masque_pandas(commune, **filtres)]
+    attendu = filtrees.sort_values(colonne, ascending=not descending, kind="stable", na_position="last")
+
+    lignes, total = [], None
+    for numero in range(math.ceil(len(filtrees) / 50) + 1):
+        page, total = engine.page(filtres, colonne, descending, page=numero, page_size=50)
+        assert len(page) == min(50, max(0, len(filtrees) - numero * 50))
+        lignes.append(page)
+    assert total == len(filtrees)
+    pages = pd.concat(lignes)
+    np.testing.assert_array_equal(pages[colonne].to_numpy(), attendu[colonne].to_numpy())
+    assert sorted(pages.index) == sorted(filtrees.index)
+    if not descending:
+        assert pages.index.tolist() == attendu.index.tolist()
+
+    # Sans filtre actif, toutes les ventes dans l'ordre précalculé
+    sans_filtre = {**filtres, "codes_postaux": engine.codes_postaux, "type_local": 'Tous', "exclure_aberrants": False}
+    tout, total = engine.page(sans_filtre, colonne, descending, page_size=len(commune))
+    attendu = commune.sort_values(colonne, ascending=not descending, kind="stable", na_position="last")
+    assert total == len(commune)
+    np.testing.assert_array_equal(tout[colonne].to_numpy(), attendu[colonne].to_numpy())
@@ -0,0 +1,111 @@
+# tests/test_dvf_http.py
+import http.server
+import json
+import threading
+
+import pytest
+import requests
+
+import dvf_http
+
+CONTENU = b"id_mutation,valeur_fonciere\n2024-1,250000\n"
+ETAG = '"v1"'
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requetes.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(CONTENU)))
+        self.end_headers()
+        self.wfile.write(CONTENU)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def serveur():
+    """
+    Serveur HTTP local qui sert CONTENU avec un ETag et répond 304 à If-None-Match.
+    """
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.requetes = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dvf_http, "HTTP_CACHE_DIR", str(tmp_path / "http"))
+
+
+@pytest.fixture
+def session():
+    return dvf_http.make_session(pool_size=1, retries=0)
+
+
+def _url(httpd) -> str:
+    return f"http://127.0.0.1:{httpd.server_port}/2024/communes/33/33063.csv"
+
+
+def test_premier_telechargement(serveur, session):
+    contenu, perime = dvf_http.fetch_cached(_url(serveur), session)
+    assert (contenu, perime) == (CONTENU, False)
+    with open(dvf_http._cache_paths(_url(serveur))[1], encoding="utf-8") as f:
+        assert json.load(f)["etag"] == ETAG
+    assert dvf_http.cache_validator(_url(serveur)) == ETAG
+
+
+def test_revalidation_304(serveur, session):
+    url = _url(serveur)
+    dvf_http.fetch_cached(url, session)
+    contenu, perime = dvf_http.fetch_cached(url, session, max_age=0)
+    assert (contenu, perime) == (CONTENU, False)
+    assert len(serveur.requetes) == 2
+    assert serveur.requetes[1].get("If-None-Match") == ETAG
+
+
+def test_copie_locale_sans_revalidation(serveur, session):
+    url = _url(serveur)
+    dvf_http.fetch_cached(url, session)
+    assert dvf_http.fetch_cached(url, session) == (CONTENU, False)
+    assert len(serveur.requetes) == 1
+
+
+def test_origine_injoignable_copie_perimee(serveur, session):
+    url = _url(serveur)
+    dvf_http.fetch_cached(url, session)
+    serveur.shutdown()
+    serveur.server_close()
+    contenu, perime = dvf_http.fetch_cached(url, session, max_age=0)
+    assert (contenu, perime) == (CONTENU, True)
+
+
+def test_origine_injoignable_sans_copie(serveur, session):
+    url = _url(serveur)
+    serveur.shutdown()
+    serveur.server_close()
+    with pytest.raises(requests.exceptions.RequestException):
+        dvf_http.fetch_cached(url, session)
+
+
+def test_origine_pas_retentee_apres_echec(serveur, session, monkeypatch):
+    url = _url(serveur)
+    dvf_http.fetch_cached(url, session)
+    serveur.shutdown()
+    serveur.server_close()
+    assert dvf_http.fetch_cached(url, session, max_age=0) == (CONTENU, True)
+
+    def get(*args, **kwargs):
+        raise AssertionError("origine retentée avant RETRY_AFTER")
+    monkeypatch.setattr(session, "get", get)
+    assert dvf_http.fetch_cached(url, session, max_age=0) == (CONTENU, True)
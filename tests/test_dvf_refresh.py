@@ -0,0 +1,82 @@
+# tests/test_dvf_refresh.py
+import pytest
+
+import dvf_data
+from benchmarks.generate_dvf import generate
+from dvf_refresh import SourceRefresher, validate
+
+
+@pytest.fixture
+def source_partagee(tmp_path, monkeypatch):
+    # Registre des sources vide pour le test ; fichiers modifiés pris en compte aussitôt
+    monkeypatch.setattr(dvf_data, "_instances", {})
+    monkeypatch.setattr(dvf_data, "FICHIER_STABLE", 0)
+    chemin = generate(3_000, str(tmp_path / "dvf.csv"))
+    source = dvf_data.get_source("csv", csv_path=chemin)
+    code = max(source.partitions(), key=lambda c: len(source.partitions()[c]))
+    source.commune_cube(code)
+    return chemin, source, code
+
+
+def test_source_modifiee_reconstruite_puis_publiee(source_partagee):
+    chemin, ancienne, code = source_partagee
+    refresher = SourceRefresher(interval=0)
+    assert refresher.run_once() == 0
+
+    generation = dvf_data.sources_generation()
+    generate(4_000, chemin, seed=1)
+    assert refresher.run_once() == 1
+
+    nouvelle = dvf_data.get_source("csv", csv_path=chemin)
+    assert nouvelle is not ancienne and nouvelle.loaded()
+    assert code in nouvelle.cached_communes()
+    assert nouvelle.row_count() > ancienne.row_count()
+    assert dvf_data.sources_generation() == generation + 1
+    resultat = refresher.last_results[("csv", (("csv_path", chemin),))]
+    assert resultat["publiee"] and resultat["motif"] == "changement"
+    assert refresher.run_once() == 0
+
+
+@pytest.mark.parametrize("lignes, motif", [(200, "ventes contre"), (0, "source vide")])
+def test_reconstruction_rejetee_garde_l_ancienne_instance(source_partagee, lignes, motif):
+    chemin, ancienne, _ = source_partagee
+    if lignes:
+        generate(lignes, chemin, seed=1)
+    else:
+        with open(chemin, "w") as f:
+            f.write(",".join(dvf_data.COLONNES_DVF) + "\n")
+    generation = dvf_data.sources_generation()
+    refresher = SourceRefresher(interval=0)
+    assert refresher.run_once() == 0
+
+    assert dvf_data.get_source("csv", csv_path=chemin) is ancienne
+    assert dvf_data.sources_generation() == generation
+    resultat = refresher.last_results[("csv", (("csv_path", chemin),))]
+    assert not resultat["publiee"] and motif in resultat["erreur"]
+    # Retentée au passage suivant, tant que le fichier n'a pas été corrigé
+    assert refresher.run_once() == 0
+    assert refresher.last_results[("csv", (("csv_path", chemin),))] is not resultat
+
+
+def test_swap_source_refuse_une_instance_deja_remplacee(source_partagee):
+    chemin, ancienne, _ = source_partagee
+    cle = ("csv", (("csv_path", chemin),))
+    premiere, seconde = dvf_data.new_source(cle), dvf_data.new_source(cle)
+    assert dvf_data.swap_source(cle, ancienne, premiere)
+    generation = dvf_data.sources_generation()
+    assert not dvf_data.swap_source(cle, ancienne, seconde)
+    assert dvf_data.get_source("csv", csv_path=chemin) is premiere
+    assert dvf_data.sources_generation() == generation
+
+
+def test_validation_copies_perimees(source_partagee):
+    _, ancienne, code = source_partagee
+
+    class Perimee(dvf_data.LocalCsvSource):
+        def is_stale(self, insee_code):
+            return insee_code == code
+
+    nouvelle = Perimee(ancienne.csv_path)
+    nouvelle.warm([code])
+    assert validate(nouvelle, [code], ancienne.row_count()) == f"copies périmées pour {code}"
+    assert validate(ancienne, [code], ancienne.row_count()) is None
@@ -0,0 +1,115 @@
+# tests/test_dvf_spatial.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from dvf_spatial import TAILLE_CELLULE_M, SpatialIndex, add_cell_keys, project
+
+# Point de départ des coordonnées planes des tests (Bordeaux)
+X0, Y0 = project(44.84, -0.58)
+
+
+def _ventes(x, y, surfaces=None, types=None) -> pd.DataFrame:
+    # Ventes placées en mètres dans la projection de l'index, relativement à (X0, Y0)
+    x, y = np.asarray(x, dtype="float64"), np.asarray(y, dtype="float64")
+    unite_x, unite_y = project(1.0, 1.0)
+    n = len(x)
+    return pd.DataFrame({
+        "code_commune": ["33063"] * n,
+        "latitude": (Y0 + y) / unite_y,
+        "longitude": (X0 + x) / unite_x,
+        "surface_reelle_bati": np.full(n, 80.0) if surfaces is None else surfaces,
+        "type_local": ["Maison"] * n if types is None else types,
+    })
+
+
+def _point(x: float, y: float):
+    unite_x, unite_y = project(1.0, 1.0)
+    return (Y0 + y) / unite_y, (X0 + x) / unite_x
+
+
+def _force_brute(df: pd.DataFrame, lat: float, lon: float, garde=None):
+    x, y = project(df["latitude"], df["longitude"])
+    qx, qy = project(lat, lon)
+    distances = np.hypot(x - qx, y - qy)
+    positions = np.flatnonzero(np.isfinite(distances))
+    if garde is not None:
+        positions = positions[garde(positions)]
+    ordre = np.argsort(distances[positions], kind="stable")
+    return positions[ordre], distances[positions][ordre]
+
+
+@pytest.fixture(scope="module")
+def ventes() -> pd.DataFrame:
+    rng = np.random.default_rng(7)
+    # Deux quartiers séparés par une zone sans ventes, et quelques ventes sans coordonnées
+    x = np.concatenate([rng.uniform(0, 2_000, 400), rng.uniform(6_000, 7_000, 200)])
+    y = np.concatenate([rng.uniform(0, 2_000, 400), rng.uniform(-500, 500, 200)])
+    df = _ventes(x, y, surfaces=rng.uniform(30, 200, 600),
+                 types=rng.choice(["Maison", "Appartement"], 600))
+    df.loc[rng.choice(600, 20, replace=False), ["latitude", "longitude"]] = np.nan
+    return add_cell_keys(df)
+
+
+POINTS = [(1_000, 1_000), (0, 0), (4_000, 300), (6_500, 0), (-5_000, 8_000), (30_000, -30_000)]
+
+
+@pytest.mark.parametrize("x, y", POINTS)
+@pytest.mark.parametrize("k", [1, 7, 100, 580, 10_000])
+def test_nearest_comme_force_brute(ventes, x, y, k):
+    index = SpatialIndex(ventes)
+    lat, lon = _point(x, y)
+    positions, distances = index.nearest(lat, lon, k)
+    attendues, distances_attendues = _force_brute(ventes, lat, lon)
+    assert index.n_localisees == 580
+    np.testing.assert_array_equal(positions, attendues[:k])
+    np.testing.assert_allclose(distances, distances_attendues[:k])
+
+
+@pytest.mark.parametrize("x, y", POINTS)
+def test_nearest_filtre_et_rayon_comme_force_brute(ventes, x, y):
+    index = SpatialIndex(ventes)
+    garde = index.comparable_filter("Appartement", 100, tolerance=0.25, exclure_aberrants=False)
+    lat, lon = _point(x, y)
+    attendues, distances_attendues = _force_brute(ventes, lat, lon, garde)
+    for k in (1, 10, 1_000):
+        positions, _ = index.nearest(lat, lon, k, garde)
+        np.testing.assert_array_equal(positions, attendues[:k])
+        positions, distances = index.nearest(lat, lon, k, garde, rayon_max=800)
+        dans_rayon = distances_attendues <= 800
+        np.testing.assert_array_equal(positions, attendues[dans_rayon][:k])
+        assert (distances <= 800).all()
+
+
+@pytest.mark.parametrize("x, y", POINTS)
+@pytest.mark.parametrize("rayon", [0, 50, 400, 2_500])
+def test_within_comme_force_brute(ventes, x, y, rayon):
+    index = SpatialIndex(ventes)
+    lat, lon = _point(x, y)
+    positions, distances = index.within(lat, lon, rayon)
+    attendues, distances_attendues = _force_brute(ventes, lat, lon)
+    np.testing.assert_array_equal(positions, attendues[distances_attendues <= rayon])
+    np.testing.assert_allclose(distances, distances_attendues[distances_attendues <= rayon])
+
+
+def test_nearest_continue_apres_le_premier_anneau_non_vide():
+    # Requête au centre d'une cellule : la vente du premier anneau non vide (coin
+    # opposé d'une cellule diagonale) est plus loin que celle de l'anneau suivant
+    c = TAILLE_CELLULE_M / 2
+    df = _ventes([2 * TAILLE_CELLULE_M - 10, 2 * TAILLE_CELLULE_M + 5],
+                 [2 * TAILLE_CELLULE_M - 10, c])
+    lat, lon = _point(c, c)
+    positions, distances = SpatialIndex(df).nearest(lat, lon, 1)
+    assert positions.tolist() == [1]
+    assert distances[0] == pytest.approx(2 * TAILLE_CELLULE_M + 5 - c)
+
+
+def test_index_sans_ventes_localisees():
+    lat, lon = _point(0, 0)
+    vides = [_ventes([], []), _ventes([np.nan, np.nan], [np.nan, np.nan])]
+    for df in vides:
+        index = SpatialIndex(df)
+        assert index.n_localisees == 0
+        for positions, distances in (index.nearest(lat, lon, 5), index.within(lat, lon, 1_000)):
+            assert len(positions) == 0 and len(distances) == 0
+    assert len(SpatialIndex(_ventes([0], [0])).nearest(lat, lon, 0)[0]) == 0